@@ -3,6 +3,7 @@ Main orchestrator for story generation system
 """
 import os
 import sys
+import threading
 from typing import Dict, Any, List, Optional
 
 from src.utils import (load_config, get_project_paths, ensure_project_directories, 
@@ -14,6 +15,19 @@ from src.outline_generator import OutlineGenerator
 from src.entity_manager import EntityManager
 from src.chapter_writer import ChapterWriter
 from src.post_processor import PostChapterProcessor
+from src.step_graph import Step, StepGraph
+from src.project_store import open_project_store
+
+
+# Chapter-writing context pieces that come from post-processing of earlier chapters,
+# with the step that produces each of them
+CONTEXT_PIECE_STEPS = {
+    'entities': "entity_extraction_chapter_{}",
+    'events': "event_extraction_{}",
+    'summaries': "summary_generation_{}",
+    'super_summary': "super_summary_update_{}",
+}
+PIPELINE_CONTEXT_PIECES = tuple(CONTEXT_PIECE_STEPS)
 
 
 class StoryGenerator:
@@ -48,6 +62,12 @@ class StoryGenerator:
         # Initialize LLM client
         self.llm_client = LLMClient(self.config, self.logger, self.cost_tracker)
         
+        # Optional SQLite store for entities/events/conflicts/summaries (None = JSON files)
+        self.store = open_project_store(self.config, self.paths, self.logger)
+        # Chapters whose post-processing writes are held in one store transaction
+        self._open_chapter_writes = set()
+        self._chapter_writes_lock = threading.Lock()
+        
         # Initialize modules
         self.motif_loader = MotifLoader(
             self.config['paths']['motif_file'],
@@ -65,14 +85,16 @@ class StoryGenerator:
             self.checkpoint,
             self.logger,
             self.config,
-            self.paths
+            self.paths,
+            store=self.store
         )
         self.post_processor = PostChapterProcessor(
             self.llm_client,
             self.checkpoint,
             self.logger,
             self.config,
-            self.paths
+            self.paths,
+            store=self.store
         )
         self.chapter_writer = ChapterWriter(
             self.llm_client,
@@ -88,6 +110,16 @@ class StoryGenerator:
         self.outline_generator.entity_manager = self.entity_manager
         self.outline_generator.post_processor = self.post_processor
         
+        # Pipelined batches: write chapter N+1 while chapter N is post-processed
+        story_config = self.config.get('story', {})
+        self.pipeline_chapters = story_config.get('pipeline_chapters', False)
+        stale_ok = set(story_config.get('pipeline_stale_context', []))
+        unknown = stale_ok - set(PIPELINE_CONTEXT_PIECES)
+        if unknown:
+            self.logger.warning(f"Unknown pipeline_stale_context entries ignored: {sorted(unknown)}")
+        # Any piece that must be fresh forces a wait for the previous chapter's post-processing
+        self.pipeline_fresh_context = [p for p in PIPELINE_CONTEXT_PIECES if p not in stale_ok]
+        
         self.logger.info(f"StoryGenerator initialized for project: {project_id}")
         self.logger.info(f"Project root: {self.paths['project_root']}")
     
@@ -136,44 +168,209 @@ class StoryGenerator:
         """
         self.logger.info(f"=== Generating Batch {batch_num} ===")
         
-        # Step 2: Generate outline
+        graph = self._new_step_graph()
+        outline_key = self.checkpoint.step_key("outline_generation", batch=batch_num)
+        
+        def outline_step(deps):
+            # Step 2: Generate outline, then add the steps that depend on its chapters
+            outlines = self.generate_outline(batch_num, motif, user_suggestions)
+            self._add_chapter_steps(graph, batch_num, outlines, motif)
+            return outlines
+        
+        graph.add(Step(outline_key, outline_step, task="outline_generation",
+                       done=lambda: self.checkpoint.is_step_completed("outline_generation", batch=batch_num)))
+        try:
+            graph.run()
+        finally:
+            # Keep whatever finished before a failure
+            for chapter_num in sorted(self._open_chapter_writes):
+                self._commit_chapter_writes(chapter_num)
+        self.entity_manager.flush_description_jobs()
+        
+        self.logger.info(f"=== Batch {batch_num} completed ===")
+    
+    def generate_outline(self, batch_num: int, motif: Dict[str, Any],
+                         user_suggestions: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Generate (or load) the outline for a batch."""
         if batch_num == 1:
-            outlines = self.outline_generator.generate_initial_outline(motif, batch_num)
-        else:
-            context = self._prepare_batch_context(batch_num, user_suggestions)
-            outlines = self.outline_generator.generate_continuation_outline(batch_num, context)
+            return self.outline_generator.generate_initial_outline(motif, batch_num)
+        context = self._prepare_batch_context(batch_num, user_suggestions)
+        return self.outline_generator.generate_continuation_outline(batch_num, context)
+    
+    def _new_step_graph(self) -> StepGraph:
+        scheduler_config = self.config.get('scheduler', {})
+        return StepGraph(
+            self.logger,
+            self.llm_client.model_for_task,
+            max_workers=scheduler_config.get('max_workers', 8),
+            model_concurrency=scheduler_config.get('model_concurrency', {})
+        )
+    
+    def _add_chapter_steps(self, graph: StepGraph, batch_num: int,
+                           outlines: List[Dict[str, Any]], motif: Dict[str, Any]):
+        """
+        Add outline-entity, chapter-writing and post-processing steps for a batch.
+        
+        Dependencies per chapter N:
+          - writing N needs writing N-1 (previous chapter end) and the outline entities,
+            plus each context piece from chapter N-1, or from N-2 for pieces listed in
+            `story.pipeline_stale_context` when `story.pipeline_chapters` is enabled
+          - entity/event/conflict extraction and summary need writing N
+            (chained one after another unless `story.parallel_post_processing`)
+          - conflict extraction N needs conflict extraction N-1 (it updates open conflicts)
+          - with `story.combined_analysis`, one chapter_analysis step (after writing N and
+            conflict extraction N-1) records all four sections first; the individual steps
+            then only call the LLM for sections it could not parse
+          - super summary N needs all of chapter N's post-processing and super summary N-1
+        
+        With the SQLite store, chapter N's post-processing writes are committed together
+        by the super summary step (see `_begin_chapter_writes`).
+        """
+        entities_key = self.checkpoint.step_key(f"entity_extraction_batch_{batch_num}", batch=batch_num)
+        graph.add(Step(
+            entities_key,
+            lambda deps: self.entity_manager.extract_entities_from_outlines(outlines, batch_num),
+            deps=[self.checkpoint.step_key("outline_generation", batch=batch_num)],
+            task="entity_extraction",
+            done=lambda: self.checkpoint.is_step_completed(f"entity_extraction_batch_{batch_num}", batch=batch_num)
+        ))
         
-        # Step 3-4: Extract entities from outlines
-        self.entity_manager.extract_entities_from_outlines(outlines, batch_num)
+        chapter_nums = [o.get('chapter_number') for o in outlines]
+        
+        def step_in_batch(template: str, index: int) -> List[str]:
+            # Steps of earlier batches already finished before this graph ran
+            return [template.format(chapter_nums[index])] if index >= 0 else []
         
-        # Step 5: Write each chapter
         for i, chapter_outline in enumerate(outlines):
-            chapter_num = chapter_outline.get('chapter_number')
-            # Get next chapter outline if exists
+            chapter_num = chapter_nums[i]
             next_chapter_outline = outlines[i + 1] if i + 1 < len(outlines) else None
-            self._generate_chapter(chapter_num, chapter_outline, motif, next_chapter_outline)
+            write_key = f"chapter_writing_{chapter_num}"
+            
+            write_deps = [entities_key] + step_in_batch("chapter_writing_{}", i - 1)
+            for piece, template in CONTEXT_PIECE_STEPS.items():
+                lag = 2 if self.pipeline_chapters and piece not in self.pipeline_fresh_context else 1
+                write_deps += step_in_batch(template, i - lag)
+            
+            graph.add(Step(
+                write_key,
+                lambda deps, n=chapter_num, o=chapter_outline, nx=next_chapter_outline:
+                    self._write_chapter(n, o, motif, nx),
+                deps=sorted(set(write_deps)),
+                task="chapter_writing",
+                done=lambda n=chapter_num: self.checkpoint.is_step_completed(f"chapter_writing_{n}", chapter=n)
+            ))
+            
+            post_steps = [
+                (f"entity_extraction_chapter_{chapter_num}", self.entity_manager.extract_entities_from_chapter,
+                 "entity_extraction", []),
+                (f"event_extraction_{chapter_num}", self.post_processor.extract_events,
+                 "event_extraction", []),
+                (f"conflict_extraction_{chapter_num}", self.post_processor.extract_conflicts,
+                 "conflict_extraction", step_in_batch("conflict_extraction_{}", i - 1)),
+                (f"summary_generation_{chapter_num}", self.post_processor.generate_summary,
+                 "summary_generation", []),
+            ]
+            analysis_deps = []
+            if self.post_processor.combined_analysis:
+                analysis_deps = [f"chapter_analysis_{chapter_num}"]
+                graph.add(Step(
+                    analysis_deps[0],
+                    lambda deps, w=write_key, n=chapter_num:
+                        self._chapter_step(n, self.post_processor.analyze_chapter, deps[w], n, self.entity_manager),
+                    deps=[write_key] + step_in_batch("conflict_extraction_{}", i - 1),
+                    task="chapter_analysis",
+                    done=lambda n=chapter_num: self.checkpoint.is_step_completed(f"chapter_analysis_{n}", chapter=n)
+                ))
+            previous = None
+            for key, fn, task, extra_deps in post_steps:
+                deps = [write_key] + extra_deps + analysis_deps
+                if not self.post_processor.parallel and previous:
+                    deps.append(previous)
+                graph.add(Step(
+                    key,
+                    lambda deps, fn=fn, w=write_key, n=chapter_num: self._chapter_step(n, fn, deps[w], n),
+                    deps=deps,
+                    task=task,
+                    done=lambda key=key, n=chapter_num: self.checkpoint.is_step_completed(key, chapter=n)
+                ))
+                previous = key
+            
+            graph.add(Step(
+                f"super_summary_update_{chapter_num}",
+                lambda deps, n=chapter_num: self._finish_chapter(n),
+                deps=[key for key, _, _, _ in post_steps] + step_in_batch("super_summary_update_{}", i - 1),
+                task="summary_generation",
+                done=lambda n=chapter_num: self.checkpoint.is_step_completed(f"super_summary_update_{n}", chapter=n)
+            ))
+    
+    def _finish_chapter(self, chapter_num: int) -> str:
+        """Update the super summary and record progress once a chapter is fully processed."""
+        super_summary = self.post_processor.update_super_summary(chapter_num)
+        self._commit_chapter_writes(chapter_num)
+        self.checkpoint.update_progress(
+            batch=(chapter_num - 1) // 5 + 1,
+            chapter=chapter_num
+        )
+        self.logger.info(f"--- Chapter {chapter_num} completed ---")
+        return super_summary
+    
+    def _chapter_step(self, chapter_num: int, fn, *args):
+        """Run one post-processing step of a chapter inside the chapter's store transaction."""
+        self._begin_chapter_writes(chapter_num)
+        return fn(*args)
+    
+    def _begin_chapter_writes(self, chapter_num: int):
+        """
+        Hold the chapter's store writes in one transaction (SQLite backend only).
         
-        self.logger.info(f"=== Batch {batch_num} completed ===")
+        The chapter's checkpoint marks are held as well, so a crash before
+        `_commit_chapter_writes` loses both and the chapter is post-processed again.
+        """
+        if self.store is None:
+            return
+        with self._chapter_writes_lock:
+            if chapter_num in self._open_chapter_writes:
+                return
+            self._open_chapter_writes.add(chapter_num)
+        self.checkpoint.hold_chapter(chapter_num)
+        self.store.begin_chapter(chapter_num)
+    
+    def _commit_chapter_writes(self, chapter_num: int):
+        """Commit the chapter's store writes, then persist its checkpoint marks."""
+        if self.store is None:
+            return
+        with self._chapter_writes_lock:
+            if chapter_num not in self._open_chapter_writes:
+                return
+            self._open_chapter_writes.discard(chapter_num)
+        self.checkpoint.release_chapters(self.store.end_chapter(chapter_num))
     
-    def _generate_chapter(self, chapter_num: int, chapter_outline: Dict[str, Any],
-                         motif: Dict[str, Any], next_chapter_outline: Optional[Dict[str, Any]] = None):
-        """Generate a single chapter with all processing."""
+    def _write_chapter(self, chapter_num: int, chapter_outline: Dict[str, Any],
+                       motif: Dict[str, Any], next_chapter_outline: Optional[Dict[str, Any]] = None) -> str:
+        """Prepare context and write a single chapter."""
         self.logger.info(f"--- Generating Chapter {chapter_num}: {chapter_outline.get('title')} ---")
         
         # Prepare context for chapter writing
         context = self._prepare_chapter_context(chapter_num, chapter_outline, motif, next_chapter_outline)
         
         # Write chapter
-        chapter_content = self.chapter_writer.write_chapter(chapter_outline, context)
-        
-        # Post-processing
+        return self.chapter_writer.write_chapter(chapter_outline, context)
+    
+    def _post_process_chapter(self, chapter_num: int, chapter_content: str) -> Dict[str, Any]:
+        """Run all post-processing for one written chapter (outside the step graph) and record progress."""
         self.logger.info(f"Post-processing chapter {chapter_num}")
         
-        # Extract new entities from chapter
-        self.entity_manager.extract_entities_from_chapter(chapter_content, chapter_num)
-        
-        # Extract events, conflicts, summaries
-        post_data = self.post_processor.process_chapter(chapter_content, chapter_num)
+        # Extract new entities, events, conflicts, summaries
+        self._begin_chapter_writes(chapter_num)
+        try:
+            if self.post_processor.combined_analysis:
+                self.post_processor.analyze_chapter(chapter_content, chapter_num, self.entity_manager)
+            post_data = self.post_processor.process_chapter(
+                chapter_content, chapter_num,
+                entity_extractor=self.entity_manager.extract_entities_from_chapter
+            )
+        finally:
+            self._commit_chapter_writes(chapter_num)
         
         # Update checkpoint progress
         self.checkpoint.update_progress(
@@ -182,6 +379,7 @@ class StoryGenerator:
         )
         
         self.logger.info(f"--- Chapter {chapter_num} completed ---")
+        return post_data
     
     def _prepare_chapter_context(self, chapter_num: int, chapter_outline: Dict[str, Any],
                                  motif: Dict[str, Any], next_chapter_outline: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
@@ -192,7 +390,7 @@ class StoryGenerator:
         # Get related characters
         character_names = [c.get('name') for c in chapter_outline.get('characters', [])]
         related_characters = [
-            e for e in self.entity_manager.entities.get('characters', [])
+            e for e in self.entity_manager.snapshot(['characters'])['characters']
             if e.get('name') in character_names
         ]
         
@@ -230,8 +428,8 @@ class StoryGenerator:
         recent_summary = self.post_processor.get_recent_summaries(count=1)
         recent_summary = recent_summary[0] if recent_summary else ''
         
-        # Get active conflicts from previous batch
-        active_conflicts = self.post_processor.get_unresolved_conflicts()
+        # Active conflicts this batch should address, picked by timeline from the registry
+        active_conflicts = self._select_conflicts_for_batch(batch_num)
         
         # From active conflicts, find related characters and entities
         related_characters = self._get_characters_from_conflicts(active_conflicts)
@@ -252,34 +450,20 @@ class StoryGenerator:
     
     def _get_relevant_events(self, chapter_outline: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Get events relevant to chapter."""
-        # Get all events, sorted by importance
-        all_events = sorted(
-            self.post_processor.events,
-            key=lambda x: x.get('importance', 0),
-            reverse=True
-        )
-        
-        # Filter by characters involved
-        character_names = [c.get('name') for c in chapter_outline.get('characters', [])]
-        relevant = []
-        
-        for event in all_events:
-            characters_involved = event.get('characters_involved', [])
-            if any(char in characters_involved for char in character_names):
-                relevant.append(event)
-        
-        return relevant[:10]  # Top 10 relevant events
+        # Top 10 events involving the chapter's characters, by importance
+        character_names = [c.get('name') for c in chapter_outline.get('characters', []) if c.get('name')]
+        return self.post_processor.get_top_events(10, characters=character_names)
     
     def _get_top_characters(self, limit: int = 15) -> List[Dict[str, Any]]:
         """Get top characters by importance/frequency."""
         # For simplicity, return all main characters
         # Could be enhanced with frequency tracking
-        return self.entity_manager.entities.get('characters', [])[:limit]
+        return self.entity_manager.snapshot(['characters'])['characters'][:limit]
     
     def _get_top_entities(self, limit: int = 20) -> List[Dict[str, Any]]:
         """Get top entities across all categories."""
         all_entities = []
-        for category, entities in self.entity_manager.entities.items():
+        for category, entities in self.entity_manager.snapshot().items():
             for entity in entities:
                 all_entities.append({**entity, 'category': category})
         
@@ -288,36 +472,38 @@ class StoryGenerator:
     
     def _get_top_events(self, limit: int = 15) -> List[Dict[str, Any]]:
         """Get top events by importance."""
-        sorted_events = sorted(
-            self.post_processor.events,
-            key=lambda x: x.get('importance', 0),
-            reverse=True
-        )
-        return sorted_events[:limit]
+        return self.post_processor.get_top_events(limit)
     
     def _select_conflicts_for_batch(self, batch_num: int, 
-                                    all_conflicts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+                                    all_conflicts: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
         """
         Select conflicts that should be addressed in this batch.
         
-        Prioritize based on timeline and when they were introduced.
+        Prioritize based on timeline and when they were introduced. Without
+        all_conflicts, active conflicts are taken from the conflict registry.
         """
+        if all_conflicts is None:
+            by_timeline = self.post_processor.get_conflicts_by_timeline
+        else:
+            grouped: Dict[str, List[Dict[str, Any]]] = {}
+            for c in all_conflicts:
+                grouped.setdefault(c.get('timeline'), []).append(c)
+            by_timeline = lambda timeline: grouped.get(timeline, [])
+        
         selected = []
         
         # Always include immediate conflicts
-        immediate = [c for c in all_conflicts if c.get('timeline') == 'immediate']
-        selected.extend(immediate)
+        selected.extend(by_timeline('immediate'))
         
         # Include batch-level conflicts
-        batch_conflicts = [c for c in all_conflicts if c.get('timeline') == 'batch']
-        selected.extend(batch_conflicts)
+        selected.extend(by_timeline('batch'))
         
         # Include some short-term conflicts
-        short_term = [c for c in all_conflicts if c.get('timeline') == 'short_term']
-        selected.extend(short_term[:2])
+        selected.extend(by_timeline('short_term')[:2])
         
-        # Include awareness of medium/long-term conflicts
-        medium_term = [c for c in all_conflicts if c.get('timeline') in ['medium_term', 'long_term']]
+        # Include awareness of medium/long-term (and epic) conflicts
+        medium_term = by_timeline('medium_term') + by_timeline('long_term') + by_timeline('epic')
+        medium_term.sort(key=lambda c: c.get('introduced_chapter') or 0)
         selected.extend(medium_term[:2])
         
         return selected
@@ -357,22 +543,11 @@ class StoryGenerator:
     def _get_events_from_characters_entities(self, characters: List[Dict[str, Any]], 
                                             entities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Get events related to characters and entities."""
-        character_names = {c.get('name') for c in characters}
-        entity_names = {e.get('name') for e in entities}
-        
-        related_events = []
-        for event in self.post_processor.events:
-            # Check if event involves any of the characters
-            event_chars = set(event.get('characters_involved', []))
-            # Check if event involves any of the entities
-            event_entities = set(event.get('entities_involved', []))
-            
-            if event_chars.intersection(character_names) or event_entities.intersection(entity_names):
-                related_events.append(event)
+        character_names = [c.get('name') for c in characters if c.get('name')]
+        entity_names = [e.get('name') for e in entities if e.get('name')]
         
-        # Sort by importance and return top events
-        related_events.sort(key=lambda x: x.get('importance', 0), reverse=True)
-        return related_events[:20]
+        # Top 20 events involving any of them, by importance
+        return self.post_processor.get_top_events(20, characters=character_names, entities=entity_names)
     
     def _save_final_summary(self):
         """Save final cost and progress summary."""
@@ -5,13 +5,29 @@ Individual step scripts for story generation.
 This file contains scripts that can be run independently to execute specific steps.
 """
 import argparse
+import os
+import re
+import shutil
 import sys
 from main import StoryGenerator
+from src.checkpoint import CheckpointManager
+from src.llm_cache import CacheMiss
+from src.llm_replay import ReplayIndex
+from src.utils import load_config, get_project_paths
+
+
+def _make_generator(args) -> StoryGenerator:
+    """StoryGenerator for --story-id; with --replay-from, LLM calls are served from that project's request logs."""
+    generator = StoryGenerator(config_path=args.config, project_id=args.story_id)
+    if getattr(args, 'replay_from', None):
+        source_paths = get_project_paths(args.replay_from, generator.config)
+        generator.llm_client.use_replay(ReplayIndex(source_paths['llm_logs_dir'], generator.logger))
+    return generator
 
 
 def run_generate_outline(args):
     """Generate outline for a specific batch."""
-    generator = StoryGenerator(config_path=args.config, story_id=args.story_id)
+    generator = _make_generator(args)
     
     motif = generator.checkpoint.get_metadata('motif')
     if not motif:
@@ -21,18 +37,14 @@ def run_generate_outline(args):
             motif = generator.motif_loader.get_random_motif(args.genre)
         generator.checkpoint.set_metadata('motif', motif)
     
-    if args.batch == 1:
-        outlines = generator.outline_generator.generate_initial_outline(motif, args.batch)
-    else:
-        context = generator._prepare_batch_context(args.batch, args.user_input)
-        outlines = generator.outline_generator.generate_continuation_outline(args.batch, context)
+    outlines = generator.generate_outline(args.batch, motif, args.user_input)
     
     print(f"✓ Generated outline for batch {args.batch} with {len(outlines)} chapters")
 
 
 def run_extract_entities(args):
     """Extract entities from outlines for a specific batch."""
-    generator = StoryGenerator(config_path=args.config, story_id=args.story_id)
+    generator = _make_generator(args)
     
     # Load outlines
     outlines = generator.outline_generator._load_outline(args.batch)
@@ -46,7 +58,7 @@ def run_extract_entities(args):
 
 def run_write_chapter(args):
     """Write a specific chapter."""
-    generator = StoryGenerator(config_path=args.config, story_id=args.story_id)
+    generator = _make_generator(args)
     
     # Load outline for this chapter
     batch = (args.chapter - 1) // 5 + 1
@@ -79,18 +91,15 @@ def run_write_chapter(args):
 
 def run_process_chapter(args):
     """Post-process a specific chapter."""
-    generator = StoryGenerator(config_path=args.config, story_id=args.story_id)
+    generator = _make_generator(args)
     
     # Load chapter
     chapter_content = generator.chapter_writer._load_chapter(args.chapter)
     
-    # Extract entities
-    print(f"Extracting entities from chapter {args.chapter}...")
-    new_entities = generator.entity_manager.extract_entities_from_chapter(chapter_content, args.chapter)
-    
-    # Process chapter
+    # Extract entities, events, conflicts, summary
     print(f"Processing chapter {args.chapter}...")
-    post_data = generator.post_processor.process_chapter(chapter_content, args.chapter)
+    post_data = generator._post_process_chapter(args.chapter, chapter_content)
+    new_entities = post_data['entities'] or {}
     
     print(f"✓ Post-processed chapter {args.chapter}")
     print(f"  New entities: {sum(len(v) for v in new_entities.values())}")
@@ -100,7 +109,7 @@ def run_process_chapter(args):
 
 def run_generate_batch(args):
     """Generate a complete batch."""
-    generator = StoryGenerator(config_path=args.config, story_id=args.story_id)
+    generator = _make_generator(args)
     
     motif = generator.checkpoint.get_metadata('motif')
     if not motif:
@@ -114,6 +123,60 @@ def run_generate_batch(args):
     print(f"✓ Completed batch {args.batch}")
 
 
+def run_export(args):
+    """Export project state from the SQLite store to the JSON files."""
+    generator = _make_generator(args)
+    
+    if generator.store is None:
+        print("✓ Storage backend is JSON; files are already up to date")
+        return
+    
+    for path in generator.store.export_json(generator.paths):
+        print(f"✓ Exported {path}")
+
+
+def run_rebuild(args):
+    """Rebuild a project's entities/events/conflicts/summaries from its recorded LLM responses."""
+    config = load_config(args.config)
+    source_paths = get_project_paths(args.story_id, config)
+    target_id = args.into or f"{args.story_id}_rebuild"
+    target_paths = get_project_paths(target_id, config)
+    if os.path.exists(target_paths['project_root']):
+        print(f"✗ Project {target_id} already exists; choose another --into")
+        return
+    
+    # Outlines and chapters are copied as-is; everything derived from them is recomputed
+    shutil.copytree(source_paths['outlines_dir'], target_paths['outlines_dir'])
+    shutil.copytree(source_paths['chapters_dir'], target_paths['chapters_dir'],
+                    ignore=shutil.ignore_patterns('*.partial'))
+    
+    generator = StoryGenerator(config_path=args.config, project_id=target_id)
+    replay = ReplayIndex(source_paths['llm_logs_dir'], generator.logger)
+    generator.llm_client.use_replay(replay)
+    
+    motif = CheckpointManager(source_paths['checkpoints_dir'], args.story_id).get_metadata('motif')
+    generator.checkpoint.set_metadata('motif', motif)
+    
+    batches = sorted(int(m.group(1)) for m in
+                     (re.match(r'batch_(\d+)_outline\.json$', f) for f in os.listdir(target_paths['outlines_dir'])) if m)
+    for batch in batches:
+        generator.checkpoint.mark_step_completed("outline_generation", batch=batch)
+        for outline in generator.outline_generator._load_outline(batch):
+            chapter = outline.get('chapter_number')
+            if os.path.exists(os.path.join(target_paths['chapters_dir'], f'chapter_{chapter:03d}.txt')):
+                generator.checkpoint.mark_step_completed(f"chapter_writing_{chapter}", chapter=chapter)
+    
+    for batch in batches:
+        try:
+            generator.generate_batch(batch, motif)
+        except CacheMiss as e:
+            print(f"✗ Stopped in batch {batch}: {e}")
+            break
+        print(f"✓ Rebuilt batch {batch}")
+    
+    print(f"✓ Rebuilt into project {target_id} (replay: {replay.stats()})")
+
+
 def main():
     """Main entry point for individual scripts."""
     parser = argparse.ArgumentParser(description="Run individual story generation steps")
@@ -123,6 +186,8 @@ def main():
     common = argparse.ArgumentParser(add_help=False)
     common.add_argument('--story-id', default='story_001', help='Story identifier')
     common.add_argument('--config', default='config/config.yaml', help='Config file path')
+    common.add_argument('--replay-from', metavar='PROJECT_ID',
+                        help="Serve LLM calls from this project's logs/llm_requests instead of the API")
     
     # Generate outline
     outline_parser = subparsers.add_parser('outline', parents=[common], help='Generate outline for a batch')
@@ -155,6 +220,16 @@ def main():
     batch_parser.add_argument('--user-input', help='User suggestions (for batch 2+)')
     batch_parser.set_defaults(func=run_generate_batch)
     
+    # Export JSON
+    export_parser = subparsers.add_parser('export', parents=[common], help='Export SQLite project state to JSON files')
+    export_parser.set_defaults(func=run_export)
+    
+    # Rebuild derived state offline
+    rebuild_parser = subparsers.add_parser('rebuild', parents=[common],
+                                           help='Rebuild entities/events/conflicts/summaries from recorded LLM responses')
+    rebuild_parser.add_argument('--into', metavar='PROJECT_ID', help='Target project (default: {story-id}_rebuild)')
+    rebuild_parser.set_defaults(func=run_rebuild)
+    
     args = parser.parse_args()
     
     if not args.command:
@@ -2,6 +2,7 @@
 Step 5: Chapter content writer
 """
 import os
+import time
 from typing import Dict, Any, List, Optional
 from src.prompts.generate_prompt import WRITING_SYSTEM_PROMPT
 from src.utils import save_text, load_text, save_json, load_json
@@ -20,6 +21,8 @@ class ChapterWriter:
         self.post_processor = post_processor
         self.target_words = config['story']['target_words_per_chapter']
         self.last_chapter_chars = config['story']['last_chapter_context_chars']
+        self.stream_chapters = config['story'].get('stream_chapters', False)
+        self.stream_resume_attempts = config['story'].get('stream_resume_attempts', 2)
     
     def write_chapter(self, chapter_outline: Dict[str, Any], context: Dict[str, Any]) -> str:
         """
@@ -53,19 +56,22 @@ class ChapterWriter:
         prompt = self._create_writing_prompt(chapter_outline, context)
         
         system_message = WRITING_SYSTEM_PROMPT
-        # Call LLM with chapter_id
-        result = self.llm_client.call(
-            prompt=prompt,
-            task_name="chapter_writing",
-            system_message=system_message,
-            max_tokens=8000,  # Allow longer output
-            chapter_id=chapter_num
-        )
-        
-        chapter_content = result['response']
+        if self.stream_chapters:
+            chapter_content = self._stream_chapter(prompt, system_message, chapter_num)
+        else:
+            # Call LLM with chapter_id
+            result = self.llm_client.call(
+                prompt=prompt,
+                task_name="chapter_writing",
+                system_message=system_message,
+                max_tokens=8000,  # Allow longer output
+                chapter_id=chapter_num
+            )
+            chapter_content = result['response']
         
         # Save chapter
         self._save_chapter(chapter_content, chapter_num, chapter_outline.get('title', ''))
+        self._remove_partial(chapter_num)
         
         # Mark as completed
         self.checkpoint.mark_step_completed(
@@ -79,6 +85,78 @@ class ChapterWriter:
         
         return chapter_content
     
+    def _stream_chapter(self, prompt: str, system_message: str, chapter_num: int) -> str:
+        """
+        Stream chapter content, appending chunks to chapter_XXX.txt.partial as they arrive.
+        
+        If the stream drops midway, the text received so far is kept and the model is
+        asked to continue from where it stopped (up to `stream_resume_attempts` times).
+        A leftover .partial file from an interrupted run is resumed the same way.
+        The request log and cache get the assembled chapter under the original prompt;
+        a chapter served from cache/replay replaces the partial text instead.
+        """
+        partial_file = self._partial_path(chapter_num)
+        os.makedirs(os.path.dirname(partial_file), exist_ok=True)
+        written = load_text(partial_file) if os.path.exists(partial_file) else ""
+        if written:
+            self.logger.info(f"Resuming chapter {chapter_num} from partial file ({len(written)} chars)")
+        
+        attempts = 0
+        while True:
+            start_time = time.time()
+            first_token_logged = False
+            info = {}
+            try:
+                with open(partial_file, 'a', encoding='utf-8') as f:
+                    for chunk in self.llm_client.stream(
+                        prompt=prompt,
+                        task_name="chapter_writing",
+                        system_message=system_message,
+                        max_tokens=8000,
+                        chapter_id=chapter_num,
+                        resume_text=written,
+                        resume_prompt=self._create_continuation_prompt(prompt, written) if written else None,
+                        info=info
+                    ):
+                        if not first_token_logged:
+                            self.logger.info(f"Chapter {chapter_num}: first token after {time.time() - start_time:.2f}s")
+                            first_token_logged = True
+                        if info.get('cached') and written:
+                            # Complete chapter from cache/replay: no continuation needed
+                            f.truncate(0)
+                            written = ""
+                        f.write(chunk)
+                        f.flush()
+                        written += chunk
+                self.logger.info(f"Chapter {chapter_num}: stream finished in {time.time() - start_time:.2f}s ({len(written)} chars)")
+                return written
+            except Exception as e:
+                attempts += 1
+                if attempts > self.stream_resume_attempts:
+                    raise
+                self.logger.warning(
+                    f"Chapter {chapter_num}: stream interrupted after {len(written)} chars ({e}), "
+                    f"resuming ({attempts}/{self.stream_resume_attempts})"
+                )
+    
+    def _create_continuation_prompt(self, prompt: str, written: str) -> str:
+        """Ask the model to continue an interrupted chapter without repeating it."""
+        tail = written[-self.last_chapter_chars:]
+        return f"""{prompt}
+**PHẦN ĐÃ VIẾT (bị ngắt giữa chừng), đoạn cuối:**
+{tail}
+
+Hãy viết tiếp chương ngay từ chỗ bị ngắt, không lặp lại nội dung đã viết, không viết lại tiêu đề.
+"""
+    
+    def _partial_path(self, chapter_num: int) -> str:
+        return os.path.join(self.paths['chapters_dir'], f'chapter_{chapter_num:03d}.txt.partial')
+    
+    def _remove_partial(self, chapter_num: int):
+        partial_file = self._partial_path(chapter_num)
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+    
     def _create_writing_prompt(self, chapter_outline: Dict[str, Any], context: Dict[str, Any]) -> str:
         """Create detailed writing prompt without duplicate information."""
         chapter_num = chapter_outline.get('chapter_number', 0)
@@ -289,8 +367,9 @@ Chương {chapter_num}: {title}
             # Handle description as array or string
             desc = e.get('description', '')
             if isinstance(desc, list):
-                # Join all descriptions with "; " separator
-                desc_text = "; ".join(desc[-10:]) if desc else ""
+                # Canonical (compacted) description first, then the recent ones
+                canonical = e.get('canonical_description', '')
+                desc_text = "; ".join(([canonical] if canonical else []) + desc[-10:])
             else:
                 desc_text = desc
 
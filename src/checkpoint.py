@@ -1,9 +1,21 @@
 """
 Checkpoint manager for resumable story generation.
+
+State is kept as a snapshot (`{story_id}_checkpoint.json`) plus an append-only
+journal (`{story_id}_checkpoint.journal.jsonl`). Every change appends one small
+JSON line to the journal instead of rewriting the whole snapshot; the journal is
+folded into a new snapshot (written to a temp file and renamed into place) once
+it grows past `compact_every` entries. On load the snapshot is read and the
+journal replayed on top of it; a line truncated by a crash is ignored.
+
+Step marks of a held chapter (`hold_chapter()`) take effect in memory right away
+but reach disk only on `release_chapters()`, so with the SQLite store a chapter is
+never recorded as done before its writes are committed.
 """
 import os
 import json
-from typing import Any, Dict, Optional
+import threading
+from typing import Any, Dict, Iterable, List, Optional
 from datetime import datetime
 from src.utils import save_json, load_json
 
@@ -11,20 +23,27 @@ from src.utils import save_json, load_json
 class CheckpointManager:
     """Manage checkpoints for resumable execution."""
     
-    def __init__(self, checkpoint_dir: str, story_id: str):
+    def __init__(self, checkpoint_dir: str, story_id: str, compact_every: int = 500):
         self.checkpoint_dir = checkpoint_dir
         self.story_id = story_id
         self.checkpoint_file = os.path.join(
-            checkpoint_dir, 
+            checkpoint_dir,
             f"{story_id}_checkpoint.json"
         )
+        self.journal_file = os.path.join(
+            checkpoint_dir,
+            f"{story_id}_checkpoint.journal.jsonl"
+        )
+        self.compact_every = compact_every
         os.makedirs(checkpoint_dir, exist_ok=True)
+        # Post-processing steps may complete concurrently (see StepGraph)
+        self._lock = threading.RLock()
+        self._journal_entries = 0
+        # Journal entries of held chapters, written on release
+        self._held: Dict[int, List[Dict[str, Any]]] = {}
         self.state = self._load_checkpoint()
     
-    def _load_checkpoint(self) -> Dict[str, Any]:
-        """Load checkpoint from file."""
-        if os.path.exists(self.checkpoint_file):
-            return load_json(self.checkpoint_file)
+    def _new_state(self) -> Dict[str, Any]:
         return {
             'story_id': self.story_id,
             'created_at': datetime.now().isoformat(),
@@ -35,35 +54,123 @@ class CheckpointManager:
             'metadata': {}
         }
     
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        """Load snapshot and replay the journal on top of it."""
+        state = load_json(self.checkpoint_file) if os.path.exists(self.checkpoint_file) else self._new_state()
+        self._journal_entries = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Partial last line from a crash mid-write
+                        continue
+                    self._apply(state, entry)
+                    self._journal_entries += 1
+        return state
+    
+    @staticmethod
+    def _apply(state: Dict[str, Any], entry: Dict[str, Any]):
+        """Apply one journal entry to a state dict."""
+        op = entry.get('op')
+        if op == 'step':
+            state['completed_steps'][entry['key']] = {
+                'completed_at': entry['at'],
+                'metadata': entry.get('metadata') or {}
+            }
+        elif op == 'progress':
+            state['current_batch'] = entry['batch']
+            state['current_chapter'] = entry['chapter']
+        elif op == 'meta':
+            state['metadata'][entry['key']] = entry['value']
+        else:
+            return
+        state['last_updated'] = entry['at']
+    
+    def _append(self, entry: Dict[str, Any], chapter: Optional[int] = None):
+        """Apply an entry in memory and append it to the journal (compacting when due)."""
+        with self._lock:
+            entry['at'] = datetime.now().isoformat()
+            self._apply(self.state, entry)
+            if chapter in self._held:
+                self._held[chapter].append(entry)
+                return
+            self._write_entry(entry)
+    
+    def _write_entry(self, entry: Dict[str, Any]):
+        with self._lock:
+            line = json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+            with open(self.journal_file, 'a', encoding='utf-8') as f:
+                # Start on a fresh line if the previous write was cut off
+                if f.tell() > 0 and not self._journal_ends_with_newline():
+                    f.write('\n')
+                f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_entries += 1
+            if self._journal_entries >= self.compact_every:
+                self.save_checkpoint()
+    
+    def _journal_ends_with_newline(self) -> bool:
+        with open(self.journal_file, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+    
     def save_checkpoint(self):
-        """Save current state to checkpoint file."""
-        self.state['last_updated'] = datetime.now().isoformat()
-        save_json(self.state, self.checkpoint_file)
+        """Write a full snapshot atomically and truncate the journal."""
+        with self._lock:
+            self.state['last_updated'] = datetime.now().isoformat()
+            state = self.state
+            held_keys = {e['key'] for entries in self._held.values() for e in entries if e['op'] == 'step'}
+            if held_keys:
+                # Held marks stay out of the snapshot until their chapter is released
+                state = dict(state, completed_steps={k: v for k, v in state['completed_steps'].items()
+                                                     if k not in held_keys})
+            save_json(state, self.checkpoint_file)
+            # Replaying entries already in the snapshot is harmless, so a crash
+            # between these two steps only costs a longer replay
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+            self._journal_entries = 0
     
-    def is_step_completed(self, step_name: str, batch: Optional[int] = None, 
+    def is_step_completed(self, step_name: str, batch: Optional[int] = None,
                           chapter: Optional[int] = None) -> bool:
         """Check if a step has been completed."""
         key = self._make_key(step_name, batch, chapter)
         return key in self.state['completed_steps']
     
-    def mark_step_completed(self, step_name: str, batch: Optional[int] = None, 
+    def mark_step_completed(self, step_name: str, batch: Optional[int] = None,
                            chapter: Optional[int] = None, metadata: Optional[Dict] = None):
         """Mark a step as completed."""
         key = self._make_key(step_name, batch, chapter)
-        self.state['completed_steps'][key] = {
-            'completed_at': datetime.now().isoformat(),
-            'metadata': metadata or {}
-        }
-        self.save_checkpoint()
+        self._append({'op': 'step', 'key': key, 'metadata': metadata or {}}, chapter=chapter)
     
-    def get_step_metadata(self, step_name: str, batch: Optional[int] = None, 
+    def hold_chapter(self, chapter: int):
+        """Keep the chapter's step marks off disk until `release_chapters()`."""
+        with self._lock:
+            self._held.setdefault(chapter, [])
+    
+    def release_chapters(self, chapters: Iterable[int]):
+        """Journal the step marks held for these chapters."""
+        with self._lock:
+            for chapter in chapters:
+                for entry in self._held.pop(chapter, []):
+                    self._write_entry(entry)
+    
+    def get_step_metadata(self, step_name: str, batch: Optional[int] = None,
                          chapter: Optional[int] = None) -> Optional[Dict]:
         """Get metadata for a completed step."""
         key = self._make_key(step_name, batch, chapter)
         step_data = self.state['completed_steps'].get(key)
         return step_data.get('metadata') if step_data else None
     
-    def _make_key(self, step_name: str, batch: Optional[int] = None, 
+    def step_key(self, step_name: str, batch: Optional[int] = None,
+                 chapter: Optional[int] = None) -> str:
+        """Public name of a step (used as node name by StepGraph)."""
+        return self._make_key(step_name, batch, chapter)
+    
+    def _make_key(self, step_name: str, batch: Optional[int] = None,
                   chapter: Optional[int] = None) -> str:
         """Create a unique key for a step."""
         if batch is not None and chapter is not None:
@@ -75,14 +182,11 @@ class CheckpointManager:
     
     def update_progress(self, batch: int, chapter: int):
         """Update current progress."""
-        self.state['current_batch'] = batch
-        self.state['current_chapter'] = chapter
-        self.save_checkpoint()
+        self._append({'op': 'progress', 'batch': batch, 'chapter': chapter})
     
     def set_metadata(self, key: str, value: Any):
         """Set metadata value."""
-        self.state['metadata'][key] = value
-        self.save_checkpoint()
+        self._append({'op': 'meta', 'key': key, 'value': value})
     
     def get_metadata(self, key: str, default: Any = None) -> Any:
         """Get metadata value."""
@@ -90,6 +194,9 @@ class CheckpointManager:
     
     def reset(self):
         """Reset checkpoint to initial state."""
-        if os.path.exists(self.checkpoint_file):
-            os.remove(self.checkpoint_file)
-        self.state = self._load_checkpoint()
+        with self._lock:
+            for path in (self.checkpoint_file, self.journal_file):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._held.clear()
+            self.state = self._load_checkpoint()
@@ -0,0 +1,99 @@
+"""
+Conflict registry: id lookup, status/timeline indexes and status history.
+
+ConflictRegistry wraps the conflict list kept by PostChapterProcessor
+(conflicts are only ever appended; updates change them in place) and maintains:
+
+  - id -> position (ids are unique for conflicts added through the registry)
+  - status -> positions, (status, timeline) -> positions
+  - introduced chapter -> positions
+
+Every conflict carries a `status_history` list of {"status", "chapter"}
+entries, oldest first, recording each status transition.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+
+class ConflictRegistry:
+    """Indexed view over an append-only conflict list."""
+
+    def __init__(self, conflicts: List[Dict[str, Any]]):
+        self.conflicts = conflicts
+        self._by_id: Dict[str, int] = {}
+        self._by_status: Dict[Any, Set[int]] = {}
+        self._by_status_timeline: Dict[Tuple[Any, Any], Set[int]] = {}
+        self._by_chapter: Dict[Any, List[int]] = {}
+        for position, conflict in enumerate(conflicts):
+            # Older data may contain duplicate ids; the first one keeps the id (as the old linear scan did)
+            self._by_id.setdefault(str(conflict.get('id')), position)
+            self._index_status(position, conflict)
+            self._by_chapter.setdefault(conflict.get('introduced_chapter'), []).append(position)
+
+    def _index_status(self, position: int, conflict: Dict[str, Any]):
+        status, timeline = conflict.get('status'), conflict.get('timeline')
+        self._by_status.setdefault(status, set()).add(position)
+        self._by_status_timeline.setdefault((status, timeline), set()).add(position)
+
+    def _unindex_status(self, position: int, conflict: Dict[str, Any]):
+        status, timeline = conflict.get('status'), conflict.get('timeline')
+        self._by_status.get(status, set()).discard(position)
+        self._by_status_timeline.get((status, timeline), set()).discard(position)
+
+    def _select(self, positions: Iterable[int]) -> List[Dict[str, Any]]:
+        return [self.conflicts[pos] for pos in sorted(positions)]
+
+    def allocate_id(self, chapter_num: int, proposed: Optional[str] = None) -> str:
+        """`proposed` if it is free, otherwise the first free conflict_ch{chapter}_{n}."""
+        if proposed and str(proposed) not in self._by_id:
+            return str(proposed)
+        n = len(self._by_chapter.get(chapter_num, ()))
+        while f"conflict_ch{chapter_num}_{n}" in self._by_id:
+            n += 1
+        return f"conflict_ch{chapter_num}_{n}"
+
+    def add(self, conflict: Dict[str, Any], chapter_num: int) -> Dict[str, Any]:
+        """Register a new conflict, giving it a unique id; returns the conflict."""
+        conflict['id'] = self.allocate_id(chapter_num, conflict.get('id'))
+        conflict.setdefault('status', 'active')
+        conflict.setdefault('introduced_chapter', chapter_num)
+        conflict.setdefault('status_history', [{'status': conflict['status'], 'chapter': chapter_num}])
+        position = len(self.conflicts)
+        self.conflicts.append(conflict)
+        self._by_id[conflict['id']] = position
+        self._index_status(position, conflict)
+        self._by_chapter.setdefault(conflict['introduced_chapter'], []).append(position)
+        return conflict
+
+    def update(self, conflict_id: str, chapter_num: int, status: Optional[str] = None,
+               resolution_chapter: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Apply a status/resolution update; returns the conflict, or None for an unknown id."""
+        position = self._by_id.get(str(conflict_id))
+        if position is None:
+            return None
+        conflict = self.conflicts[position]
+        if status is not None and status != conflict.get('status'):
+            self._unindex_status(position, conflict)
+            history = conflict.setdefault('status_history', [])
+            if not history and conflict.get('status') is not None:
+                # Conflicts stored before history was kept: record where they started
+                history.append({'status': conflict['status'], 'chapter': conflict.get('introduced_chapter')})
+            history.append({'status': status, 'chapter': chapter_num})
+            conflict['status'] = status
+            self._index_status(position, conflict)
+        if resolution_chapter is not None:
+            conflict['resolution_chapter'] = resolution_chapter
+        return conflict
+
+    def get(self, conflict_id: str) -> Optional[Dict[str, Any]]:
+        position = self._by_id.get(str(conflict_id))
+        return self.conflicts[position] if position is not None else None
+
+    def with_status(self, status: str, timeline: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Conflicts with a status (and timeline), in insertion order."""
+        if timeline is None:
+            return self._select(self._by_status.get(status, ()))
+        return self._select(self._by_status_timeline.get((status, timeline), ()))
+
+    def introduced_in(self, chapter_num: int) -> List[Dict[str, Any]]:
+        """Conflicts introduced in a chapter, in insertion order."""
+        return self._select(self._by_chapter.get(chapter_num, ()))
@@ -0,0 +1,74 @@
+"""
+Local compaction of entity description history.
+
+Extraction prompts ask for descriptions shaped like
+"giới tính: nam; cảnh giới: Trúc Cơ; thuộc: Thanh Vân Tông", so an entity seen in
+many chapters accumulates many overlapping versions of the same fields.
+compact_descriptions() folds them into one canonical description:
+
+  - "field: value" clauses keep the newest known value per field
+    ("unknow"/empty values never overwrite a known one)
+  - free-text clauses are deduplicated (case/punctuation-insensitive)
+  - the result is capped at max_chars, dropping the oldest free-text first
+"""
+import re
+from typing import Dict, Iterable, List, Tuple
+
+from src.mention_scanner import normalize_text
+
+
+_CLAUSE_SPLIT_RE = re.compile(r"\s*[;\n]+\s*")
+_UNKNOWN = {"", "unknow", "unknown", "không rõ", "chưa rõ", "n/a"}
+
+
+def split_clauses(description: str) -> List[str]:
+    """Split a description into its ';'/newline separated clauses."""
+    if not isinstance(description, str):
+        return []
+    return [c.strip(" .") for c in _CLAUSE_SPLIT_RE.split(description) if c.strip(" .")]
+
+
+def _field(clause: str) -> Tuple[str, str]:
+    """("field", "value") for "field: value" clauses, ("", clause) otherwise."""
+    head, sep, value = clause.partition(":")
+    # Only short heads are field names; a colon inside prose is not a field
+    if sep and 0 < len(head.split()) <= 4:
+        return normalize_text(head), value.strip()
+    return "", clause
+
+
+def compact_descriptions(descriptions: Iterable[str], max_chars: int = 800) -> str:
+    """
+    Fold descriptions (oldest first) into one canonical description.
+
+    Args:
+        descriptions: Description strings, oldest first (a previous canonical
+                      description can simply be passed as the first item)
+        max_chars: Upper bound on the result length
+
+    Returns:
+        "; "-joined clauses, fields in first-seen order followed by free text
+    """
+    fields: Dict[str, str] = {}  # field key -> "field: value" clause (newest known value)
+    notes: Dict[str, str] = {}  # normalized free text -> clause, newest last
+    for description in descriptions:
+        for clause in split_clauses(description):
+            key, value = _field(clause)
+            if key:
+                if normalize_text(value) not in _UNKNOWN or key not in fields:
+                    fields[key] = clause
+            else:
+                norm = normalize_text(clause)
+                if norm not in _UNKNOWN:
+                    notes.pop(norm, None)
+                    notes[norm] = clause
+
+    clauses = list(fields.values())
+    free = list(notes.values())
+    # Drop the oldest free text first, then trailing fields, until it fits
+    while free and len("; ".join(clauses + free)) > max_chars:
+        free.pop(0)
+    while len(clauses) > 1 and len("; ".join(clauses)) > max_chars:
+        clauses.pop()
+    text = "; ".join(clauses + free)
+    return text[:max_chars]
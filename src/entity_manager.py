@@ -2,27 +2,64 @@
 Step 3-4: Entity extraction and management
 """
 import os
-from typing import Dict, Any, List, Optional
-from src.prompts.extract_prompt import SYSTEM_ENTITY_EXTRACTOR, SYSTEM_ENTITY_EXTRACTOR_OUTLINE
+import copy
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Set, Tuple
+from src.prompts.extract_prompt import SYSTEM_ENTITY_EXTRACTOR, SYSTEM_ENTITY_EXTRACTOR_OUTLINE, SYSTEM_DESCRIPTION_COMPACTOR
 from src.utils import save_json, load_json, parse_json_from_response
+from src.name_normalizer import normalize_name, loose_key, is_fuzzy_match, TrigramIndex
+from src.mention_scanner import MentionScanner
+from src.description_compactor import compact_descriptions
 
 
 class EntityManager:
     """Extract and manage story entities (characters, locations, items, etc.)."""
     
-    def __init__(self, llm_client, checkpoint_manager, logger, config, paths):
+    def __init__(self, llm_client, checkpoint_manager, logger, config, paths, store=None):
         self.llm_client = llm_client
         self.checkpoint = checkpoint_manager
         self.logger = logger
         self.config = config
         self.paths = paths
         self.max_chars = config.get('story', {}).get('max_chars_for_llm', 30000)
+        # Near-duplicate spellings at or above this similarity merge into one entity (0 disables)
+        self.fuzzy_threshold = config.get('entities', {}).get('fuzzy_match_threshold', 0.92)
+        self.mention_min_chars = config.get('entities', {}).get('mention_min_chars', 3)
+        self.existing_list_token_budget = config.get('entities', {}).get('existing_list_token_budget', 600)
+        # Description history: once it exceeds description_max entries, older ones are
+        # archived and folded into canonical_description, keeping the last description_tail
+        self.description_max = config.get('entities', {}).get('description_max', 10)
+        self.description_tail = config.get('entities', {}).get('description_tail', 5)
+        self.canonical_max_chars = config.get('entities', {}).get('canonical_description_max_chars', 800)
+        self.summarize_descriptions = config.get('entities', {}).get('summarize_descriptions', False)
         self.entity_file = os.path.join(paths['entities_dir'], 'entities.json')
+        self.archive_file = os.path.join(paths['entities_dir'], 'description_archive.jsonl')
+        self._compaction_executor = None  # created on first background summarization
+        self._compaction_jobs = []
+        self.store = store  # Optional SQLiteProjectStore; None = entities.json
+        self._lock = threading.RLock()  # guards self.entities / entities.json
         self.entities = self._load_entities()
+        # normalized name/alias -> {category: position in self.entities[category]}
+        self._name_index: Dict[str, Dict[str, int]] = {}
+        # diacritic-insensitive key -> {category: positions}, plus trigram index over those keys
+        self._loose_index: Dict[str, Dict[str, Set[int]]] = {}
+        self._trigrams = TrigramIndex()
+        # Aho–Corasick over all names/aliases, ids are (category, position)
+        self._scanner = MentionScanner(self.mention_min_chars)
+        # chapter -> {category: set of positions} for entities appearing in that chapter
+        self._chapter_index: Dict[int, Dict[str, Set[int]]] = {}
+        self._rebuild_name_index()
     
     def _load_entities(self) -> Dict[str, List[Dict[str, Any]]]:
         """Load existing entities from file."""
-        if os.path.exists(self.entity_file):
+        if self.store is not None:
+            stored = self.store.load_entities()
+            if stored:
+                return stored
+        elif os.path.exists(self.entity_file):
             return load_json(self.entity_file)
         return {
             'characters': [],
@@ -35,6 +72,93 @@ class EntityManager:
             'other': []
         }
     
+    def _rebuild_name_index(self):
+        """Index every entity by name/aliases and chapter (entities are only ever appended)."""
+        with self._lock:
+            self._name_index = {}
+            self._loose_index = {}
+            self._trigrams = TrigramIndex()
+            self._scanner = MentionScanner(self.mention_min_chars)
+            self._chapter_index = {}
+            for category, entities in self.entities.items():
+                for position, entity in enumerate(entities):
+                    self._index_entity(category, position, entity)
+                    self._index_chapters(category, position, entity)
+    
+    def _index_entity(self, category: str, position: int, entity: Dict[str, Any]):
+        """Add an entity's name and aliases to the indexes (first entity wins per exact key)."""
+        names = [entity.get('name', '')] + list(entity.get('aliases', []) or [])
+        for name in names:
+            key = normalize_name(name)
+            if not key:
+                continue
+            self._name_index.setdefault(key, {}).setdefault(category, position)
+            loose = loose_key(name)
+            self._loose_index.setdefault(loose, {}).setdefault(category, set()).add(position)
+            self._trigrams.add(loose)
+        self._scanner.add_entity((category, position), names)
+    
+    def _index_chapters(self, category: str, position: int, entity: Dict[str, Any]):
+        """Keep appear_in_chapters sorted and add the entity to the chapter index."""
+        chapters = entity.get('appear_in_chapters')
+        if chapters is None:
+            return
+        chapters = sorted(set(chapters))
+        entity['appear_in_chapters'] = chapters
+        for chapter in chapters:
+            self._chapter_index.setdefault(chapter, {}).setdefault(category, set()).add(position)
+    
+    def _entities_in_chapter(self, chapter_num: int, category: str) -> List[Dict[str, Any]]:
+        """Entities of a category appearing in a chapter, in insertion order."""
+        positions = self._chapter_index.get(chapter_num, {}).get(category, ())
+        entities = self.entities.get(category, [])
+        return [entities[p] for p in sorted(positions)]
+    
+    def _chapter_entities(self, chapter_num: int,
+                          categories: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Copies of the entities appearing in a chapter, by category (non-empty ones only).
+        
+        Answered by the project store's appearance index when it is active, otherwise
+        by the in-memory chapter index (copied: merges may run concurrently).
+        """
+        with self._lock:
+            if self.store is not None:
+                return self.store.entities_in_chapter(chapter_num, categories)
+            result = {}
+            for category in (categories or list(self._chapter_index.get(chapter_num, {}))):
+                entities = self._entities_in_chapter(chapter_num, category)
+                if entities:
+                    result[category] = copy.deepcopy(entities)
+            return result
+    
+    def _find_position(self, category: str, name: str, loose: bool = True) -> Optional[int]:
+        """
+        Position of the entity with this name/alias in a category.
+        
+        Tries the exact normalized name first; with `loose`, then a diacritic-insensitive
+        match and finally the closest trigram candidate above `fuzzy_threshold`. Loose
+        matches are only accepted when they point to a single entity.
+        """
+        position = self._name_index.get(normalize_name(name), {}).get(category)
+        if position is not None or not loose:
+            return position
+        
+        key = loose_key(name)
+        if not key:
+            return None
+        positions = self._loose_index.get(key, {}).get(category, set())
+        if len(positions) == 1:
+            return next(iter(positions))
+        if positions or not self.fuzzy_threshold:
+            return None
+        
+        for _, candidate in self._trigrams.candidates(key):
+            positions = self._loose_index.get(candidate, {}).get(category, set())
+            if len(positions) == 1 and is_fuzzy_match(key, candidate, self.fuzzy_threshold):
+                return next(iter(positions))
+        return None
+    
     def extract_entities_from_outlines(self, outlines: List[Dict[str, Any]], batch_num: int) -> Dict[str, List[Dict[str, Any]]]:
         """
         Extract entities from batch outlines.
@@ -68,11 +192,10 @@ class EntityManager:
         # Save entities for this batch (before merging)
         self._save_batch_entities(new_entities, batch_num)
         
-        # Merge with existing entities
-        self._merge_entities(new_entities)
-        
-        # Save entities
-        self._save_entities()
+        # Merge with existing entities and save
+        with self._lock:
+            changed = self._merge_entities(new_entities)
+            self._save_entities(changed)
         
         # Mark as completed
         self.checkpoint.mark_step_completed(
@@ -93,6 +216,8 @@ class EntityManager:
         
         if self.checkpoint.is_step_completed(step_name, chapter=chapter_num):
             self.logger.info(f"Entities for chapter {chapter_num} already extracted")
+            # The scan is checkpoint-guarded; this only runs it if a crash hit right after the merge
+            self.scan_chapter_mentions(chapter_content, chapter_num)
             return {}
         
         self.logger.info(f"Extracting new entities from chapter {chapter_num}")
@@ -112,6 +237,20 @@ class EntityManager:
         
         # Parse new entities
         new_entities = self._parse_entity_response(result['response'])
+        return self.record_chapter_entities(new_entities, chapter_num, chapter_content)
+    
+    def record_chapter_entities(self, new_entities: Dict[str, List[Dict[str, Any]]],
+                                chapter_num: int, chapter_content: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Merge entities extracted from a chapter and mark the chapter's extraction done.
+        
+        With `chapter_content`, the mention scan runs after the merge, so entities
+        first seen in this chapter get their mentions in it counted too.
+        
+        Used by extract_entities_from_chapter and by the combined chapter analysis
+        (PostChapterProcessor.analyze_chapter).
+        """
+        step_name = f"entity_extraction_chapter_{chapter_num}"
         
         # Add metadata to all extracted entities
         for category, entities in new_entities.items():
@@ -123,11 +262,13 @@ class EntityManager:
         # Save entities for this chapter (before merging)
         self._save_chapter_entities(new_entities, chapter_num)
         
-        # Merge with existing entities
-        self._merge_entities(new_entities)
+        # Merge with existing entities and save
+        with self._lock:
+            changed = self._merge_entities(new_entities)
+            self._save_entities(changed)
         
-        # Save entities
-        self._save_entities()
+        if chapter_content is not None:
+            self.scan_chapter_mentions(chapter_content, chapter_num)
         
         # Mark as completed
         self.checkpoint.mark_step_completed(
@@ -138,6 +279,81 @@ class EntityManager:
         
         return new_entities
     
+    def scan_chapter_mentions(self, chapter_content: str, chapter_num: int) -> Dict[Tuple[str, int], int]:
+        """
+        Find every known entity mentioned in a chapter (one Aho–Corasick pass, no LLM call).
+        
+        Adds the chapter to each mentioned entity's appear_in_chapters and accumulates
+        its `mention_count` (once per chapter, guarded by the checkpoint).
+        
+        Returns mention counts keyed by (category, position).
+        """
+        step_name = f"entity_mention_scan_{chapter_num}"
+        
+        with self._lock:
+            counts = self._scanner.scan(chapter_content)
+            if self.checkpoint.is_step_completed(step_name, chapter=chapter_num):
+                return counts
+            
+            changed = []
+            for (category, position), count in counts.items():
+                entity = self.entities[category][position]
+                entity['mention_count'] = entity.get('mention_count', 0) + count
+                if chapter_num not in (entity.get('appear_in_chapters') or []):
+                    entity['appear_in_chapters'] = list(entity.get('appear_in_chapters') or []) + [chapter_num]
+                    self._index_chapters(category, position, entity)
+                changed.append((category, entity))
+            if changed:
+                self._save_entities(changed)
+        
+        self.logger.info(f"Chapter {chapter_num}: {len(counts)} known entities mentioned")
+        self.checkpoint.mark_step_completed(
+            step_name,
+            chapter=chapter_num,
+            metadata={'entities_mentioned': len(counts)}
+        )
+        return counts
+    
+    def rank_existing_entities(self, chapter_content: str, chapter_num: int,
+                               token_budget: Optional[int] = None) -> List[str]:
+        """
+        Names of existing entities to list in the chapter extraction prompt.
+        
+        Entities mentioned in the chapter text come first (most mentions first), then
+        entities seen in the most recent earlier chapters, until the token budget
+        (~2.5 chars/token) is used up.
+        """
+        budget_chars = (self.existing_list_token_budget if token_budget is None else token_budget) * 2.5
+        names: List[str] = []
+        seen: Set[Tuple[str, int]] = set()
+        used = 0
+        
+        def take(category: str, position: int) -> bool:
+            nonlocal used
+            if (category, position) in seen:
+                return True
+            name = self.entities[category][position].get('name', '')
+            if not name:
+                return True
+            if used + len(name) + 2 > budget_chars:
+                return False
+            seen.add((category, position))
+            names.append(name)
+            used += len(name) + 2
+            return True
+        
+        with self._lock:
+            counts = self._scanner.scan(chapter_content)
+            for entity_id, _ in sorted(counts.items(), key=lambda kv: -kv[1]):
+                if not take(*entity_id):
+                    return names
+            for chapter in sorted((c for c in self._chapter_index if c < chapter_num), reverse=True):
+                for category, positions in self._chapter_index[chapter].items():
+                    for position in sorted(positions):
+                        if not take(category, position):
+                            return names
+        return names
+    
     def get_relevant_entities(self, chapter_outline: Dict[str, Any], 
                              max_entities: int = 20) -> List[Dict[str, Any]]:
         """
@@ -153,12 +369,13 @@ class EntityManager:
         character_names = [c.get('name', '') for c in chapter_outline.get('characters', [])]
         settings = chapter_outline.get('settings', [])
         
+        # Only entities indexed for this chapter are considered
+        in_chapter = self._chapter_entities(chapter_num)
+        
         # Add characters that appear in this chapter
-        for char in self.entities.get('characters', []):
+        for char in in_chapter.get('characters', []):
             if char.get('name') in character_names:
-                # Filter by appear_in_chapters
-                if self._entity_appears_in_chapter(char, chapter_num):
-                    relevant.append(char)
+                relevant.append(char)
         
         # Extract location keywords from settings (settings are full description strings)
         location_keywords = []
@@ -168,23 +385,20 @@ class EntityManager:
             location_keywords.extend([w.strip(',.;:') for w in words if w and w[0].isupper()])
         
         # Add locations mentioned in settings
-        for loc in self.entities.get('locations', []):
+        for loc in in_chapter.get('locations', []):
             loc_name = loc.get('name', '')
             # Check if any keyword matches location name (both directions)
             if any(keyword in loc_name or loc_name in keyword for keyword in location_keywords):
-                if self._entity_appears_in_chapter(loc, chapter_num):
-                    relevant.append(loc)
+                relevant.append(loc)
         
         # Add other entities that appear in this chapter
         # Filter by appear_in_chapters instead of relying on associated_characters
         for entity_type in ['items', 'techniques', 'spiritual_herbs', 'beasts', 'factions', 'other']:
-            for entity in self.entities.get(entity_type, []):
-                if self._entity_appears_in_chapter(entity, chapter_num):
-                    # Optionally also check associated_characters for extra filtering
-                    associated = entity.get('associated_characters', [])
-                    if not associated or any(name in associated for name in character_names):
-                        relevant.append(entity)
-                        relevant.append(entity)
+            for entity in in_chapter.get(entity_type, []):
+                # Optionally also check associated_characters for extra filtering
+                associated = entity.get('associated_characters', [])
+                if not associated or any(name in associated for name in character_names):
+                    relevant.append(entity)
         
         return relevant[:max_entities]
     
@@ -207,8 +421,8 @@ class EntityManager:
         # Truncate content if too long
         truncated_content = chapter_content[:self.max_chars] + "..." if len(chapter_content) > self.max_chars else chapter_content
         
-        # Get existing entity names for reference
-        existing_names = self._get_all_entity_names()
+        # Existing entities most likely to be re-extracted from this chapter
+        existing_names = self.rank_existing_entities(chapter_content, chapter_num)
         
         prompt = f"""Hãy trích xuất các entity MỚI xuất hiện trong chương {chapter_num} mà chưa có trong danh sách hiện tại:
 
@@ -216,7 +430,7 @@ class EntityManager:
 {truncated_content}
 
 **ENTITY ĐÃ CÓ (không cần trích xuất lại):**
-{', '.join(existing_names[:100])}
+{', '.join(existing_names)}
 
 """
         
@@ -225,63 +439,66 @@ class EntityManager:
     def _parse_entity_response(self, response: str) -> Dict[str, List[Dict[str, Any]]]:
         """Parse entity extraction response."""
         try:
-            entities = parse_json_from_response(response)
-            # If response is a list, convert to dict format
-            if isinstance(entities, list):
-                # Group entities by type
-                # Map from prompt types to storage keys
-                type_mapping = {
-                    'character': 'characters',
-                    'beast': 'beasts',
-                    'faction': 'factions',
-                    'artifact': 'items',  # artifacts stored as items
-                    'location': 'locations',
-                    'technique': 'techniques',
-                    'elixir': 'spiritual_herbs',  # elixirs stored as spiritual_herbs
-                    'other': 'other'
-                }
-                
-                categorized = {
-                    'characters': [],
-                    'locations': [],
-                    'items': [],
-                    'spiritual_herbs': [],
-                    'beasts': [],
-                    'techniques': [],
-                    'factions': [],
-                    'other': []
-                }
-                
-                for entity in entities:
-                    entity_type = entity.get('type', 'other')
-                    storage_key = type_mapping.get(entity_type, 'other')
-                    categorized[storage_key].append(entity)
-                
-                return categorized
-            return entities
+            return self.categorize_entities(parse_json_from_response(response))
         except Exception as e:
             self.logger.error(f"JSON parsing error: {str(e)}")
             self.logger.error(f"Response preview: {response[:500]}")
             return {}
     
-    def _merge_entities(self, new_entities: Dict[str, List[Dict[str, Any]]]):
-        """Merge new entities with existing ones, updating appear_in_chapters."""
+    def categorize_entities(self, entities: Any) -> Dict[str, List[Dict[str, Any]]]:
+        """Group an extracted entity list by storage category (dicts are returned as-is)."""
+        # If response is a list, convert to dict format
+        if isinstance(entities, list):
+            # Group entities by type
+            # Map from prompt types to storage keys
+            type_mapping = {
+                'character': 'characters',
+                'beast': 'beasts',
+                'faction': 'factions',
+                'artifact': 'items',  # artifacts stored as items
+                'location': 'locations',
+                'technique': 'techniques',
+                'elixir': 'spiritual_herbs',  # elixirs stored as spiritual_herbs
+                'other': 'other'
+            }
+            
+            categorized = {
+                'characters': [],
+                'locations': [],
+                'items': [],
+                'spiritual_herbs': [],
+                'beasts': [],
+                'techniques': [],
+                'factions': [],
+                'other': []
+            }
+            
+            for entity in entities:
+                entity_type = entity.get('type', 'other')
+                storage_key = type_mapping.get(entity_type, 'other')
+                categorized[storage_key].append(entity)
+            
+            return categorized
+        return entities
+    
+    def _merge_entities(self, new_entities: Dict[str, List[Dict[str, Any]]]) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Merge new entities with existing ones, updating appear_in_chapters.
+        
+        Returns the (category, entity) pairs that were added or modified.
+        """
+        changed = []
         for category, entities in new_entities.items():
             if category not in self.entities:
                 self.entities[category] = []
 
-            # Create index for faster lookup
-            existing_index = {e.get('name', '').lower(): i
-                            for i, e in enumerate(self.entities[category])}
-
             for entity in entities:
-                entity_name = entity.get('name', '').lower()
-                if not entity_name:
+                if not normalize_name(entity.get('name', '')):
                     continue
 
-                if entity_name in existing_index:
+                idx = self._find_position(category, entity.get('name', ''))
+                if idx is not None:
                     # Entity exists - merge appear_in_chapters
-                    idx = existing_index[entity_name]
                     existing_entity = self.entities[category][idx]
 
                     # Merge appear_in_chapters
@@ -289,8 +506,10 @@ class EntityManager:
                     new_chapters = set(entity.get('appear_in_chapters', []))
                     merged_chapters = sorted(list(existing_chapters | new_chapters))
 
+                    changed.append((category, existing_entity))
                     if merged_chapters:
                         existing_entity['appear_in_chapters'] = merged_chapters
+                        self._index_chapters(category, idx, existing_entity)
                         self.logger.info(f"Updated entity: {entity.get('name')} ({category}) - chapters: {merged_chapters}")
 
                     # Merge descriptions as array
@@ -298,7 +517,7 @@ class EntityManager:
                     existing_desc = existing_entity.get('description', [])
                     if isinstance(existing_desc, str):
                         existing_desc = [existing_desc] if existing_desc else []
-                        existing_entity['description'] = existing_desc
+                    existing_entity['description'] = existing_desc
 
                     # Get new description
                     new_desc = entity.get('description', '')
@@ -307,14 +526,109 @@ class EntityManager:
                     if new_desc and new_desc not in existing_desc:
                         existing_desc.append(new_desc)
                         self.logger.info(f"Appended description for entity: {entity.get('name')} ({category}) - total descriptions: {len(existing_desc)}")
+                        if len(existing_desc) > self.description_max:
+                            self._compact_description(category, existing_entity)
+
+                    # Keep new aliases (and a differing spelling that matched) reachable through the index
+                    known = {normalize_name(a) for a in [existing_entity.get('name', '')] + list(existing_entity.get('aliases', []) or [])}
+                    new_aliases = []
+                    for alias in [entity.get('name', '')] + list(entity.get('aliases', []) or []):
+                        if alias and normalize_name(alias) not in known:
+                            known.add(normalize_name(alias))
+                            new_aliases.append(alias)
+                    if new_aliases:
+                        existing_entity['aliases'] = list(existing_entity.get('aliases', [])) + new_aliases
+                        self._index_entity(category, idx, existing_entity)
                 else:
                     # New entity - add it
                     self.entities[category].append(entity)
+                    self._index_entity(category, len(self.entities[category]) - 1, entity)
+                    self._index_chapters(category, len(self.entities[category]) - 1, entity)
+                    changed.append((category, entity))
                     self.logger.info(f"Added new entity: {entity.get('name')} ({category}) - chapters: {entity.get('appear_in_chapters', [])}")
     
-    def _save_entities(self):
-        """Save entities to file."""
-        save_json(self.entities, self.entity_file)
+        return changed
+    
+    def _compact_description(self, category: str, entity: Dict[str, Any]):
+        """
+        Fold all but the last description_tail descriptions into canonical_description.
+        
+        The folded descriptions are appended to description_archive.jsonl first, so the
+        full history stays recoverable. Called with self._lock held.
+        """
+        descriptions = entity.get('description', [])
+        tail = max(self.description_tail, 0)
+        older = descriptions[:-tail] if tail else list(descriptions)
+        if not older:
+            return
+        self._archive_descriptions(category, entity, older)
+        previous = entity.get('canonical_description', '')
+        entity['canonical_description'] = compact_descriptions([previous] + older, self.canonical_max_chars)
+        entity['description'] = descriptions[len(older):]
+        entity['compacted_descriptions'] = entity.get('compacted_descriptions', 0) + len(older)
+        self.logger.info(f"Compacted {len(older)} descriptions of {entity.get('name')} ({category})")
+        if self.summarize_descriptions:
+            self._submit_summarization(category, entity, previous, older)
+    
+    def _archive_descriptions(self, category: str, entity: Dict[str, Any], descriptions: List[str]):
+        """Append compacted descriptions to the side archive (one JSON line per compaction)."""
+        record = {
+            'category': category,
+            'name': entity.get('name', ''),
+            'archived_at': datetime.now().isoformat(),
+            'descriptions': descriptions
+        }
+        with open(self.archive_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    
+    def _submit_summarization(self, category: str, entity: Dict[str, Any],
+                              previous: str, older: List[str]):
+        """Rewrite canonical_description with a cheap model in the background."""
+        if self._compaction_executor is None:
+            self._compaction_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="desc-compact")
+        name = entity.get('name', '')
+        local = entity['canonical_description']
+        
+        def job():
+            history = ([f"(tóm tắt trước) {previous}"] if previous else []) + older
+            prompt = f"Thực thể: {name} ({category})\n\nCác mô tả, cũ trước mới sau:\n" + \
+                "\n".join(f"- {d}" for d in history)
+            try:
+                result = self.llm_client.call(
+                    prompt=prompt,
+                    task_name="description_compaction",
+                    system_message=SYSTEM_DESCRIPTION_COMPACTOR
+                )
+            except Exception as e:
+                self.logger.warning(f"Description summarization failed for {name} ({category}), keeping local compaction: {e}")
+                return
+            summary = (result.get('response') or '').strip()
+            if not summary:
+                return
+            with self._lock:
+                # A later compaction may have replaced the text this summary was based on
+                if entity.get('canonical_description') != local:
+                    return
+                entity['canonical_description'] = summary[:self.canonical_max_chars]
+                self._save_entities([(category, entity)])
+        
+        self._compaction_jobs.append(self._compaction_executor.submit(job))
+    
+    def flush_description_jobs(self):
+        """Wait for pending background description summarizations."""
+        jobs, self._compaction_jobs = self._compaction_jobs, []
+        if jobs:
+            wait(jobs)
+    
+    def _save_entities(self, changed: Optional[List[Tuple[str, Dict[str, Any]]]] = None):
+        """Save entities to file (or only the changed ones to the project store)."""
+        with self._lock:
+            if self.store is not None:
+                if changed is None:
+                    changed = [(cat, e) for cat, items in self.entities.items() for e in items]
+                self.store.upsert_entities(changed)
+                return
+            save_json(self.entities, self.entity_file)
         self.logger.info(f"Saved entities to {self.entity_file}")
     
     def _save_batch_entities(self, entities: Dict[str, List[Dict[str, Any]]], batch_num: int):
@@ -347,6 +661,18 @@ class EntityManager:
         save_json(entity_data, chapter_file)
         self.logger.info(f"Saved chapter {chapter_num} entities to {chapter_file}")
     
+    def snapshot(self, categories: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Deep copy of the entity lists (all categories, or only `categories`), taken under the lock.
+        
+        For readers on other threads, e.g. chapter context built while an earlier
+        chapter's extraction is still merging into self.entities.
+        """
+        with self._lock:
+            selected = self.entities if categories is None else \
+                {c: self.entities.get(c, []) for c in categories}
+            return copy.deepcopy(selected)
+    
     def _count_entities(self) -> int:
         """Count total number of entities."""
         return sum(len(entities) for entities in self.entities.values())
@@ -354,17 +680,20 @@ class EntityManager:
     def _get_all_entity_names(self) -> List[str]:
         """Get all entity names across all categories."""
         names = []
-        for entities in self.entities.values():
-            names.extend([e.get('name', '') for e in entities if e.get('name')])
+        with self._lock:
+            for entities in self.entities.values():
+                names.extend([e.get('name', '') for e in entities if e.get('name')])
         return names
     
     def get_entity_by_name(self, name: str) -> Optional[Dict[str, Any]]:
-        """Find an entity by name across all categories."""
-        name_lower = name.lower()
-        for category, entities in self.entities.items():
-            for entity in entities:
-                if entity.get('name', '').lower() == name_lower:
-                    return {**entity, 'category': category}
+        """Find an entity by name or alias across all categories."""
+        with self._lock:
+            # Exact matches in any category win over loose ones; categories in self.entities order
+            for loose in (False, True):
+                for category in self.entities:
+                    position = self._find_position(category, name, loose=loose)
+                    if position is not None:
+                        return {**self.entities[category][position], 'category': category}
         return None
     
     def _entity_appears_in_chapter(self, entity: Dict[str, Any], chapter_num: int) -> bool:
@@ -396,21 +725,4 @@ class EntityManager:
         Returns:
             Dictionary of entities grouped by type
         """
-        result = {}
-        
-        # Determine which types to include
-        types_to_check = entity_types if entity_types else self.entities.keys()
-        
-        for entity_type in types_to_check:
-            if entity_type not in self.entities:
-                continue
-                
-            filtered = []
-            for entity in self.entities[entity_type]:
-                if self._entity_appears_in_chapter(entity, chapter_num):
-                    filtered.append(entity)
-            
-            if filtered:
-                result[entity_type] = filtered
-        
-        return result
+        return self._chapter_entities(chapter_num, entity_types)
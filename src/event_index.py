@@ -0,0 +1,86 @@
+"""
+In-memory inverted indexes over extracted events.
+
+EventIndex wraps the event list kept by PostChapterProcessor (events are only
+ever appended) and maintains:
+
+  - character name -> event positions (from characters_involved)
+  - entity name -> event positions (from entities_involved)
+  - chapter -> event positions
+
+Names are keyed by normalize_name(), so lookups ignore case, punctuation and
+honorific titles. top_k() selects the most important matches with a heap
+instead of sorting every match.
+"""
+import heapq
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from src.name_normalizer import normalize_name
+
+
+def _importance(event: Dict[str, Any]) -> float:
+    try:
+        return float(event.get('importance', 0) or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class EventIndex:
+    """Participant/chapter indexes and top-k selection over an append-only event list."""
+
+    def __init__(self, events: List[Dict[str, Any]]):
+        self.events = events
+        self._by_character: Dict[str, Set[int]] = {}
+        self._by_entity: Dict[str, Set[int]] = {}
+        self._by_chapter: Dict[int, List[int]] = {}
+        for position, event in enumerate(events):
+            self._index(position, event)
+
+    def _index(self, position: int, event: Dict[str, Any]):
+        for field, index in (('characters_involved', self._by_character),
+                             ('entities_involved', self._by_entity)):
+            for name in event.get(field, []) or []:
+                key = normalize_name(name)
+                if key:
+                    index.setdefault(key, set()).add(position)
+        self._by_chapter.setdefault(event.get('chapter', 0), []).append(position)
+
+    def extend(self, events: Iterable[Dict[str, Any]]):
+        """Append events to the list and index them."""
+        for event in events:
+            self.events.append(event)
+            self._index(len(self.events) - 1, event)
+
+    def _lookup(self, index: Dict[str, Set[int]], names: Iterable[str]) -> Set[int]:
+        positions: Set[int] = set()
+        for name in names:
+            positions |= index.get(normalize_name(name or ''), set())
+        return positions
+
+    def top_k(self, k: int, characters: Optional[Iterable[str]] = None,
+              entities: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Most important events, ties in insertion order.
+
+        Args:
+            k: Number of events to return
+            characters: Keep events whose characters_involved includes one of these
+            entities: Keep events whose entities_involved includes one of these
+                      (with neither filter given, all events are candidates)
+        """
+        if characters is None and entities is None:
+            candidates: Iterable[int] = range(len(self.events))
+        else:
+            candidates = self._lookup(self._by_character, characters or ()) | \
+                self._lookup(self._by_entity, entities or ())
+        best = heapq.nlargest(k, candidates, key=lambda pos: (_importance(self.events[pos]), -pos))
+        return [self.events[pos] for pos in best]
+
+    def in_chapters(self, start_chapter: int, end_chapter: int) -> List[Dict[str, Any]]:
+        """Events of chapters start..end (inclusive), in insertion order."""
+        if end_chapter - start_chapter + 1 <= len(self._by_chapter):
+            chapters: Iterable[int] = range(start_chapter, end_chapter + 1)
+        else:
+            chapters = [c for c in self._by_chapter if start_chapter <= c <= end_chapter]
+        positions = sorted(pos for c in chapters for pos in self._by_chapter.get(c, ()))
+        return [self.events[pos] for pos in positions]
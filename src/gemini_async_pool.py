@@ -0,0 +1,410 @@
+# gemini_async_pool.py
+# -*- coding: utf-8 -*-
+"""
+Client asyncio cho Gemini / DeepSeek: aiohttp + KeyPool dùng chung + retry không chặn.
+API chính:
+  - async_gemini_call_text(system_prompt, user_prompt, *, model=..., temperature=0.3, ...)
+  - async_gemini_call_json(system_prompt, user_prompt, *, model=..., temperature=0.3, ...)
+    (return_usage=True -> (kết quả, usage) như bản sync)
+  - async_gemini_batch(calls=[...], model=..., temperature=..., max_concurrency=...)
+  - async_deepseek_call_text / async_deepseek_call_json / async_deepseek_batch
+
+Cần cài `aiohttp` (Gemini) và `openai` (DeepSeek, dùng AsyncOpenAI).
+KeyPool được chia sẻ với client đồng bộ (gemini_client_pool.get_gemini_client()),
+nên code sync và async trong cùng process không tranh nhau cùng một key.
+"""
+
+import asyncio
+import os
+import time
+import weakref
+from typing import Optional, Any, Dict, List, Tuple
+
+try:
+    import aiohttp  # type: ignore
+except ImportError:
+    aiohttp = None  # type: ignore[assignment]
+
+try:
+    from openai import AsyncOpenAI  # type: ignore
+except ImportError:
+    AsyncOpenAI = None  # type: ignore[assignment]
+
+from src.gemini_client_pool import (
+    MODEL_PRIMARY, MODEL_FALLBACK, RETRY_429_LIMIT, RETRY_OTHER_LIMIT, TIMEOUT_S,
+    POOL_MAXSIZE, KEY_WAIT_S, DEFAULT_PER_JOB_SLEEP,
+    DEFAULT_DEEPSEEK_MODEL, DEEPSEEK_DEFAULT_TEMPERATURE, DEEPSEEK_DEFAULT_TOP_P,
+    DEEPSEEK_DEFAULT_MAX_TOKENS, DEEPSEEK_PER_JOB_SLEEP,
+    RETRY_429_BASE_S, RETRY_503_BASE_S, RETRY_NET_BASE_S, LIMITER_MAX_SLEEP_S,
+    KeyPool, RateLimiter, endpoint_for_model, get_gemini_client, parse_json_from_model,
+    _build_payload, _extract_text_from_gemini, _extract_usage, _add_usage, _log_disabled_key, _resolve_deepseek_api_key,
+    _backoff_delay, _retry_after_seconds, _estimate_prompt_tokens,
+)
+
+
+class AsyncHTTPError(Exception):
+    """Lỗi HTTP >= 400 từ Gemini (tương đương requests.HTTPError ở bản sync)."""
+
+    def __init__(self, status: int, text: str, headers: Optional[Any] = None):
+        super().__init__(text)
+        self.status = status
+        self.text = text
+        self.headers = headers
+
+
+# =========================
+# Async client (mỗi event loop một session)
+# =========================
+class AsyncGeminiClient:
+    """
+    Giữ một aiohttp.ClientSession (connection pool giới hạn POOL_MAXSIZE) cho một event loop.
+    KeyPool lấy từ GeminiClient đồng bộ để dùng chung trạng thái key trong process.
+    """
+
+    def __init__(self, pool_maxsize: int = POOL_MAXSIZE):
+        if aiohttp is None:
+            raise RuntimeError("Thiếu thư viện aiohttp; cần cài đặt để dùng client async.")
+        self._sync_client = get_gemini_client()
+        self._pool_maxsize = max(1, pool_maxsize)
+        self._session: Optional["aiohttp.ClientSession"] = None
+
+    @property
+    def session(self) -> "aiohttp.ClientSession":
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._pool_maxsize)
+            timeout = aiohttp.ClientTimeout(total=TIMEOUT_S)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def key_pool(self) -> KeyPool:
+        """KeyPool dùng chung; việc nạp lại keys / đọc disable log (I/O đĩa) chạy ngoài event loop."""
+        return await asyncio.to_thread(self._sync_client.key_pool)
+
+    @property
+    def limiter(self) -> RateLimiter:
+        return self._sync_client.limiter
+
+    async def acquire_key(self, pool: KeyPool, model: Optional[str] = None, tokens: int = 0,
+                          timeout: Optional[float] = KEY_WAIT_S) -> str:
+        """
+        Mượn key mà không chặn event loop (poll với backoff ngắn).
+        Nếu có `model`, chọn key còn quota theo RateLimiter dùng chung với client sync.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        select = self._sync_client.key_selector(pool, model, tokens)
+        delay = 0.05
+        while True:
+            if pool.alive_count() <= 0:
+                raise RuntimeError("Key pool empty.")
+            key = pool.get_key(block=False, select=select)
+            if key is not None:
+                if pool.is_dead(key):
+                    continue
+                if not model:
+                    return key
+                wait = self.limiter.reserve(key, model, tokens)
+                if wait <= 0:
+                    return key
+                pool.return_key(key)
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    raise RuntimeError("Rate limit: no key with remaining quota.")
+                await asyncio.sleep(min(wait, LIMITER_MAX_SLEEP_S))
+                continue
+            if deadline is not None and time.monotonic() >= deadline:
+                raise RuntimeError("Key pool empty.")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    async def wait_for_quota(self, key: str, model: str, tokens: int = 0) -> None:
+        while True:
+            wait = self.limiter.reserve(key, model, tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(min(wait, LIMITER_MAX_SLEEP_S))
+
+    async def request_once(self, key: str, model: str, payload: dict) -> Tuple[str, Dict[str, int]]:
+        headers = {"Content-Type": "application/json", "x-goog-api-key": key}
+        async with self.session.post(endpoint_for_model(model), headers=headers, json=payload) as resp:
+            if resp.status >= 400:
+                raise AsyncHTTPError(resp.status, await resp.text(), resp.headers)
+            data = await resp.json(content_type=None)
+        return _extract_text_from_gemini(data) or "", _extract_usage(data)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+_ASYNC_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncGeminiClient]" = weakref.WeakKeyDictionary()
+
+def get_async_gemini_client() -> AsyncGeminiClient:
+    """AsyncGeminiClient của event loop đang chạy (aiohttp session gắn với loop)."""
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_CLIENTS.get(loop)
+    if client is None:
+        client = AsyncGeminiClient()
+        _ASYNC_CLIENTS[loop] = client
+    return client
+
+async def close_async_clients() -> None:
+    """Đóng các session của loop hiện tại (gọi trước khi loop kết thúc)."""
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_CLIENTS.pop(loop, None)
+    if client is not None:
+        await client.close()
+    for ds_client in (_ASYNC_DEEPSEEK.pop(loop, None) or {}).values():
+        await ds_client.close()
+
+
+# =========================
+# Public: single-call text / json
+# =========================
+async def async_gemini_call_text(system_prompt: str, user_prompt: str, *,
+                                 model: Optional[str] = None,
+                                 temperature: float = 0.3,
+                                 response_mime_type: Optional[str] = None,
+                                 per_job_sleep: float = DEFAULT_PER_JOB_SLEEP,
+                                 return_usage: bool = False) -> Any:
+    """
+    Bản async của gemini_call_text_free: cùng chính sách retry/fallback,
+    nhưng mọi lần chờ đều là asyncio.sleep (huỷ được bằng task.cancel()).
+    """
+    client = get_async_gemini_client()
+    pool = await client.key_pool()
+    est_tokens = _estimate_prompt_tokens(system_prompt, user_prompt)
+    cur_model = model or MODEL_PRIMARY
+    key: Optional[str] = await client.acquire_key(pool, cur_model, est_tokens)
+
+    key_429: Dict[str, int] = {}
+    try_count_other = 0
+    usage: Dict[str, int] = {}
+
+    try:
+        while True:
+            try:
+                payload = _build_payload(system_prompt, user_prompt,
+                                         temperature=temperature, model=cur_model,
+                                         response_mime_type=response_mime_type)
+                t0 = time.monotonic()
+                text, req_usage = await client.request_once(key, cur_model, payload)
+                pool.record_success(key, cur_model, time.monotonic() - t0)
+                _add_usage(usage, req_usage)
+
+                if not text or text == "blocked_content":
+                    try_count_other += 1
+                    if try_count_other <= RETRY_OTHER_LIMIT:
+                        await asyncio.sleep(2.0)
+                        continue
+                if per_job_sleep > 0:
+                    await asyncio.sleep(per_job_sleep)
+                return (text, usage) if return_usage else text
+
+            except AsyncHTTPError as err:
+                retry_after = _retry_after_seconds(err.headers, err.text)
+                if err.status == 429:
+                    key_429[key] = key_429.get(key, 0) + 1
+                    pool.record_429(key, cur_model)
+                    delay = retry_after if retry_after is not None else _backoff_delay(key_429[key], RETRY_429_BASE_S)
+                    client.limiter.block(key, cur_model, delay)
+                    if key_429[key] >= RETRY_429_LIMIT:
+                        pool.disable_key(key)
+                        await asyncio.to_thread(_log_disabled_key, key)
+                    else:
+                        print(f"[async_gemini_call_text] HTTP 429 on key, blocked {delay:.1f}s (attempt {key_429[key]}/{RETRY_429_LIMIT})")
+                        pool.return_key(key)
+                    key = None
+                    try:
+                        key = await client.acquire_key(pool, cur_model, est_tokens)
+                    except RuntimeError:
+                        raise err
+                    continue
+                pool.record_error(key, cur_model)
+                if err.status == 503:
+                    try_count_other += 1
+                    if try_count_other < RETRY_OTHER_LIMIT:
+                        delay = retry_after if retry_after is not None else _backoff_delay(try_count_other, RETRY_503_BASE_S)
+                        print(f"[async_gemini_call_text] HTTP 503 received, retrying in {delay:.1f}s... (attempt {try_count_other}/{RETRY_OTHER_LIMIT})")
+                        await asyncio.sleep(delay); continue
+                    raise
+                else:
+                    if cur_model != MODEL_FALLBACK:
+                        cur_model = MODEL_FALLBACK
+                        print(f"[async_gemini_call_text] Fallback sang model '{cur_model}' do HTTP {err.status}")
+                        await client.wait_for_quota(key, cur_model, est_tokens)
+                        continue
+                    try_count_other += 1
+                    if try_count_other < RETRY_OTHER_LIMIT:
+                        await asyncio.sleep(_backoff_delay(try_count_other, RETRY_NET_BASE_S)); continue
+                    raise
+
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                pool.record_error(key, cur_model)
+                try_count_other += 1
+                if try_count_other < RETRY_OTHER_LIMIT:
+                    await asyncio.sleep(_backoff_delay(try_count_other, RETRY_NET_BASE_S)); continue
+                raise
+    finally:
+        # cả khi task bị cancel, key vẫn được trả về pool
+        if key:
+            pool.return_key(key)
+
+async def async_gemini_call_json(system_prompt: str, user_prompt: str, *,
+                                 model: Optional[str] = None,
+                                 temperature: float = 0.3,
+                                 per_job_sleep: float = DEFAULT_PER_JOB_SLEEP,
+                                 return_usage: bool = False) -> Any:
+    """Gọi model và bóc JSON an toàn (bản async của gemini_call_json_free)."""
+    usage: Dict[str, int] = {}
+    txt, req_usage = await async_gemini_call_text(system_prompt, user_prompt,
+                                                  model=model,
+                                                  temperature=temperature,
+                                                  response_mime_type="application/json",
+                                                  per_job_sleep=per_job_sleep,
+                                                  return_usage=True)
+    _add_usage(usage, req_usage)
+    try:
+        data = parse_json_from_model(txt)
+    except Exception:
+        print(f"[async_gemini_call_json] Thử lại không đặt response_mime_type")
+        txt2, req_usage = await async_gemini_call_text(system_prompt, user_prompt,
+                                                       model=model,
+                                                       temperature=temperature,
+                                                       response_mime_type=None,
+                                                       per_job_sleep=per_job_sleep,
+                                                       return_usage=True)
+        _add_usage(usage, req_usage)
+        data = parse_json_from_model(txt2)
+    return (data, usage) if return_usage else data
+
+
+# =========================
+# Public: batch (asyncio.gather, giới hạn đồng thời)
+# =========================
+async def async_gemini_batch(
+    calls: List[Dict[str, Any]],
+    *,
+    model: Optional[str] = None,
+    temperature: float = 0.3,
+    max_concurrency: Optional[int] = None,
+    per_job_sleep: float = DEFAULT_PER_JOB_SLEEP,
+) -> List[Dict[str, Any]]:
+    """
+    Batch nhiều yêu cầu đồng thời trên một event loop.
+    calls / kết quả có cùng schema với gemini_batch.
+    Huỷ task gọi hàm này sẽ huỷ toàn bộ request đang chạy.
+    """
+    if not calls:
+        return []
+    client = get_async_gemini_client()
+    n_alive = (await client.key_pool()).alive_count()
+    if n_alive <= 0:
+        raise RuntimeError("No API keys provided.")
+    limit = max_concurrency if max_concurrency is not None else n_alive
+    sem = asyncio.Semaphore(max(1, min(limit, n_alive)))
+
+    async def _one(call: Dict[str, Any]) -> Dict[str, Any]:
+        system = call.get("system") or ""
+        user = call.get("user") or ""
+        typ = (call.get("type") or "text").lower()
+        meta = call.get("meta")
+        async with sem:
+            try:
+                if typ == "json":
+                    data = await async_gemini_call_json(system, user, model=model,
+                                                        temperature=temperature,
+                                                        per_job_sleep=per_job_sleep)
+                else:
+                    data = await async_gemini_call_text(system, user, model=model,
+                                                        temperature=temperature,
+                                                        per_job_sleep=per_job_sleep)
+                return {"ok": True, "result": data, "error": None, "meta": meta}
+            except AsyncHTTPError as err:
+                return {"ok": False, "result": None, "error": f"HTTP {err.status}", "meta": meta}
+            except Exception as exc:
+                return {"ok": False, "result": None, "error": f"{type(exc).__name__}: {exc}", "meta": meta}
+
+    return list(await asyncio.gather(*(_one(c) for c in calls)))
+
+
+# =========================
+# Public: DeepSeek async
+# =========================
+_ASYNC_DEEPSEEK: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Any, Any]]" = weakref.WeakKeyDictionary()
+
+def _get_async_deepseek_client(api_key: Optional[str] = None, base_url: Optional[str] = None):
+    if AsyncOpenAI is None:
+        raise RuntimeError("Thiếu thư viện openai; cần cài đặt để dùng DeepSeek.")
+    key = _resolve_deepseek_api_key(api_key)
+    url = (base_url or os.getenv("DEEPSEEK_API_BASE") or "https://api.deepseek.com").strip()
+    clients = _ASYNC_DEEPSEEK.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get((key, url))
+    if client is None:
+        client = AsyncOpenAI(api_key=key, base_url=url)
+        clients[(key, url)] = client
+    return client
+
+async def async_deepseek_call_text(system_prompt: str, user_prompt: str, *,
+                                   model: Optional[str] = None,
+                                   temperature: Optional[float] = None,
+                                   top_p: Optional[float] = None,
+                                   api_key: Optional[str] = None,
+                                   base_url: Optional[str] = None,
+                                   max_tokens: Optional[int] = None) -> str:
+    """Một lượt chat completion DeepSeek (AsyncOpenAI dùng chung connection pool)."""
+    client = _get_async_deepseek_client(api_key=api_key, base_url=base_url)
+    payload: Dict[str, Any] = {
+        "model": (model or DEFAULT_DEEPSEEK_MODEL or "deepseek-chat").strip(),
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+        "temperature": DEEPSEEK_DEFAULT_TEMPERATURE if temperature is None else float(temperature),
+        "top_p": DEEPSEEK_DEFAULT_TOP_P if top_p is None else float(top_p),
+        "stream": False,
+    }
+    _max_tokens = DEEPSEEK_DEFAULT_MAX_TOKENS if max_tokens is None else max_tokens
+    if _max_tokens is not None:
+        payload["max_tokens"] = _max_tokens
+    resp = await client.chat.completions.create(**payload)
+    choice = (resp.choices or [None])[0]
+    message = getattr(choice, "message", None)
+    content = (getattr(message, "content", "") or "") if message else ""
+    return content.strip()
+
+async def async_deepseek_call_json(system_prompt: str, user_prompt: str, **kwargs: Any) -> Any:
+    text = await async_deepseek_call_text(system_prompt, user_prompt, **kwargs)
+    return parse_json_from_model(text)
+
+async def async_deepseek_batch(
+    calls: List[Dict[str, Any]],
+    *,
+    max_concurrency: int = 4,
+    per_job_sleep: Optional[float] = None,
+    **kwargs: Any,
+) -> List[Dict[str, Any]]:
+    """Bản async của deepseek_batch (cùng schema kết quả), chạy đồng thời có giới hạn."""
+    if not calls:
+        return []
+    sem = asyncio.Semaphore(max(1, max_concurrency))
+    sleep_time = DEEPSEEK_PER_JOB_SLEEP if per_job_sleep is None else float(per_job_sleep)
+
+    async def _one(call: Dict[str, Any]) -> Dict[str, Any]:
+        system = call.get("system") or ""
+        user = call.get("user") or ""
+        typ = (call.get("type") or "text").lower()
+        meta = call.get("meta")
+        async with sem:
+            try:
+                text = await async_deepseek_call_text(system, user, **kwargs)
+                if not text:
+                    raise RuntimeError("DeepSeek trả về nội dung rỗng.")
+                result = parse_json_from_model(text) if typ == "json" else text
+                out = {"ok": True, "result": result, "error": None, "meta": meta}
+            except Exception as exc:
+                out = {"ok": False, "result": None, "error": str(exc), "meta": meta}
+            if sleep_time > 0:
+                await asyncio.sleep(sleep_time)
+            return out
+
+    return list(await asyncio.gather(*(_one(c) for c in calls)))
@@ -5,19 +5,28 @@ Client gom chuẩn: dùng requests + KeyPool + retry (429, net), fallback model.
 API chính:
   - gemini_call_text_free(system_prompt, user_prompt, *, model="gemini-2.5-flash", temperature=0.3, ...)
   - gemini_call_json_free(system_prompt, user_prompt, *, model="gemini-2.5-flash", temperature=0.3, ...)
+    (return_usage=True -> (kết quả, usage) với usage lấy từ usageMetadata của response)
   - gemini_batch(calls=[...], model=..., temperature=..., keys=[...], ...)
+  - gemini_stream_text(system_prompt, user_prompt, *, model=..., temperature=..., usage={}) -> Iterator[str]
+  - get_gemini_client(): session + KeyPool dùng chung cho cả process
 """
 
-import os, json, time, math, random, threading, queue, unicodedata
+import os, json, time, math, random, threading, queue, unicodedata, collections, atexit, weakref
 import requests
+from requests.adapters import HTTPAdapter
 import regex as re
-from typing import Optional, Tuple, Any, Dict, List
+from typing import Optional, Tuple, Any, Dict, List, Callable, Iterator, Set
 
 try:
     from openai import OpenAI  # type: ignore
 except ImportError:
     OpenAI = None  # type: ignore[assignment]
 
+try:
+    from src.key_store import KeyHealthStore, DisabledKeyStore, key_fingerprint
+except ImportError:  # chạy trực tiếp: python src/gemini_client_pool.py
+    from key_store import KeyHealthStore, DisabledKeyStore, key_fingerprint  # type: ignore
+
 try:
     from Utils.read_config import DEEPSEEK_API as CONFIG_DEEPSEEK_API  # type: ignore
 except Exception:
@@ -45,12 +54,21 @@ MODEL_PRIMARY   = os.getenv("GEM_MODEL_PRIMARY",   "gemma-3-27b-it")
 MODEL_FALLBACK  = os.getenv("GEM_MODEL_FALLBACK",  "gemini-2.5-flash-lite")
 MODEL_GEMMA_FBK = os.getenv("GEM_MODEL_GEMMAFBK",  "gemma-3-27b-it")  # optional
 
-DEFAULT_PER_JOB_SLEEP = float(os.getenv("GEM_PER_JOB_SLEEP", "10"))  # giữa 2 job (giảm rate)
+# Nhịp gọi do RateLimiter điều phối; chỉ đặt > 0 nếu muốn nghỉ thêm sau mỗi job
+DEFAULT_PER_JOB_SLEEP = float(os.getenv("GEM_PER_JOB_SLEEP", "0"))
 RETRY_429_LIMIT   = int(os.getenv("GEM_RETRY_429", "3"))
 RETRY_OTHER_LIMIT = int(os.getenv("GEM_RETRY_OTHER", "3"))
 
 TIMEOUT_S = int(os.getenv("GEM_TIMEOUT_S", "240"))
 
+# Connection pool của session dùng chung (mỗi host 1 pool, maxsize = số kết nối giữ lại)
+POOL_CONNECTIONS = int(os.getenv("GEM_POOL_CONNECTIONS", "4"))
+POOL_MAXSIZE     = int(os.getenv("GEM_POOL_MAXSIZE", "32"))
+# Khoảng tối thiểu giữa 2 lần stat() các file keys/config/disable_log
+KEYS_REFRESH_INTERVAL_S = _env_float("GEM_KEYS_REFRESH_S", 5.0)
+# Thời gian chờ tối đa để mượn key khi tất cả key đang được thread khác dùng
+KEY_WAIT_S = _env_float("GEM_KEY_WAIT_S", 300.0)
+
 DEFAULT_PROVIDER = (os.getenv("FREE_CALL_PROVIDER") or "deepseek").strip().lower()
 _raw_deepseek_model = os.getenv("DEEPSEEK_MODEL_PRIMARY") or os.getenv("DEEPSEEK_MODEL")
 DEFAULT_DEEPSEEK_MODEL = (_raw_deepseek_model.strip() if _raw_deepseek_model else "deepseek-chat")
@@ -65,6 +83,10 @@ DEEPSEEK_PER_JOB_SLEEP = _env_float("DEEPSEEK_PER_JOB_SLEEP", 0.0)
 def endpoint_for_model(model: str) -> str:
     return f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
 
+def stream_endpoint_for_model(model: str) -> str:
+    # server-sent events: mỗi sự kiện "data: {...}" là một GenerateContentResponse rút gọn
+    return f"https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?alt=sse"
+
 def _normalize_ws(s: str) -> str:
     return re.sub(r"\s+", " ", (s or "")).strip()
 
@@ -153,6 +175,25 @@ def _extract_text_from_gemini(resp_json: dict) -> Optional[str]:
         pass
     return None
 
+# usageMetadata -> số token thật (input gồm cả phần cached; thoughts tính phí như output)
+USAGE_FIELDS = {
+    "promptTokenCount": "input",
+    "candidatesTokenCount": "output",
+    "thoughtsTokenCount": "thoughts",
+    "cachedContentTokenCount": "cached",
+    "totalTokenCount": "total",
+}
+
+def _extract_usage(resp_json: dict) -> Dict[str, int]:
+    """{"input", "output", "thoughts", "cached", "total"} từ usageMetadata (thiếu trường = 0)."""
+    meta = (resp_json or {}).get("usageMetadata") or {}
+    return {name: int(meta.get(field) or 0) for field, name in USAGE_FIELDS.items()}
+
+def _add_usage(total: Dict[str, int], usage: Dict[str, int]) -> None:
+    """Cộng dồn usage của một request vào tổng (mọi request thành công đều bị tính phí)."""
+    for name, n in usage.items():
+        total[name] = total.get(name, 0) + n
+
 # Bóc JSON từ text model trả về
 JSON_FENCE_RE = re.compile(r"```(?:json)?\s*([\s\S]*?)\s*```", re.IGNORECASE)
 def _try_json_loads(s: str):
@@ -185,37 +226,439 @@ def parse_json_from_model(text: str):
 # =========================
 # KeyPool
 # =========================
+# Key bị disable (429 liên tục) nghỉ bao lâu trước khi được dùng lại
+DISABLE_COOLDOWN_S = _env_float("GEM_DISABLE_COOLDOWN_S", 5 * 3600)
+KEY_HEALTH_PATH = os.getenv("GEM_KEY_HEALTH_PATH", "auth_files/key_health.jsonl")
+HEALTH_EWMA_ALPHA = 0.2
+# Trạng thái key được ghi xuống đĩa bởi thread nền: mỗi HEALTH_FLUSH_S giây, hoặc sớm hơn khi
+# có HEALTH_FLUSH_UPDATES cập nhật chưa ghi (và lúc thoát process)
+HEALTH_FLUSH_S = _env_float("GEM_HEALTH_FLUSH_S", 5.0)
+HEALTH_FLUSH_UPDATES = _env_int("GEM_HEALTH_FLUSH_UPDATES", 64)
+
+class KeyHealth:
+    """Sức khoẻ 1 key: EWMA latency / tỉ lệ 429 / tỉ lệ lỗi, cooldown và số request trong ngày."""
+
+    __slots__ = ("latency_s", "rate_429", "error_rate", "cooldown_until", "day", "daily")
+
+    def __init__(self, state: Optional[Dict[str, Any]] = None):
+        state = state or {}
+        self.latency_s = float(state.get("lat", 0.0))
+        self.rate_429 = float(state.get("r429", 0.0))
+        self.error_rate = float(state.get("err", 0.0))
+        self.cooldown_until = float(state.get("cd", 0.0))
+        self.day = state.get("day", "")
+        self.daily: Dict[str, int] = dict(state.get("daily") or {})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"lat": round(self.latency_s, 3), "r429": round(self.rate_429, 4),
+                "err": round(self.error_rate, 4), "cd": self.cooldown_until,
+                "day": self.day, "daily": self.daily}
+
+    def _observe(self, latency_s: Optional[float], is_429: bool, is_error: bool):
+        a = HEALTH_EWMA_ALPHA
+        if latency_s is not None:
+            self.latency_s = latency_s if self.latency_s <= 0 else (1 - a) * self.latency_s + a * latency_s
+        self.rate_429 = (1 - a) * self.rate_429 + a * (1.0 if is_429 else 0.0)
+        self.error_rate = (1 - a) * self.error_rate + a * (1.0 if is_error else 0.0)
+
+    def _count_request(self, model: str):
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+        if self.day != today:
+            self.day, self.daily = today, {}
+        self.daily[model] = self.daily.get(model, 0) + 1
+
+class _HealthFlusher:
+    """Thread nền ghi trạng thái key đã thay đổi của mọi KeyPool xuống KeyHealthStore (ngoài lock của pool)."""
+
+    def __init__(self):
+        self._pools: "weakref.WeakSet[KeyPool]" = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, pool: "KeyPool") -> None:
+        with self._lock:
+            self._pools.add(pool)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="key-health-flusher", daemon=True)
+                self._thread.start()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(HEALTH_FLUSH_S)
+            self._wake.clear()
+            self.flush_all()
+
+    def flush_all(self) -> None:
+        with self._lock:
+            pools = list(self._pools)
+        for pool in pools:
+            try:
+                pool.flush_health()
+            except Exception as exc:
+                print(f"Warning: Failed to flush key health: {exc}")
+
+_HEALTH_FLUSHER = _HealthFlusher()
+atexit.register(_HEALTH_FLUSHER.flush_all)
+
 class KeyPool:
-    def __init__(self, keys: List[str]):
+    """
+    Tập key dùng chung: key rảnh nằm trong `_avail`, key đang nghỉ (cooldown) nằm trong `_dead`.
+    Mỗi key có KeyHealth; mặc định key được chọn theo điểm sức khoẻ (xem cost()).
+    Thay đổi sức khoẻ chỉ đánh dấu key "bẩn"; _HealthFlusher ghi xuống đĩa sau, không giữ lock của pool.
+    """
+
+    def __init__(self, keys: List[str], health_store: Optional[KeyHealthStore] = None,
+                 limits: Optional[Dict[str, Dict[str, float]]] = None):
         rnd = list(dict.fromkeys([k.strip() for k in keys if k.strip()]))
         random.SystemRandom().shuffle(rnd)
-        self._avail = queue.Queue()
-        for k in rnd:
-            self._avail.put(k)
+        self._keys = set(rnd)
+        self._store = health_store
+        self._limits = limits or {}
+        self._health: Dict[str, KeyHealth] = {}
+        self._fps: Dict[str, str] = {}
         self._dead = set()
-        self._lock = threading.Lock()
+        now = time.time()
+        for k in rnd:
+            self._fps[k] = key_fingerprint(k)
+            self._health[k] = KeyHealth(health_store.get(self._fps[k]) if health_store else None)
+            if self._health[k].cooldown_until > now:
+                self._dead.add(k)
+        self._avail = collections.deque(k for k in rnd if k not in self._dead)
+        self._lock = threading.RLock()
+        self._cond = threading.Condition(self._lock)
+        self._dirty: Set[str] = set()
+        self._pending_updates = 0
+        if health_store is not None:
+            _HEALTH_FLUSHER.register(self)
 
-    def get_key(self, block=True, timeout=None) -> Optional[str]:
-        try:
-            return self._avail.get(block=block, timeout=timeout)
-        except queue.Empty:
-            return None
+    def get_key(self, block=True, timeout=None,
+                select: Optional[Callable[[List[str]], Optional[str]]] = None) -> Optional[str]:
+        """
+        Lấy 1 key rảnh. `select` (nếu có) chọn key trong danh sách key đang rảnh;
+        mặc định chọn key có cost() thấp nhất.
+        """
+        with self._cond:
+            if block and not self._avail:
+                self._cond.wait_for(lambda: bool(self._avail), timeout)
+            if not self._avail:
+                return None
+            keys = list(self._avail)
+            key = select(keys) if select is not None else self.best_key(keys)
+            if key is None or key not in self._avail:
+                return self._avail.popleft()
+            self._avail.remove(key)
+            return key
 
     def return_key(self, key: str):
+        with self._cond:
+            if key in self._dead or key in self._avail:
+                return
+            self._avail.append(key)
+            self._cond.notify()
+
+    def disable_key(self, key: str, cooldown_s: float = DISABLE_COOLDOWN_S):
+        with self._cond:
+            self._dead.add(key)
+            if key in self._avail:
+                self._avail.remove(key)
+            h = self._health.get(key)
+            if h is not None:
+                h.cooldown_until = time.time() + cooldown_s
+                self._persist(key)
+
+    def revive_expired(self) -> int:
+        """Đưa các key đã hết cooldown trở lại pool; trả về số key được hồi."""
+        now = time.time()
+        revived = 0
+        with self._cond:
+            for key in list(self._dead):
+                h = self._health.get(key)
+                if h is not None and 0 < h.cooldown_until <= now:
+                    self._dead.discard(key)
+                    self._avail.append(key)
+                    revived += 1
+            if revived:
+                self._cond.notify(revived)
+        return revived
+
+    def is_dead(self, key: str) -> bool:
+        with self._lock:
+            return key in self._dead
+
+    def all_keys(self) -> List[str]:
+        with self._lock:
+            return list(self._keys)
+
+    def alive_count(self) -> int:
+        with self._lock:
+            return len(self._keys) - len(self._dead & self._keys)
+
+    # ----- health -----
+    def _persist(self, key: str):
+        """Đánh dấu key cần ghi (gọi khi đang giữ lock; không I/O)."""
+        if self._store is None:
+            return
+        self._dirty.add(key)
+        self._pending_updates += 1
+        if self._pending_updates >= HEALTH_FLUSH_UPDATES:
+            _HEALTH_FLUSHER.wake()
+
+    def flush_health(self) -> int:
+        """Ghi trạng thái các key đã thay đổi xuống KeyHealthStore; trả về số key đã ghi."""
+        if self._store is None:
+            return 0
         with self._lock:
-            if key in self._dead:
+            states = {self._fps[k]: self._health[k].to_dict() for k in self._dirty if k in self._health}
+            self._dirty.clear()
+            self._pending_updates = 0
+        self._store.put_many(states)
+        return len(states)
+
+    def record_success(self, key: str, model: str, latency_s: float):
+        with self._lock:
+            h = self._health.get(key)
+            if h is None:
                 return
-        self._avail.put(key)
+            h._observe(latency_s, False, False)
+            h._count_request(model)
+            self._persist(key)
 
-    def disable_key(self, key: str):
+    def record_429(self, key: str, model: str):
         with self._lock:
-            self._dead.add(key)
+            h = self._health.get(key)
+            if h is None:
+                return
+            h._observe(None, True, False)
+            h._count_request(model)
+            self._persist(key)
+
+    def record_error(self, key: str, model: str):
+        with self._lock:
+            h = self._health.get(key)
+            if h is None:
+                return
+            h._observe(None, False, True)
+            self._persist(key)
+
+    def remaining_quota(self, key: str, model: str) -> Optional[int]:
+        """Ước lượng số request còn lại trong ngày (None nếu model không có giới hạn rpd)."""
+        lim = self._limits.get(model) or self._limits.get("default") or {}
+        rpd = lim.get("rpd")
+        if not rpd:
+            return None
+        with self._lock:
+            h = self._health.get(key)
+            if h is None:
+                return int(rpd)
+            used = h.daily.get(model, 0) if h.day == time.strftime("%Y-%m-%d", time.gmtime()) else 0
+            return int(rpd) - used
+
+    def cost(self, key: str, model: Optional[str] = None) -> float:
+        """
+        Điểm chọn key (thấp = tốt), xấp xỉ số giây 'đắt' của key:
+        latency trung bình + phạt theo tỉ lệ 429 / lỗi, rất lớn nếu đang cooldown hoặc hết quota ngày.
+        """
+        with self._lock:
+            h = self._health.get(key)
+            if h is None:
+                return 0.0
+            if h.cooldown_until > time.time():
+                return math.inf
+            c = h.latency_s + 60.0 * h.rate_429 + 30.0 * h.error_rate
+        if model:
+            rem = self.remaining_quota(key, model)
+            if rem is not None and rem <= 0:
+                c += 1e6
+        return c
+
+    def best_key(self, keys: List[str], model: Optional[str] = None,
+                 waits: Optional[Dict[str, float]] = None) -> Optional[str]:
+        """Key có (thời gian chờ quota + cost) thấp nhất."""
+        if not keys:
+            return None
+        return min(keys, key=lambda k: (waits.get(k, 0.0) if waits else 0.0) + self.cost(k, model))
+
+# =========================
+# Rate limiter (token bucket theo key × model)
+# =========================
+# Quota mặc định cho 1 key (free tier): rpm/tpm cho RateLimiter, rpd để KeyPool ước lượng quota còn lại.
+# Ghi đè bằng mục `rate_limits` trong config.yaml
+DEFAULT_RATE_LIMITS: Dict[str, Dict[str, float]] = {
+    "gemini-2.5-pro":        {"rpm": 5,  "tpm": 250_000, "rpd": 100},
+    "gemini-2.5-flash":      {"rpm": 10, "tpm": 250_000, "rpd": 250},
+    "gemini-2.5-flash-lite": {"rpm": 15, "tpm": 250_000, "rpd": 1000},
+    "gemma-3-27b-it":        {"rpm": 30, "tpm": 15_000,  "rpd": 14400},
+    "default":               {"rpm": 10, "tpm": 250_000},
+}
+RETRY_429_BASE_S = _env_float("GEM_RETRY_429_BASE_S", 5.0)
+RETRY_503_BASE_S = _env_float("GEM_RETRY_503_BASE_S", 4.0)
+RETRY_NET_BASE_S = _env_float("GEM_RETRY_NET_BASE_S", 2.0)
+RETRY_MAX_DELAY_S = _env_float("GEM_RETRY_MAX_DELAY_S", 60.0)
+# Ngủ tối đa mỗi lần khi chờ bucket hồi (để còn kiểm tra key khác được trả về)
+LIMITER_MAX_SLEEP_S = _env_float("GEM_LIMITER_MAX_SLEEP_S", 5.0)
+
+class TokenBucket:
+    """Bucket dung lượng `capacity`, hồi đầy sau `per_seconds` giây."""
+
+    def __init__(self, capacity: float, per_seconds: float = 60.0):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / per_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, n: float, now: float) -> float:
+        self._refill(now)
+        n = min(n, self.capacity)  # request lớn hơn bucket vẫn phải đi được
+        if self.tokens >= n:
+            return 0.0
+        return (n - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def consume(self, n: float, now: float):
+        self._refill(now)
+        self.tokens -= min(n, self.capacity)
+
+class RateLimiter:
+    """
+    Theo dõi requests/phút và tokens/phút cho từng cặp (key, model),
+    cộng với thời điểm key bị chặn sau 429 (Retry-After).
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None):
+        self.limits = limits if limits is not None else _load_rate_limits()
+        self._buckets: Dict[Tuple[str, str], Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self._blocked_until: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def _buckets_for(self, key: str, model: str):
+        pair = self._buckets.get((key, model))
+        if pair is None:
+            lim = self.limits.get(model) or self.limits.get("default") or {}
+            rpm, tpm = lim.get("rpm"), lim.get("tpm")
+            pair = (TokenBucket(rpm) if rpm else None, TokenBucket(tpm) if tpm else None)
+            self._buckets[(key, model)] = pair
+        return pair
+
+    def _wait_locked(self, key: str, model: str, tokens: int, now: float) -> float:
+        rpm_b, tpm_b = self._buckets_for(key, model)
+        wait = max(0.0, self._blocked_until.get((key, model), 0.0) - now)
+        if rpm_b is not None:
+            wait = max(wait, rpm_b.wait_time(1, now))
+        if tpm_b is not None and tokens > 0:
+            wait = max(wait, tpm_b.wait_time(tokens, now))
+        return wait
+
+    def wait_time(self, key: str, model: str, tokens: int = 0) -> float:
+        with self._lock:
+            return self._wait_locked(key, model, tokens, time.monotonic())
+
+    def best_key(self, keys: List[str], model: str, tokens: int = 0) -> Optional[str]:
+        """Key có thời gian chờ ngắn nhất (0 = còn quota ngay)."""
+        if not keys:
+            return None
+        waits = self.wait_times(keys, model, tokens)
+        return min(keys, key=lambda k: waits[k])
+
+    def wait_times(self, keys: List[str], model: str, tokens: int = 0) -> Dict[str, float]:
+        with self._lock:
+            now = time.monotonic()
+            return {k: self._wait_locked(k, model, tokens, now) for k in keys}
+
+    def reserve(self, key: str, model: str, tokens: int = 0) -> float:
+        """Trừ quota nếu đủ và trả 0; ngược lại trả số giây cần chờ (không trừ gì)."""
+        with self._lock:
+            now = time.monotonic()
+            wait = self._wait_locked(key, model, tokens, now)
+            if wait <= 0:
+                rpm_b, tpm_b = self._buckets_for(key, model)
+                if rpm_b is not None:
+                    rpm_b.consume(1, now)
+                if tpm_b is not None and tokens > 0:
+                    tpm_b.consume(tokens, now)
+            return wait
+
+    def block(self, key: str, model: str, seconds: float):
+        """Chặn (key, model) trong `seconds` giây (sau 429 / Retry-After)."""
+        with self._lock:
+            until = time.monotonic() + max(0.0, seconds)
+            if until > self._blocked_until.get((key, model), 0.0):
+                self._blocked_until[(key, model)] = until
+
+def _load_rate_limits() -> Dict[str, Dict[str, float]]:
+    """DEFAULT_RATE_LIMITS ghi đè bởi mục `rate_limits` trong config.yaml (nếu có)."""
+    limits = {m: dict(v) for m, v in DEFAULT_RATE_LIMITS.items()}
+    try:
+        import yaml
+        if os.path.exists(CONFIG_PATH):
+            with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+                config = yaml.safe_load(f) or {}
+            for model_name, lim in (config.get("rate_limits") or {}).items():
+                if isinstance(lim, dict):
+                    limits.setdefault(model_name, {}).update(lim)
+    except Exception as exc:
+        print(f"Warning: Failed to load rate_limits from config: {exc}")
+    return limits
+
+def _backoff_delay(attempt: int, base: float, cap: float = RETRY_MAX_DELAY_S) -> float:
+    """Exponential backoff có jitter: nửa cố định + nửa ngẫu nhiên của min(cap, base·2^(n-1))."""
+    d = min(cap, base * (2 ** max(0, attempt - 1)))
+    return d / 2 + random.uniform(0, d / 2)
+
+_RETRY_DELAY_RE = re.compile(r"^\s*([0-9]+(?:\.[0-9]+)?)s\s*$")
+
+def _retry_after_seconds(headers: Optional[Any], body: Optional[str]) -> Optional[float]:
+    """Đọc thời gian chờ server yêu cầu: header Retry-After hoặc RetryInfo.retryDelay trong body lỗi."""
+    try:
+        raw = headers.get("Retry-After") if headers is not None else None
+        if raw:
+            return max(0.0, float(raw))
+    except (TypeError, ValueError):
+        pass
+    try:
+        details = (json.loads(body or "").get("error") or {}).get("details") or []
+        for d in details:
+            if str(d.get("@type", "")).endswith("RetryInfo"):
+                m = _RETRY_DELAY_RE.match(str(d.get("retryDelay", "")))
+                if m:
+                    return float(m.group(1))
+    except Exception:
+        pass
+    return None
+
+def _estimate_prompt_tokens(system_prompt: Optional[str], user_prompt: str) -> int:
+    """Ước lượng input tokens cho TPM (~2.5 ký tự/token với tiếng Việt)."""
+    return int((len(system_prompt or "") + len(user_prompt or "")) / 2.5)
+
+CONFIG_PATH = "config/config.yaml"
+DISABLE_LOG_PATH = os.getenv("GEM_DISABLE_LOG_PATH", "auth_files/disable_log.jsonl")
+LEGACY_DISABLE_LOG_PATH = "auth_files/disable_log.json"  # định dạng cũ, được import 1 lần
+
+_DISABLED_STORE: Optional[DisabledKeyStore] = None
+_DISABLED_STORE_LOCK = threading.Lock()
+
+def get_disabled_key_store() -> DisabledKeyStore:
+    """DisabledKeyStore dùng chung cho cả process."""
+    global _DISABLED_STORE
+    if _DISABLED_STORE is None:
+        with _DISABLED_STORE_LOCK:
+            if _DISABLED_STORE is None:
+                _DISABLED_STORE = DisabledKeyStore(DISABLE_LOG_PATH, DISABLE_COOLDOWN_S,
+                                                   legacy_path=LEGACY_DISABLE_LOG_PATH)
+    return _DISABLED_STORE
 
 def _get_config_keys_path() -> Optional[str]:
     """Load keys file path from config.yaml."""
     try:
         import yaml
-        config_path = "config/config.yaml"
+        config_path = CONFIG_PATH
         if os.path.exists(config_path):
             with open(config_path, "r", encoding="utf-8") as f:
                 config = yaml.safe_load(f)
@@ -264,39 +707,165 @@ def load_keys(keys_file: Optional[str] = None, keys_env: Optional[str] = None) -
     random.SystemRandom().shuffle(keys)
     print(f"Loaded {len(keys)} Gemini API keys from {keys_file}.")
     
-    # Loại bỏ các key đã bị disable trong vòng 5 giờ qua
-    disable_log_path = "auth_files/disable_log.json"
-    disabled_keys = set()
-    now = time.time()
-    if os.path.exists(disable_log_path):
-        try:
-            with open(disable_log_path, "r", encoding="utf-8") as f:
-                log_data = json.load(f)
-            for entry in log_data:
-                key = entry.get("key")
-                disabled_at_str = entry.get("disabled_at")
-                if key and disabled_at_str:
-                    try:
-                        # Chuyển disabled_at sang timestamp
-                        disabled_at_ts = time.mktime(time.strptime(disabled_at_str, "%Y-%m-%d %H:%M:%S"))
-                        # Nếu bị disable dưới 5h thì loại bỏ
-                        if now - disabled_at_ts < 5 * 3600:
-                            disabled_keys.add(key)
-                    except Exception:
-                        continue
-        except Exception as exc:
-            print(f"Warning: Failed to read disable_log.json: {exc}")
+    # Loại bỏ các key đã bị disable trong cooldown (index trong bộ nhớ, chỉ đọc phần log mới)
+    store = get_disabled_key_store()
+    store.refresh()
+    disabled_fps = store.active_fingerprints()
 
     # Giữ lại các key chưa bị disable hoặc đã bị disable trên 5h
-    keys = [k for k in keys if k not in disabled_keys]
+    keys = [k for k in keys if key_fingerprint(k) not in disabled_fps]
     print(f"After filtering disabled keys: {len(keys)} active keys.")
     return keys
 
+def _log_disabled_key(key: str) -> None:
+    """Ghi key bị disable (429 liên tục) vào disable log (append-only, có file lock)."""
+    get_disabled_key_store().disable(key)
+
+# =========================
+# Persistent client (process-wide)
+# =========================
+class GeminiClient:
+    """
+    Client dùng chung cho cả process: một requests.Session có connection pool
+    và một KeyPool chia sẻ giữa các thread.
+    KeyPool chỉ được nạp lại khi config.yaml / file keys / disable_log.json thay đổi
+    (so sánh mtime + size), thay vì load_keys() ở mỗi lần gọi.
+    """
+
+    def __init__(self, keys_file: Optional[str] = None, keys_env: Optional[str] = None,
+                 pool_connections: int = POOL_CONNECTIONS, pool_maxsize: int = POOL_MAXSIZE):
+        self.keys_file = keys_file
+        self.keys_env = keys_env
+        self.session = self._make_session(pool_connections, pool_maxsize)
+        self._lock = threading.RLock()
+        self._pool: Optional[KeyPool] = None
+        self._signature: Optional[Tuple[Any, ...]] = None
+        self._keys_path: Optional[str] = None
+        self._last_check = 0.0
+        self.limiter = RateLimiter()
+        self.health_store = KeyHealthStore(KEY_HEALTH_PATH)
+
+    @staticmethod
+    def _make_session(pool_connections: int, pool_maxsize: int) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(1, pool_connections),
+                              pool_maxsize=max(1, pool_maxsize))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @staticmethod
+    def _stat_sig(path: str) -> Tuple[Any, ...]:
+        try:
+            st = os.stat(path)
+            return (path, st.st_mtime_ns, st.st_size)
+        except OSError:
+            return (path, None, None)
+
+    def _sources_signature(self) -> Tuple[Any, ...]:
+        config_sig = self._stat_sig(CONFIG_PATH)
+        # chỉ parse lại config.yaml để tìm keys_file khi chính config thay đổi
+        if self._signature is None or self._signature[0] != config_sig:
+            self._keys_path = self.keys_file or _get_config_keys_path() or "auth_files/keys.txt"
+        return (config_sig,
+                self._stat_sig(self._keys_path),
+                self.keys_env or os.getenv("GOOGLE_API_KEYS") or "")
+
+    def key_pool(self) -> KeyPool:
+        """Trả về KeyPool hiện tại, nạp lại nếu nguồn keys đã thay đổi."""
+        with self._lock:
+            now = time.monotonic()
+            if self._pool is not None and now - self._last_check < KEYS_REFRESH_INTERVAL_S:
+                return self._pool
+            self._last_check = now
+            signature = self._sources_signature()
+            if self._pool is None or signature != self._signature:
+                keys = load_keys(self._keys_path, self.keys_env)
+                if not keys:
+                    raise RuntimeError("No API keys provided.")
+                # KeyHealthStore dùng chung nên cooldown / điểm sức khoẻ được giữ qua các lần nạp lại
+                self._pool = KeyPool(keys, health_store=self.health_store, limits=self.limiter.limits)
+                self._signature = signature
+            else:
+                self._pool.revive_expired()
+            self._sync_disabled(self._pool)
+            return self._pool
+
+    @staticmethod
+    def _sync_disabled(pool: KeyPool) -> None:
+        """Áp dụng các key do process khác disable (đọc tăng dần disable log)."""
+        store = get_disabled_key_store()
+        store.refresh()
+        now = time.time()
+        for key in pool.all_keys():
+            until = store.disabled_until(key)
+            if until > now and not pool.is_dead(key):
+                pool.disable_key(key, cooldown_s=until - now)
+
+    def acquire_key(self, pool: KeyPool, model: Optional[str] = None, tokens: int = 0,
+                    timeout: Optional[float] = KEY_WAIT_S) -> str:
+        """
+        Mượn một key. Nếu có `model`, chọn key rảnh còn quota nhiều nhất theo RateLimiter
+        và chỉ trả về khi đã trừ được quota (chờ bucket hồi thay vì ngủ cố định).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        select = self.key_selector(pool, model, tokens)
+        while True:
+            if pool.alive_count() <= 0:
+                raise RuntimeError("Key pool empty.")
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            key = pool.get_key(block=True, timeout=remaining, select=select)
+            if key is None:
+                raise RuntimeError("Key pool empty.")
+            if pool.is_dead(key):
+                continue
+            if not model:
+                return key
+            wait = self.limiter.reserve(key, model, tokens)
+            if wait <= 0:
+                return key
+            # chưa key nào còn quota: trả key lại rồi chờ bucket hồi
+            pool.return_key(key)
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise RuntimeError("Rate limit: no key with remaining quota.")
+            time.sleep(min(wait, LIMITER_MAX_SLEEP_S))
+
+    def key_selector(self, pool: KeyPool, model: Optional[str], tokens: int = 0):
+        """Hàm chọn key cho KeyPool.get_key: thời gian chờ quota (RateLimiter) + cost sức khoẻ."""
+        if not model:
+            return None
+        return lambda keys: pool.best_key(keys, model, self.limiter.wait_times(keys, model, tokens))
+
+    def wait_for_quota(self, key: str, model: str, tokens: int = 0) -> None:
+        """Chờ tới khi (key, model) còn quota rồi trừ quota (dùng khi đổi model giữa chừng)."""
+        while True:
+            wait = self.limiter.reserve(key, model, tokens)
+            if wait <= 0:
+                return
+            time.sleep(min(wait, LIMITER_MAX_SLEEP_S))
+
+    def release_key(self, pool: KeyPool, key: Optional[str]) -> None:
+        if key:
+            pool.return_key(key)
+
+
+_CLIENT: Optional[GeminiClient] = None
+_CLIENT_LOCK = threading.Lock()
+
+def get_gemini_client() -> GeminiClient:
+    """Singleton GeminiClient cho cả process (thread-safe)."""
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = GeminiClient()
+    return _CLIENT
+
 # =========================
 # Low-level single request
 # =========================
 
-def _request_once(session: requests.Session, key: str, model: str, payload: dict) -> str:
+def _request_once(session: requests.Session, key: str, model: str, payload: dict) -> Tuple[str, Dict[str, int]]:
     headers = {"Content-Type": "application/json", "x-goog-api-key": key}
     url = endpoint_for_model(model)
     proxies = {
@@ -306,8 +875,28 @@ def _request_once(session: requests.Session, key: str, model: str, payload: dict
     resp = session.post(url, headers=headers, json=payload, timeout=TIMEOUT_S, proxies=proxies)
     if resp.status_code >= 400:
         raise requests.HTTPError(resp.text, response=resp)
-    out = _extract_text_from_gemini(resp.json())
-    return out or ""
+    data = resp.json()
+    return _extract_text_from_gemini(data) or "", _extract_usage(data)
+
+def _iter_sse_chunks(resp: requests.Response, usage: Optional[Dict[str, int]] = None) -> Iterator[str]:
+    """Bóc text từ từng sự kiện SSE của streamGenerateContent (usageMetadata, nếu có, ghi vào usage)."""
+    resp.encoding = "utf-8"
+    for raw in resp.iter_lines(decode_unicode=True):
+        if not raw or not raw.startswith("data:"):
+            continue
+        data = raw[5:].strip()
+        if not data or data == "[DONE]":
+            continue
+        try:
+            event = json.loads(data)
+        except ValueError:
+            continue
+        if usage is not None and event.get("usageMetadata"):
+            # usageMetadata của stream là số cộng dồn, sự kiện cuối chứa tổng
+            usage.update(_extract_usage(event))
+        text = _extract_text_from_gemini(event)
+        if text and text != "blocked_content":
+            yield text
 
 # =========================
 # Public: single-call text / json
@@ -317,128 +906,215 @@ def gemini_call_text_free(system_prompt: str, user_prompt: str, *,
                      model: Optional[str] = None,
                      temperature: float = 0.3,
                      response_mime_type: Optional[str] = None,
-                     per_job_sleep: float = DEFAULT_PER_JOB_SLEEP) -> str:
+                     per_job_sleep: float = DEFAULT_PER_JOB_SLEEP,
+                     return_usage: bool = False) -> Any:
     """
     Trả về string (không ép JSON). Tự xoay key khi 429, fallback model nếu non-429.
-    Mỗi lần gọi sẽ load lại keys từ config để sử dụng key ngẫu nhiên.
+    Dùng session + KeyPool dùng chung của process (xem get_gemini_client()); nhịp gọi
+    do RateLimiter điều phối theo quota từng key thay vì ngủ cố định.
+    return_usage=True -> (text, usage): usage cộng dồn mọi request thành công (kể cả lần retry do blocked/rỗng).
     """
     _model = model or MODEL_PRIMARY
-    # Load keys mới mỗi lần gọi để sử dụng key ngẫu nhiên
-    _keys = load_keys()
-    if not _keys:
-        raise RuntimeError("No API keys provided.")
-    pool = KeyPool(_keys)
-
-    session = requests.Session()
-    key = pool.get_key(block=False)
-    if key is None:
-        raise RuntimeError("Key pool empty.")
+    client = get_gemini_client()
+    pool = client.key_pool()
+    session = client.session
+    est_tokens = _estimate_prompt_tokens(system_prompt, user_prompt)
+    cur_model = _model
+    key: Optional[str] = client.acquire_key(pool, cur_model, est_tokens)
 
-    try_count_429 = 0
+    key_429: Dict[str, int] = {}
     try_count_other = 0
-    cur_model = _model
+    usage: Dict[str, int] = {}
 
-    while True:
-        try:
-            payload = _build_payload(system_prompt, user_prompt,
-                                     temperature=temperature, model=cur_model,
-                                     response_mime_type=response_mime_type)
-            print(f"[gemini_call_text_free] Requesting model '{cur_model}' with key '{key}'")
-            text = _request_once(session, key, cur_model, payload)
-
-            # Nếu model trả "blocked_content" coi như empty
-            if not text or text == "blocked_content":
-                # cho retry nhẹ nhàng 2 lần
-                try_count_other += 1
-                if try_count_other <= RETRY_OTHER_LIMIT:
-                    time.sleep(2.0)
-                    continue
-            time.sleep(per_job_sleep)
-            return text
-
-        except requests.HTTPError as err:
-            status = getattr(err, "response", None).status_code if getattr(err, "response", None) is not None else -1
-            if status == 429:
-                try_count_429 += 1
-                if try_count_429 < RETRY_429_LIMIT:
-                    print(f"[gemini_call_text_free] HTTP 429 received, retrying... (attempt {try_count_429}/{RETRY_429_LIMIT})")
-                    time.sleep(30.0); continue
-                # disable key và lấy key mới
-                pool.disable_key(key)
-                # Log disabled key with timestamp
-                try:
-                    log_path = "auth_files/disable_log.json"
-                    os.makedirs(os.path.dirname(log_path), exist_ok=True)
-                    log_entry = {"key": key, "disabled_at": time.strftime("%Y-%m-%d %H:%M:%S")}
-                    if os.path.exists(log_path):
-                        with open(log_path, "r", encoding="utf-8") as f:
-                            data = json.load(f)
-                        if not isinstance(data, list):
-                            data = []
+    try:
+        while True:
+            try:
+                payload = _build_payload(system_prompt, user_prompt,
+                                         temperature=temperature, model=cur_model,
+                                         response_mime_type=response_mime_type)
+                print(f"[gemini_call_text_free] Requesting model '{cur_model}' with key '{key}'")
+                t0 = time.monotonic()
+                text, req_usage = _request_once(session, key, cur_model, payload)
+                pool.record_success(key, cur_model, time.monotonic() - t0)
+                _add_usage(usage, req_usage)
+
+                # Nếu model trả "blocked_content" coi như empty
+                if not text or text == "blocked_content":
+                    # cho retry nhẹ nhàng 2 lần
+                    try_count_other += 1
+                    if try_count_other <= RETRY_OTHER_LIMIT:
+                        time.sleep(2.0)
+                        continue
+                if per_job_sleep > 0:
+                    time.sleep(per_job_sleep)
+                return (text, usage) if return_usage else text
+
+            except requests.HTTPError as err:
+                resp = getattr(err, "response", None)
+                status = resp.status_code if resp is not None else -1
+                retry_after = _retry_after_seconds(getattr(resp, "headers", None), getattr(resp, "text", None))
+                if status == 429:
+                    key_429[key] = key_429.get(key, 0) + 1
+                    pool.record_429(key, cur_model)
+                    delay = retry_after if retry_after is not None else _backoff_delay(key_429[key], RETRY_429_BASE_S)
+                    client.limiter.block(key, cur_model, delay)
+                    if key_429[key] >= RETRY_429_LIMIT:
+                        # key liên tục 429 → disable và log
+                        pool.disable_key(key)
+                        _log_disabled_key(key)
                     else:
-                        data = []
-                    data.append(log_entry)
-                    with open(log_path, "w", encoding="utf-8") as f:
-                        json.dump(data, f, ensure_ascii=False, indent=2)
-                except Exception as log_exc:
-                    print(f"Warning: Failed to log disabled key: {log_exc}")
-                new_key = pool.get_key(block=False)
-                if not new_key:
-                    raise
-                key = new_key
-                try_count_429 = 0
-                continue
-            elif status == 503:
-               
-                try_count_other += 1
-                if try_count_other < RETRY_OTHER_LIMIT:
-                    print(f"[gemini_call_text_free] HTTP 503 received, retrying... (attempt {try_count_other}/{RETRY_OTHER_LIMIT})")
-                    time.sleep(60); continue
-                raise
-                
-            else:
-                # non-429 → thử fallback model
-                if cur_model != MODEL_FALLBACK:
-                    cur_model = MODEL_FALLBACK
-                    print(f"[gemini_call_text_free] Fallback sang model '{cur_model}' do HTTP {status}")
-                    time.sleep(3.0)
+                        print(f"[gemini_call_text_free] HTTP 429 on key, blocked {delay:.1f}s (attempt {key_429[key]}/{RETRY_429_LIMIT})")
+                        pool.return_key(key)
+                    # chuyển sang key còn quota (có thể chính key cũ khi hết thời gian chặn)
+                    key = None
+                    try:
+                        key = client.acquire_key(pool, cur_model, est_tokens)
+                    except RuntimeError:
+                        raise err
                     continue
+                pool.record_error(key, cur_model)
+                if status == 503:
+                    try_count_other += 1
+                    if try_count_other < RETRY_OTHER_LIMIT:
+                        delay = retry_after if retry_after is not None else _backoff_delay(try_count_other, RETRY_503_BASE_S)
+                        print(f"[gemini_call_text_free] HTTP 503 received, retrying in {delay:.1f}s... (attempt {try_count_other}/{RETRY_OTHER_LIMIT})")
+                        time.sleep(delay); continue
+                    raise
+
+                else:
+                    # non-429 → thử fallback model
+                    if cur_model != MODEL_FALLBACK:
+                        cur_model = MODEL_FALLBACK
+                        print(f"[gemini_call_text_free] Fallback sang model '{cur_model}' do HTTP {status}")
+                        client.wait_for_quota(key, cur_model, est_tokens)
+                        continue
+                    try_count_other += 1
+                    if try_count_other < RETRY_OTHER_LIMIT:
+                        time.sleep(_backoff_delay(try_count_other, RETRY_NET_BASE_S)); continue
+                    raise
+
+            except (requests.ConnectionError, requests.Timeout):
+                pool.record_error(key, cur_model)
                 try_count_other += 1
                 if try_count_other < RETRY_OTHER_LIMIT:
-                    time.sleep(5.0); continue
+                    time.sleep(_backoff_delay(try_count_other, RETRY_NET_BASE_S)); continue
                 raise
-
-        except (requests.ConnectionError, requests.Timeout):
-            try_count_other += 1
-            if try_count_other < RETRY_OTHER_LIMIT:
-                time.sleep(5.0); continue
-            raise
+    finally:
+        # trả key về pool dùng chung (key đã disable sẽ bị bỏ qua)
+        client.release_key(pool, key)
 
 def gemini_call_json_free(system_prompt: str, user_prompt: str, *,
                      model: Optional[str] = None,
                      temperature: float = 0.3,
-                     per_job_sleep: float = DEFAULT_PER_JOB_SLEEP) -> Any:
+                     per_job_sleep: float = DEFAULT_PER_JOB_SLEEP,
+                     return_usage: bool = False) -> Any:
     """
     Gọi model và bóc JSON an toàn.
-    Mỗi lần gọi sẽ load lại keys từ config để sử dụng key ngẫu nhiên.
+    return_usage=True -> (data, usage), usage gồm cả lần gọi lại.
     """
-    txt = gemini_call_text_free(system_prompt, user_prompt,
+    usage: Dict[str, int] = {}
+    txt, req_usage = gemini_call_text_free(system_prompt, user_prompt,
                            model=model,
                            temperature=temperature,
                            response_mime_type="application/json",
-                           per_job_sleep=per_job_sleep)
+                           per_job_sleep=per_job_sleep,
+                           return_usage=True)
+    _add_usage(usage, req_usage)
     # Một số model vẫn có thể trả text lẫn -> vẫn bóc thông minh
     try:
-        return parse_json_from_model(txt)
+        data = parse_json_from_model(txt)
     except Exception:
         # cố thêm 1 lần không đặt response_mime_type
         print(f"[gemini_call_json_free] Thử lại không đặt response_mime_type")
-        txt2 = gemini_call_text_free(system_prompt, user_prompt,
+        txt2, req_usage = gemini_call_text_free(system_prompt, user_prompt,
                                 model=model,
                                 temperature=temperature,
                                 response_mime_type=None,
-                                per_job_sleep=per_job_sleep)
-        return parse_json_from_model(txt2)
+                                per_job_sleep=per_job_sleep,
+                                return_usage=True)
+        _add_usage(usage, req_usage)
+        data = parse_json_from_model(txt2)
+    return (data, usage) if return_usage else data
+
+# =========================
+# Public: streaming text
+# =========================
+def gemini_stream_text(system_prompt: str, user_prompt: str, *,
+                       model: Optional[str] = None,
+                       temperature: float = 0.3,
+                       usage: Optional[Dict[str, int]] = None) -> Iterator[str]:
+    """
+    Generator trả về từng đoạn text ngay khi server gửi (streamGenerateContent, SSE).
+    Trước khi nhận được đoạn đầu tiên: xoay key khi 429, retry 503/mạng như gemini_call_text_free.
+    Sau khi đã có dữ liệu, lỗi mạng được ném ra để bên gọi giữ phần đã nhận và viết tiếp.
+    Truyền dict vào usage để nhận usageMetadata (đủ khi stream kết thúc).
+    """
+    client = get_gemini_client()
+    pool = client.key_pool()
+    session = client.session
+    est_tokens = _estimate_prompt_tokens(system_prompt, user_prompt)
+    cur_model = model or MODEL_PRIMARY
+    key: Optional[str] = client.acquire_key(pool, cur_model, est_tokens)
+    headers = {"Content-Type": "application/json"}
+
+    key_429: Dict[str, int] = {}
+    try_count_other = 0
+
+    try:
+        while True:
+            started = False
+            try:
+                payload = _build_payload(system_prompt, user_prompt,
+                                         temperature=temperature, model=cur_model)
+                print(f"[gemini_stream_text] Streaming model '{cur_model}' with key '{key}'")
+                t0 = time.monotonic()
+                with session.post(stream_endpoint_for_model(cur_model),
+                                  headers={**headers, "x-goog-api-key": key}, json=payload,
+                                  timeout=(30, TIMEOUT_S), stream=True) as resp:
+                    if resp.status_code >= 400:
+                        raise requests.HTTPError(resp.text, response=resp)
+                    for chunk in _iter_sse_chunks(resp, usage):
+                        started = True
+                        yield chunk
+                pool.record_success(key, cur_model, time.monotonic() - t0)
+                return
+
+            except requests.HTTPError as err:
+                resp = getattr(err, "response", None)
+                status = resp.status_code if resp is not None else -1
+                retry_after = _retry_after_seconds(getattr(resp, "headers", None), getattr(resp, "text", None))
+                if status == 429:
+                    key_429[key] = key_429.get(key, 0) + 1
+                    pool.record_429(key, cur_model)
+                    delay = retry_after if retry_after is not None else _backoff_delay(key_429[key], RETRY_429_BASE_S)
+                    client.limiter.block(key, cur_model, delay)
+                    if key_429[key] >= RETRY_429_LIMIT:
+                        pool.disable_key(key)
+                        _log_disabled_key(key)
+                    else:
+                        pool.return_key(key)
+                    key = None
+                    try:
+                        key = client.acquire_key(pool, cur_model, est_tokens)
+                    except RuntimeError:
+                        raise err
+                    continue
+                pool.record_error(key, cur_model)
+                try_count_other += 1
+                if status == 503 and try_count_other < RETRY_OTHER_LIMIT:
+                    delay = retry_after if retry_after is not None else _backoff_delay(try_count_other, RETRY_503_BASE_S)
+                    print(f"[gemini_stream_text] HTTP 503 received, retrying in {delay:.1f}s... (attempt {try_count_other}/{RETRY_OTHER_LIMIT})")
+                    time.sleep(delay); continue
+                raise
+
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+                pool.record_error(key, cur_model)
+                try_count_other += 1
+                if not started and try_count_other < RETRY_OTHER_LIMIT:
+                    time.sleep(_backoff_delay(try_count_other, RETRY_NET_BASE_S)); continue
+                raise
+    finally:
+        client.release_key(pool, key)
 
 # =========================
 # Public: batch (multi-thread)
@@ -455,17 +1131,16 @@ def gemini_batch(
     Batch nhiều yêu cầu song song.
     calls: [{ "type": "json"/"text", "system": "...", "user": "...", "meta": {...}}, ...]
     Trả: list kết quả có cùng thứ tự: {"ok": True/False, "result": <obj or str>, "error": str|None, "meta": {...}}
-    Mỗi lần gọi sẽ load lại keys từ config để sử dụng key ngẫu nhiên.
+    Mỗi job mượn key qua RateLimiter (key còn quota trước), nên worker không giữ chết 1 key.
     """
-    # Load keys mới mỗi lần gọi để sử dụng key ngẫu nhiên
-    _keys = load_keys()
-    if not _keys: 
+    client = get_gemini_client()
+    pool = client.key_pool()
+    n_alive = pool.alive_count()
+    if n_alive <= 0:
         raise RuntimeError("No API keys provided.")
-    pool = KeyPool(_keys)
-    session = requests.Session()
 
-    n_workers = max_workers if max_workers is not None else len(_keys)
-    n_workers = max(1, min(n_workers, len(_keys)))
+    n_workers = max_workers if max_workers is not None else n_alive
+    n_workers = max(1, min(n_workers, n_alive, len(calls) or 1))
 
     job_q: "queue.Queue[Tuple[int, Dict[str, Any]]]" = queue.Queue()
     for i, c in enumerate(calls):
@@ -474,90 +1149,37 @@ def gemini_batch(
     lock = threading.Lock()
 
     def _worker():
-        key = pool.get_key(block=False)
-        if key is None:
-            return
         while True:
             try:
                 idx, call = job_q.get_nowait()
             except queue.Empty:
-                pool.return_key(key); return
+                return
 
             system = call.get("system") or ""
             user   = call.get("user") or ""
             typ    = (call.get("type") or "text").lower()
             meta   = call.get("meta")
 
-            cur_model = model or MODEL_PRIMARY
-            try_429 = 0
-            try_other = 0
-
-            while True:
-                try:
-                    payload = _build_payload(system, user, temperature=temperature, model=cur_model,
-                                             response_mime_type=("application/json" if typ=="json" else None))
-                    print(f"[gemini_batch] Worker processing job {idx} with key '{key}'")
-                    text = _request_once(session, key, cur_model, payload)
-                    if not text or text == "blocked_content":
-                        try_other += 1
-                        if try_other <= RETRY_OTHER_LIMIT:
-                            time.sleep(2.0); continue
-
-                    if typ == "json":
-                        try:
-                            data = parse_json_from_model(text)
-                        except Exception:
-                            # thêm 1 lần không response_mime_type
-                            payload2 = _build_payload(system, user, temperature=temperature, model=cur_model)
-                            text2 = _request_once(session, key, cur_model, payload2)
-                            data = parse_json_from_model(text2)
-                        with lock:
-                            results[idx] = {"ok": True, "result": data, "error": None, "meta": meta}
-                    else:
-                        with lock:
-                            results[idx] = {"ok": True, "result": text, "error": None, "meta": meta}
-
-                    time.sleep(per_job_sleep)
-                    job_q.task_done()
-                    break
-
-                except requests.HTTPError as err:
-                    status = getattr(err, "response", None).status_code if getattr(err, "response", None) is not None else -1
-                    if status == 429:
-                        try_429 += 1
-                        if try_429 < RETRY_429_LIMIT:
-                            print(f"[gemini_batch] Retry {try_429}/{RETRY_429_LIMIT} for 429")
-                            time.sleep(20.0); continue
-                        pool.disable_key(key)
-                        new_key = pool.get_key(block=False)
-                        if not new_key:
-                            with lock:
-                                results[idx] = {"ok": False, "result": None, "error": f"429 with no key left", "meta": meta}
-                            job_q.task_done(); return
-                        key = new_key
-                        try_429 = 0
-                        continue
-                    
-                    else:
-                        print(f"[gemini_batch] HTTP error {err} on model '{cur_model}'")
-                        if cur_model != MODEL_FALLBACK:
-                            cur_model = MODEL_FALLBACK
-                            print(f"[gemini_batch] Fallback sang model '{cur_model}' do HTTP {status}")
-                            time.sleep(3.0); continue
-                        try_other += 1
-                        if try_other < RETRY_OTHER_LIMIT:
-                            time.sleep(5.0); continue
-                        with lock:
-                            results[idx] = {"ok": False, "result": None, "error": f"HTTP {status}", "meta": meta}
-                        job_q.task_done(); break
-
-                except (requests.ConnectionError, requests.Timeout) as e:
-                    try_other += 1
-                    if try_other < RETRY_OTHER_LIMIT:
-                        time.sleep(5.0); continue
-                    with lock:
-                        results[idx] = {"ok": False, "result": None, "error": f"Net {type(e).__name__}", "meta": meta}
-                    job_q.task_done(); break
+            print(f"[gemini_batch] Worker processing job {idx}")
+            try:
+                if typ == "json":
+                    data = gemini_call_json_free(system, user, model=model,
+                                                 temperature=temperature, per_job_sleep=per_job_sleep)
+                else:
+                    data = gemini_call_text_free(system, user, model=model,
+                                                 temperature=temperature, per_job_sleep=per_job_sleep)
+                out = {"ok": True, "result": data, "error": None, "meta": meta}
+            except requests.HTTPError as err:
+                status = err.response.status_code if err.response is not None else -1
+                print(f"[gemini_batch] HTTP error {err} on job {idx}")
+                out = {"ok": False, "result": None, "error": f"HTTP {status}", "meta": meta}
+            except (requests.ConnectionError, requests.Timeout) as e:
+                out = {"ok": False, "result": None, "error": f"Net {type(e).__name__}", "meta": meta}
+            except Exception as e:
+                out = {"ok": False, "result": None, "error": str(e), "meta": meta}
+            with lock:
+                results[idx] = out
+            job_q.task_done()
 
     threads = []
     for _ in range(n_workers):
@@ -0,0 +1,254 @@
+# key_store.py
+# -*- coding: utf-8 -*-
+"""
+Lưu trạng thái API key trên đĩa cho gemini_client_pool.
+
+  - KeyHealthStore: trạng thái sức khoẻ từng key (latency, tỉ lệ 429/lỗi, cooldown, quota ngày)
+    dạng JSON-lines append-only: mỗi lần cập nhật ghi thêm 1 dòng nhỏ, dòng sau ghi đè dòng trước;
+    file được nén lại (compaction) khi số dòng vượt quá vài lần số key.
+  - DisabledKeyStore: danh sách key bị disable (429 liên tục), append-only, tự bỏ các mục
+    quá cooldown khi compaction, đọc tăng dần (chỉ phần mới ghi thêm) vào index trong bộ nhớ.
+
+Cả hai dùng file lock (fcntl) nên nhiều worker process có thể ghi chung một file.
+Key không bao giờ được ghi nguyên văn: mỗi key được định danh bằng key_fingerprint().
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Any, Dict, Optional, Set
+
+try:
+    import fcntl  # type: ignore
+except ImportError:  # Windows: chỉ khoá trong process
+    fcntl = None  # type: ignore[assignment]
+
+
+def key_fingerprint(key: str) -> str:
+    """Định danh ngắn, không lộ key (sha256, 16 ký tự hex)."""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+class _FileLock:
+    """Khoá độc quyền liên process trên `<path>.lock` (no-op nếu không có fcntl)."""
+
+    def __init__(self, path: str):
+        self.lock_path = path + ".lock"
+        self._fh = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+            self._fh = open(self.lock_path, "a")
+            fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fh is not None:
+            fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+            self._fh.close()
+            self._fh = None
+        return False
+
+
+class KeyHealthStore:
+    """Map fingerprint → dict trạng thái, lưu bằng file JSONL append-only."""
+
+    def __init__(self, path: str, compact_factor: int = 4, min_compact_lines: int = 256):
+        self.path = path
+        self.compact_factor = compact_factor
+        self.min_compact_lines = min_compact_lines
+        self._lock = threading.Lock()
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._lines = 0
+        self._load()
+
+    def _read_file(self):
+        """(fingerprint → trạng thái mới nhất, số dòng hợp lệ) theo nội dung file hiện tại."""
+        states: Dict[str, Dict[str, Any]] = {}
+        lines = 0
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # dòng ghi dở khi crash
+                fp = rec.pop("k", None)
+                if fp:
+                    states[fp] = rec
+                    lines += 1
+        return states, lines
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            self._states, self._lines = self._read_file()
+        except OSError as exc:
+            print(f"Warning: Failed to read key health store: {exc}")
+
+    def get(self, fp: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            state = self._states.get(fp)
+            return dict(state) if state is not None else None
+
+    def put(self, fp: str, state: Dict[str, Any]) -> None:
+        """Ghi trạng thái mới nhất của một key (append 1 dòng, compaction khi cần)."""
+        self.put_many({fp: state})
+
+    def put_many(self, states: Dict[str, Dict[str, Any]]) -> None:
+        """Ghi trạng thái của nhiều key trong một lần lấy file lock."""
+        if not states:
+            return
+        with self._lock:
+            for fp, state in states.items():
+                self._states[fp] = dict(state)
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with _FileLock(self.path):
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write("".join(json.dumps({"k": fp, **state}, ensure_ascii=False, separators=(",", ":")) + "\n"
+                                        for fp, state in states.items()))
+                    self._lines += len(states)
+                    if self._lines > max(self.min_compact_lines, self.compact_factor * len(self._states)):
+                        self._compact_locked()
+            except OSError as exc:
+                print(f"Warning: Failed to write key health store: {exc}")
+
+    def _compact_locked(self):
+        # Đọc lại file dưới file lock: gồm cả các dòng process khác ghi thêm từ lần đọc trước
+        # (dòng sau thắng, như khi load), rồi mới ghi đè.
+        states, _ = self._read_file()
+        for fp, state in self._states.items():
+            states.setdefault(fp, state)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for fp, state in states.items():
+                f.write(json.dumps({"k": fp, **state}, ensure_ascii=False, separators=(",", ":")) + "\n")
+        os.replace(tmp_path, self.path)
+        self._states = states
+        self._lines = len(states)
+
+
+class DisabledKeyStore:
+    """
+    Key bị disable, lưu ở file JSONL append-only: mỗi dòng {"k": fingerprint, "t": epoch}.
+    Index trong bộ nhớ (fingerprint → thời điểm disable gần nhất) được cập nhật bằng cách
+    chỉ đọc phần file mới ghi thêm; các mục quá `cooldown_s` bị loại khi compaction.
+    """
+
+    def __init__(self, path: str, cooldown_s: float, legacy_path: Optional[str] = None,
+                 min_compact_lines: int = 64):
+        self.path = path
+        self.cooldown_s = cooldown_s
+        self.min_compact_lines = min_compact_lines
+        self._lock = threading.Lock()
+        self._index: Dict[str, float] = {}
+        self._offset = 0
+        self._inode = None
+        self._lines = 0
+        if legacy_path and not os.path.exists(path) and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+        self.refresh()
+
+    def _import_legacy(self, legacy_path: str):
+        """Chuyển disable_log.json cũ (mảng {key, disabled_at}) sang định dạng mới, một lần."""
+        now = time.time()
+        entries = []
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for entry in data if isinstance(data, list) else []:
+                key, disabled_at = entry.get("key"), entry.get("disabled_at")
+                if not key or not disabled_at:
+                    continue
+                try:
+                    ts = time.mktime(time.strptime(disabled_at, "%Y-%m-%d %H:%M:%S"))
+                except ValueError:
+                    continue
+                if now - ts < self.cooldown_s:
+                    entries.append({"k": key_fingerprint(key), "t": ts})
+        except Exception as exc:
+            print(f"Warning: Failed to import legacy disable log: {exc}")
+        with _FileLock(self.path):
+            if os.path.exists(self.path):
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                for e in entries:
+                    f.write(json.dumps(e, separators=(",", ":")) + "\n")
+
+    def refresh(self) -> None:
+        """Đọc các dòng mới ghi thêm (hoặc đọc lại toàn bộ nếu file đã bị compaction)."""
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                self._index, self._offset, self._inode, self._lines = {}, 0, None, 0
+                return
+            if st.st_ino != self._inode or st.st_size < self._offset:
+                self._index, self._offset, self._inode, self._lines = {}, 0, st.st_ino, 0
+            if st.st_size == self._offset:
+                return
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                chunk = f.read()
+            end = chunk.rfind(b"\n") + 1  # bỏ dòng ghi dở cuối file
+            for raw in chunk[:end].splitlines():
+                try:
+                    rec = json.loads(raw)
+                except ValueError:
+                    continue
+                fp, ts = rec.get("k"), rec.get("t")
+                if fp and isinstance(ts, (int, float)):
+                    self._index[fp] = max(ts, self._index.get(fp, 0.0))
+                    self._lines += 1
+            self._offset += end
+
+    def disable(self, key: str, at: Optional[float] = None) -> None:
+        """Ghi thêm 1 mục disable; compaction khi phần lớn file là mục hết hạn."""
+        fp = key_fingerprint(key)
+        ts = time.time() if at is None else at
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with _FileLock(self.path):
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"k": fp, "t": ts}, separators=(",", ":")) + "\n")
+                self.refresh()
+                active = len(self.active_fingerprints())
+                if self._lines > max(self.min_compact_lines, 2 * active):
+                    self._compact_locked()
+        except OSError as exc:
+            print(f"Warning: Failed to log disabled key: {exc}")
+            with self._lock:
+                self._index[fp] = ts
+
+    def _compact_locked(self) -> None:
+        now = time.time()
+        with self._lock:
+            live = {fp: ts for fp, ts in self._index.items() if now - ts < self.cooldown_s}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for fp, ts in live.items():
+                    f.write(json.dumps({"k": fp, "t": ts}, separators=(",", ":")) + "\n")
+            os.replace(tmp_path, self.path)
+            st = os.stat(self.path)
+            self._index, self._offset, self._inode, self._lines = live, st.st_size, st.st_ino, len(live)
+
+    def disabled_until(self, key: str) -> float:
+        with self._lock:
+            ts = self._index.get(key_fingerprint(key))
+        return ts + self.cooldown_s if ts is not None else 0.0
+
+    def is_disabled(self, key: str, now: Optional[float] = None) -> bool:
+        return self.disabled_until(key) > (time.time() if now is None else now)
+
+    def active_fingerprints(self, now: Optional[float] = None) -> Set[str]:
+        now = time.time() if now is None else now
+        with self._lock:
+            return {fp for fp, ts in self._index.items() if now - ts < self.cooldown_s}
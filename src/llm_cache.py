@@ -0,0 +1,151 @@
+"""
+Content-addressed on-disk cache of LLM responses.
+
+Entries are keyed by sha256 over (model, temperature, system prompt hash, user
+prompt hash, response mode) and stored one JSON file per key under
+`{cache_dir}/{key[:2]}/{key}.json`. Total size is bounded: once it exceeds
+`max_size_mb`, least recently used entries are deleted (file mtime is the
+access time, so the order survives restarts).
+
+Modes (`llm_cache.mode` in config.yaml):
+  - off: no caching
+  - read_write: tasks with `cache: true` in task_configs are served from and
+    stored to the cache
+  - replay: every call must be served from the cache (any task); a miss raises
+    CacheMiss instead of calling the API
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+CACHE_MODES = ("off", "read_write", "replay")
+
+
+class CacheMiss(RuntimeError):
+    """Raised in replay mode when a request has no cached response."""
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def cache_key(model: str, temperature: float, system_prompt: str, user_prompt: str,
+              response_mode: str = "text") -> str:
+    """Content address of one request."""
+    parts = {
+        'model': model,
+        'temperature': round(float(temperature), 4),
+        'system': _sha256(system_prompt or ""),
+        'user': _sha256(user_prompt or ""),
+        'mode': response_mode,
+    }
+    return _sha256(json.dumps(parts, sort_keys=True))
+
+
+class LLMCache:
+    """Size-bounded LRU response cache on local disk (thread-safe)."""
+
+    def __init__(self, cache_dir: str, max_size_mb: float = 500, mode: str = "read_write"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown llm_cache.mode: {mode} (expected one of {', '.join(CACHE_MODES)})")
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> file size, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._scan()
+
+    @property
+    def replay(self) -> bool:
+        return self.mode == "replay"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _scan(self):
+        """Index existing entries, oldest access first."""
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                found.append((stat.st_mtime, name[:-len('.json')], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total += size
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached entry ({"response", "model", "task_name", ...}) or None."""
+        path = self._path(key)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                os.utime(path)
+            except (OSError, ValueError):
+                # Deleted or corrupted behind our back: forget it
+                self._total -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, response: str, **meta):
+        """Store a response (meta: model, task_name, ... kept for inspection), evicting LRU entries."""
+        path = self._path(key)
+        data = json.dumps({'response': response, 'stored_at': time.time(), **meta},
+                          ensure_ascii=False).encode('utf-8')
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self._total -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._total += len(data)
+            self._evict()
+
+    def _evict(self):
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._total,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+def open_llm_cache(config: Dict[str, Any], logger) -> Optional[LLMCache]:
+    """LLMCache configured by `llm_cache`, or None when the mode is "off"."""
+    cache_config = config.get('llm_cache', {})
+    mode = cache_config.get('mode', 'off')
+    if mode == 'off':
+        return None
+    cache = LLMCache(
+        cache_config.get('dir', 'cache/llm'),
+        max_size_mb=cache_config.get('max_size_mb', 500),
+        mode=mode
+    )
+    logger.info(f"LLM cache ({mode}) at {cache.cache_dir}: {cache.stats()['entries']} entries")
+    return cache
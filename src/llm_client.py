@@ -3,9 +3,11 @@ LLM client wrapper for story generation system.
 Sử dụng Gemini API thông qua gemini_client_pool.
 """
 import os
+import json
 import time
-from typing import Dict, Any, Optional
-from src.gemini_client_pool import gemini_call_text_free, gemini_call_json_free
+from typing import Dict, Any, Optional, Iterator
+from src.gemini_client_pool import gemini_call_text_free, gemini_call_json_free, gemini_stream_text
+from src.llm_cache import CacheMiss, cache_key, open_llm_cache
 
 
 class LLMClient:
@@ -18,8 +20,12 @@ class LLMClient:
         self.default_config = config.get('default_llm', {})
         self.task_configs = config.get('task_configs', {})
         
-        # Không cần load keys ở đây nữa, mỗi lần call API sẽ tự động load keys ngẫu nhiên
-        self.logger.info("LLMClient initialized. Keys will be loaded dynamically on each API call.")
+        # Keys + HTTP session dùng chung được quản lý bởi gemini_client_pool.get_gemini_client()
+        self.logger.info("LLMClient initialized. Using shared Gemini client (keys reloaded on file change).")
+        # Optional response cache (llm_cache in config; None = off)
+        self.cache = open_llm_cache(config, logger)
+        # Optional ReplayIndex serving recorded responses instead of the API (see use_replay)
+        self.replay = None
     
     def call(self, prompt: str, task_name: str = "default", 
              system_message: Optional[str] = None, 
@@ -42,156 +48,323 @@ class LLMClient:
         Returns:
             Dictionary containing response, tokens, cost, and duration
         """
-        # Get task-specific configuration
-        task_config = self.task_configs.get(task_name, {})
-        
-        # Merge configurations (kwargs > task_config > default_config)
-        llm_config = {**self.default_config, **task_config, **kwargs}
-        
-        model = llm_config.get('model', 'gemini-2.5-flash')
-        temperature = llm_config.get('temperature', 0.7)
+        model, temperature = self._resolve_model(task_name, kwargs)
         
         # System message
         sys_msg = system_message or ""
         
+        response_mode = "json" if return_json else "text"
+        cached = self._from_cache(task_name, model, temperature, sys_msg, prompt, response_mode,
+                                  batch_id, chapter_id)
+        if cached is not None:
+            return cached
+        
         # Call API with exception handling
         start_time = time.time()
-        response_text = None
-        error = None
         
         try:
             self.logger.info(f"Calling Gemini API: model={model}, task={task_name}, batch={batch_id}, chapter={chapter_id}")
             
             if return_json:
-                # Không cần truyền keys, sẽ tự động load từ config
-                response_data = gemini_call_json_free(
+                response_data, usage = gemini_call_json_free(
                     system_prompt=sys_msg,
                     user_prompt=prompt,
                     model=model,
                     temperature=temperature,
-                    per_job_sleep=0.1  # Giảm sleep time
+                    per_job_sleep=0,  # RateLimiter lo nhịp gọi
+                    return_usage=True
                 )
                 # Convert to string for consistent handling
-                import json
                 response_text = json.dumps(response_data, ensure_ascii=False)
             else:
-                # Không cần truyền keys, sẽ tự động load từ config
-                response_text = gemini_call_text_free(
+                response_text, usage = gemini_call_text_free(
                     system_prompt=sys_msg,
                     user_prompt=prompt,
                     model=model,
                     temperature=temperature,
-                    per_job_sleep=0.1
+                    per_job_sleep=0,
+                    return_usage=True
                 )
-            
-            duration = time.time() - start_time
-            
-            # Estimate tokens (rough estimate for Gemini)
-            input_tokens = self._estimate_tokens(sys_msg + prompt)
-            output_tokens = self._estimate_tokens(response_text)
-            total_tokens = input_tokens + output_tokens
-            
-            # Calculate cost (Gemini pricing)
-            cost = self._calculate_gemini_cost(model, input_tokens, output_tokens)
-            
-            # Track cost
-            self.cost_tracker.add_call(
-                model=model,
-                input_tokens=input_tokens,
-                output_tokens=output_tokens,
-                step=task_name,
-                duration=duration
-            )
-            
-            # Log to main log
-            self.logger.log_llm_call(
-                step=task_name,
-                prompt=prompt,
-                response=response_text,
-                tokens={
-                    'input': input_tokens,
-                    'output': output_tokens,
-                    'total': total_tokens
-                },
-                cost=cost,
-                duration=duration
-            )
-            
-            # Log detailed request to separate file
-            self.logger.log_llm_request(
-                task_name=task_name,
-                system_prompt=sys_msg,
-                user_prompt=prompt,
-                response=response_text,
-                error=None,
-                batch_id=batch_id,
-                chapter_id=chapter_id,
-                tokens={
-                    'input': input_tokens,
-                    'output': output_tokens,
-                    'total': total_tokens
-                },
-                cost=cost,
-                duration=duration,
-                model=model
-            )
-            
-            return {
-                'response': response_text,
-                'tokens': {
-                    'input': input_tokens,
-                    'output': output_tokens,
-                    'total': total_tokens
-                },
-                'cost': cost,
-                'duration': duration,
-                'model': model
-            }
-            
         except Exception as e:
-            duration = time.time() - start_time
-            error = str(e)
-            
-            # Log error to main log
-            self.logger.error(f"LLM API call failed: {error}")
+            self._record_failure(e, task_name, sys_msg, prompt, batch_id, chapter_id, model)
+            raise
+        
+        result = self._record_success(response_text, time.time() - start_time, task_name,
+                                      sys_msg, prompt, batch_id, chapter_id, model, usage)
+        self._to_cache(task_name, model, temperature, sys_msg, prompt, response_mode, response_text)
+        return result
+    
+    async def acall(self, prompt: str, task_name: str = "default",
+                    system_message: Optional[str] = None,
+                    return_json: bool = False,
+                    batch_id: Optional[int] = None,
+                    chapter_id: Optional[int] = None,
+                    **kwargs) -> Dict[str, Any]:
+        """
+        Async counterpart of call(): same arguments and return value, but the
+        request, retries and backoff run on the event loop (see gemini_async_pool).
+        Cancelling the awaiting task cancels the in-flight request.
+        """
+        from src.gemini_async_pool import async_gemini_call_text, async_gemini_call_json
+        
+        model, temperature = self._resolve_model(task_name, kwargs)
+        sys_msg = system_message or ""
+        response_mode = "json" if return_json else "text"
+        cached = self._from_cache(task_name, model, temperature, sys_msg, prompt, response_mode,
+                                  batch_id, chapter_id)
+        if cached is not None:
+            return cached
+        start_time = time.time()
+        
+        try:
+            self.logger.info(f"Calling Gemini API (async): model={model}, task={task_name}, batch={batch_id}, chapter={chapter_id}")
             
-            # Log error to separate file with prompts
-            self.logger.log_llm_error(
-                task_name=task_name,
+            if return_json:
+                response_data, usage = await async_gemini_call_json(
+                    system_prompt=sys_msg,
+                    user_prompt=prompt,
+                    model=model,
+                    temperature=temperature,
+                    per_job_sleep=0,
+                    return_usage=True
+                )
+                response_text = json.dumps(response_data, ensure_ascii=False)
+            else:
+                response_text, usage = await async_gemini_call_text(
+                    system_prompt=sys_msg,
+                    user_prompt=prompt,
+                    model=model,
+                    temperature=temperature,
+                    per_job_sleep=0,
+                    return_usage=True
+                )
+        except Exception as e:
+            self._record_failure(e, task_name, sys_msg, prompt, batch_id, chapter_id, model)
+            raise
+        
+        result = self._record_success(response_text, time.time() - start_time, task_name,
+                                      sys_msg, prompt, batch_id, chapter_id, model, usage)
+        self._to_cache(task_name, model, temperature, sys_msg, prompt, response_mode, response_text)
+        return result
+    
+    def stream(self, prompt: str, task_name: str = "default",
+               system_message: Optional[str] = None,
+               batch_id: Optional[int] = None,
+               chapter_id: Optional[int] = None,
+               resume_text: str = "",
+               resume_prompt: Optional[str] = None,
+               info: Optional[Dict[str, Any]] = None,
+               **kwargs) -> Iterator[str]:
+        """
+        Stream a text response chunk by chunk.
+        
+        Tokens, cost and request logs are recorded once the stream completes;
+        on failure the error is logged and the exception is re-raised so the
+        caller can salvage what it received.
+        
+        To finish an interrupted response, pass the text received so far as
+        `resume_text` and the request to send instead as `resume_prompt`: only
+        the continuation is streamed, but the log and cache record the whole
+        response (`resume_text` + continuation) under the original `prompt`.
+        A response served from cache/replay is always complete; it sets
+        `info['cached']` so the caller can drop its partial text.
+        """
+        model, temperature = self._resolve_model(task_name, kwargs)
+        sys_msg = system_message or ""
+        cached = self._from_cache(task_name, model, temperature, sys_msg, prompt, "text",
+                                  batch_id, chapter_id)
+        if cached is not None:
+            if info is not None:
+                info['cached'] = True
+            yield cached['response']
+            return
+        request_prompt = resume_prompt if resume_text and resume_prompt else prompt
+        start_time = time.time()
+        parts = []
+        usage: Dict[str, int] = {}
+        
+        self.logger.info(f"Streaming Gemini API: model={model}, task={task_name}, batch={batch_id}, chapter={chapter_id}")
+        try:
+            for chunk in gemini_stream_text(
                 system_prompt=sys_msg,
-                user_prompt=prompt,
-                error=error,
-                batch_id=batch_id,
-                chapter_id=chapter_id,
-                model=model
-            )
-            
+                user_prompt=request_prompt,
+                model=model,
+                temperature=temperature,
+                usage=usage
+            ):
+                parts.append(chunk)
+                yield chunk
+        except Exception as e:
+            self._record_failure(e, task_name, sys_msg, request_prompt, batch_id, chapter_id, model)
             raise
+        
+        response_text = resume_text + "".join(parts)
+        self._record_success(response_text, time.time() - start_time, task_name,
+                             sys_msg, prompt, batch_id, chapter_id, model, usage)
+        self._to_cache(task_name, model, temperature, sys_msg, prompt, "text", response_text)
+    
+    def use_replay(self, replay_index):
+        """Serve every call from a ReplayIndex of recorded responses (no API calls; misses raise CacheMiss)."""
+        self.replay = replay_index
+    
+    def model_for_task(self, task_name: str) -> str:
+        """Model configured for a task."""
+        return self._resolve_model(task_name, {})[0]
+    
+    def _resolve_model(self, task_name: str, overrides: Dict[str, Any]):
+        """Resolve (model, temperature) for a task: kwargs > task_config > default_config."""
+        task_config = self.task_configs.get(task_name, {})
+        llm_config = {**self.default_config, **task_config, **overrides}
+        return llm_config.get('model', 'gemini-2.5-flash'), llm_config.get('temperature', 0.7)
+    
+    def _cacheable(self, task_name: str) -> bool:
+        """Per-task cache policy: `cache: true` in the task's task_configs entry."""
+        return bool(self.task_configs.get(task_name, {}).get('cache', False))
+    
+    def _from_cache(self, task_name: str, model: str, temperature: float, sys_msg: str, prompt: str,
+                    response_mode: str, batch_id: Optional[int],
+                    chapter_id: Optional[int]) -> Optional[Dict[str, Any]]:
+        """
+        Cached call result, or None to call the API.
+        
+        With a replay index (use_replay) or in cache replay mode every task is
+        looked up and a miss raises CacheMiss.
+        """
+        if self.replay is not None:
+            response_text = self.replay.lookup(sys_msg, prompt, task_name, batch_id, chapter_id)
+            if response_text is None:
+                raise CacheMiss(f"No recorded response for task={task_name}, model={model}, "
+                                f"batch={batch_id}, chapter={chapter_id} in {self.replay.llm_logs_dir}")
+            return self._cached_result(response_text, sys_msg, prompt, model)
+        if self.cache is None or not (self.cache.replay or self._cacheable(task_name)):
+            return None
+        entry = self.cache.get(cache_key(model, temperature, sys_msg, prompt, response_mode))
+        if entry is None:
+            if self.cache.replay:
+                raise CacheMiss(f"No cached response for task={task_name}, model={model}, "
+                                f"batch={batch_id}, chapter={chapter_id} (llm_cache.mode is replay)")
+            return None
+        self.logger.info(f"LLM cache hit: model={model}, task={task_name}, batch={batch_id}, chapter={chapter_id}")
+        return self._cached_result(entry['response'], sys_msg, prompt, model)
+    
+    def _cached_result(self, response_text: str, sys_msg: str, prompt: str, model: str) -> Dict[str, Any]:
+        """Call result for a response served without an API call (no cost recorded)."""
+        return {
+            'response': response_text,
+            'tokens': self._token_counts(sys_msg, prompt, response_text, None),
+            'cost': 0.0,
+            'duration': 0.0,
+            'model': model,
+            'cached': True
+        }
+    
+    def _to_cache(self, task_name: str, model: str, temperature: float, sys_msg: str, prompt: str,
+                  response_mode: str, response_text: str):
+        if self.cache is None or self.cache.replay or self.replay is not None or not self._cacheable(task_name):
+            return
+        self.cache.put(cache_key(model, temperature, sys_msg, prompt, response_mode), response_text,
+                       model=model, task_name=task_name)
+    
+    def _record_success(self, response_text: str, duration: float, task_name: str,
+                        sys_msg: str, prompt: str, batch_id: Optional[int],
+                        chapter_id: Optional[int], model: str,
+                        usage: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """Track tokens/cost, write logs and build the call result."""
+        tokens = self._token_counts(sys_msg, prompt, response_text, usage)
+        
+        # Track cost (cost_tracking.pricing, USD per 1M tokens; 0 when tracking is disabled)
+        cost = self.cost_tracker.add_call(
+            model=model,
+            input_tokens=tokens['input'],
+            output_tokens=tokens['output'],
+            step=task_name,
+            duration=duration,
+            thoughts_tokens=tokens['thoughts'],
+            cached_tokens=tokens['cached']
+        )
+        
+        # Log to main log
+        self.logger.log_llm_call(
+            step=task_name,
+            prompt=prompt,
+            response=response_text,
+            tokens=tokens,
+            cost=cost,
+            duration=duration
+        )
+        
+        # Log detailed request to separate file
+        self.logger.log_llm_request(
+            task_name=task_name,
+            system_prompt=sys_msg,
+            user_prompt=prompt,
+            response=response_text,
+            error=None,
+            batch_id=batch_id,
+            chapter_id=chapter_id,
+            tokens=tokens,
+            cost=cost,
+            duration=duration,
+            model=model
+        )
+        
+        return {
+            'response': response_text,
+            'tokens': tokens,
+            'cost': cost,
+            'duration': duration,
+            'model': model
+        }
+    
+    def _record_failure(self, exc: Exception, task_name: str, sys_msg: str, prompt: str,
+                        batch_id: Optional[int], chapter_id: Optional[int], model: str):
+        """Log a failed call (main log + request log with prompts)."""
+        error = str(exc)
+        
+        # Log error to main log
+        self.logger.error(f"LLM API call failed: {error}")
+        
+        # Log error to separate file with prompts
+        self.logger.log_llm_error(
+            task_name=task_name,
+            system_prompt=sys_msg,
+            user_prompt=prompt,
+            error=error,
+            batch_id=batch_id,
+            chapter_id=chapter_id,
+            model=model
+        )
+    
+    def _token_counts(self, sys_msg: str, prompt: str, response_text: str,
+                      usage: Optional[Dict[str, int]]) -> Dict[str, Any]:
+        """
+        Token counts of a call: exact counts from the response's usageMetadata,
+        or a length-based estimate (flagged 'estimated') when there is none.
+        """
+        if usage and usage.get('total'):
+            return {
+                'input': usage.get('input', 0),
+                'output': usage.get('output', 0),
+                'thoughts': usage.get('thoughts', 0),
+                'cached': usage.get('cached', 0),
+                'total': usage['total']
+            }
+        input_tokens = self._estimate_tokens(sys_msg + prompt)
+        output_tokens = self._estimate_tokens(response_text)
+        return {
+            'input': input_tokens,
+            'output': output_tokens,
+            'thoughts': 0,
+            'cached': 0,
+            'total': input_tokens + output_tokens,
+            'estimated': True
+        }
     
     def _estimate_tokens(self, text: str) -> int:
-        """Estimate tokens for Gemini (rough approximation)."""
+        """Estimate tokens for Gemini (rough approximation, used when a response has no usageMetadata)."""
         # Gemini uses similar tokenization to GPT
         # Rough estimate: ~4 chars per token for English, ~2-3 for Vietnamese
         if not text:
             return 0
         # Use 2.5 chars per token as average for Vietnamese
         return int(len(text) / 2.5)
-    
-    def _calculate_gemini_cost(self, model: str, input_tokens: int, output_tokens: int) -> float:
-        """Calculate cost for Gemini API calls."""
-        # Gemini 2.5 Flash pricing (as of 2025)
-        # Free tier: very generous limits
-        # Paid: $0.075 per 1M input tokens, $0.30 per 1M output tokens for Flash
-        # Pro: $1.25 per 1M input tokens, $5.00 per 1M output tokens
-        
-        if 'pro' in model.lower():
-            input_cost_per_1m = 1.25
-            output_cost_per_1m = 5.00
-        else:  # flash or other
-            input_cost_per_1m = 0.075
-            output_cost_per_1m = 0.30
-        
-        input_cost = (input_tokens / 1_000_000) * input_cost_per_1m
-        output_cost = (output_tokens / 1_000_000) * output_cost_per_1m
-        
-        return input_cost + output_cost
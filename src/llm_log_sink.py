@@ -0,0 +1,204 @@
+"""
+Batched, compressed LLM request log.
+
+Instead of one .txt file per call, request records are handed to a background
+writer thread through a bounded queue and appended to rotating segment files
+in `logs/llm_requests/`:
+
+  - `requests_00001.jsonl.gz`, ...: each record is one JSON line compressed as
+    its own gzip member, so a segment is a valid gzip file and any record can
+    be read on its own from its offset
+  - `index.jsonl`: one line per record {segment, offset, length, task, batch,
+    chapter, timestamp, error}, written after the record's bytes are flushed
+
+A record torn by a crash is never indexed, so readers that go through the
+index (iter_records) only see complete records. Records written after close()
+(e.g. from atexit handlers or background threads during shutdown) are appended
+directly by the calling thread.
+"""
+import os
+import json
+import gzip
+import queue
+import atexit
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+
+SEGMENT_PREFIX = "requests_"
+SEGMENT_SUFFIX = ".jsonl.gz"
+INDEX_FILE = "index.jsonl"
+
+_STOP = object()
+
+
+class LLMLogSink:
+    """Append-only gzip JSON-lines request log written by a background thread."""
+
+    def __init__(self, log_dir: str, segment_max_mb: float = 64, queue_size: int = 1000):
+        self.log_dir = log_dir
+        self.segment_max_bytes = int(segment_max_mb * 1024 * 1024)
+        os.makedirs(log_dir, exist_ok=True)
+        # put() blocks when the writer falls this far behind, rather than dropping records
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._segment = self._last_segment()
+        self._closed = False
+        # Orders write() against close(), and serialises direct appends once closed
+        self._state_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="llm-log-sink", daemon=True)
+        self._thread.start()
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.log_dir, f"{SEGMENT_PREFIX}{number:05d}{SEGMENT_SUFFIX}")
+
+    @staticmethod
+    def _close_segment(f):
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    def _last_segment(self) -> int:
+        numbers = [int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.log_dir)
+                   if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)]
+        return max(numbers, default=1)
+
+    def write(self, record: Dict[str, Any]):
+        """Queue a record (a JSON-serializable dict) for writing; written directly once closed."""
+        with self._state_lock:
+            if not self._closed:
+                self._queue.put(record)
+                return
+            try:
+                self._append([record])
+            except Exception as e:
+                print(f"LLM log sink failed to write a record after close: {e}")
+
+    def flush(self):
+        """Block until every queued record is on disk."""
+        self._queue.join()
+
+    def close(self):
+        """Write out queued records and stop the writer thread."""
+        with self._state_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Drain whatever else is waiting so it goes out in one write/flush
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(item is _STOP for item in batch)
+            records = [item for item in batch if item is not _STOP]
+            try:
+                if records:
+                    self._append(records)
+            except Exception as e:
+                # Logging must never take the pipeline down; report and keep going
+                print(f"LLM log sink failed to write {len(records)} records: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _append(self, records):
+        index_lines = []
+        f = open(self._segment_path(self._segment), 'ab')
+        try:
+            for record in records:
+                if f.tell() >= self.segment_max_bytes:
+                    self._close_segment(f)
+                    self._segment += 1
+                    f = open(self._segment_path(self._segment), 'ab')
+                line = json.dumps(record, ensure_ascii=False) + "\n"
+                member = gzip.compress(line.encode('utf-8'))
+                offset = f.tell()
+                f.write(member)
+                index_lines.append(json.dumps({
+                    'segment': os.path.basename(f.name),
+                    'offset': offset,
+                    'length': len(member),
+                    'task': record.get('task'),
+                    'batch': record.get('batch'),
+                    'chapter': record.get('chapter'),
+                    'timestamp': record.get('timestamp'),
+                    'error': bool(record.get('error')),
+                }, ensure_ascii=False))
+        finally:
+            self._close_segment(f)
+        index_path = os.path.join(self.log_dir, INDEX_FILE)
+        with open(index_path, 'a+b') as f:
+            # Start on a fresh line if a previous write was cut off
+            prefix = b""
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                prefix = b"" if f.read(1) == b"\n" else b"\n"
+            f.write(prefix + ("\n".join(index_lines) + "\n").encode('utf-8'))
+
+
+_sinks: Dict[str, LLMLogSink] = {}
+_sinks_lock = threading.Lock()
+
+
+def iter_index(log_dir: str) -> Iterator[Dict[str, Any]]:
+    """Index entries of a log directory, in write order (records still queued in this process included)."""
+    with _sinks_lock:
+        sink = _sinks.get(os.path.abspath(log_dir))
+    if sink is not None:
+        sink.flush()
+    path = os.path.join(log_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # partial last line
+
+
+def read_record(log_dir: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    """The full record an index entry points to."""
+    with open(os.path.join(log_dir, entry['segment']), 'rb') as f:
+        f.seek(entry['offset'])
+        return json.loads(gzip.decompress(f.read(entry['length'])).decode('utf-8'))
+
+
+def iter_records(log_dir: str, task: Optional[str] = None, chapter: Optional[int] = None,
+                 batch: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Full records, optionally filtered by task/chapter/batch through the index."""
+    for entry in iter_index(log_dir):
+        if task is not None and entry.get('task') != task:
+            continue
+        if chapter is not None and entry.get('chapter') != chapter:
+            continue
+        if batch is not None and entry.get('batch') != batch:
+            continue
+        yield read_record(log_dir, entry)
+
+
+def get_llm_log_sink(log_dir: str, segment_max_mb: float = 64, queue_size: int = 1000) -> LLMLogSink:
+    """The process-wide sink for a directory (one writer per directory)."""
+    key = os.path.abspath(log_dir)
+    with _sinks_lock:
+        if key not in _sinks:
+            _sinks[key] = LLMLogSink(log_dir, segment_max_mb, queue_size)
+        return _sinks[key]
+
+
+@atexit.register
+def close_all_sinks():
+    """Flush and stop every sink (runs at interpreter exit)."""
+    with _sinks_lock:
+        # Closed sinks stay registered: later writes append directly instead of starting a new writer
+        sinks = list(_sinks.values())
+    for sink in sinks:
+        sink.close()
@@ -0,0 +1,127 @@
+"""
+Offline replay of recorded LLM responses.
+
+Logger.log_llm_request records every request in `logs/llm_requests/`, either
+in the segment log (see llm_log_sink) or, in the older format, as one .txt
+file per call (header lines, then SYSTEM PROMPT / USER PROMPT / RESPONSE /
+ERROR / METRICS sections). ReplayIndex reads both and serves the recorded
+response for a request:
+
+  1. by prompt hash: sha256 of the system prompt and of the user prompt
+  2. otherwise by step: same task, batch, chapter and system prompt. This
+     covers prompts that embed state which a replayed run rebuilds in a
+     slightly different order (e.g. the existing-entity list).
+
+When a request was recorded more than once, the latest response wins.
+"""
+import os
+import re
+import hashlib
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from src.llm_log_sink import iter_records
+
+
+_RULE = "-" * 80
+_SECTION_RE = re.compile(
+    r"\n\n" + _RULE + r"\n(SYSTEM PROMPT|USER PROMPT|RESPONSE|ERROR|METRICS):\n" + _RULE + r"\n"
+)
+_HEADER_RE = re.compile(r"^(Timestamp|Project ID|Task|Batch|Chapter|Model): (.*)$", re.MULTILINE)
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256((text or "").encode('utf-8')).hexdigest()
+
+
+def parse_request_log(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse one request log file.
+
+    Returns:
+        {"timestamp", "task", "batch", "chapter", "model", "system_prompt",
+         "user_prompt", "response", "error"} or None if the text is not a request log
+    """
+    parts = _SECTION_RE.split(text)
+    if len(parts) < 5:
+        return None
+    header = dict(_HEADER_RE.findall(parts[0]))
+    sections = dict(zip(parts[1::2], parts[2::2]))
+    if 'SYSTEM PROMPT' not in sections or 'USER PROMPT' not in sections:
+        return None
+
+    def number(value: Optional[str]) -> Optional[int]:
+        return int(value) if value and value.strip().isdigit() else None
+
+    return {
+        'timestamp': header.get('Timestamp', ''),
+        'task': header.get('Task'),
+        'batch': number(header.get('Batch')),
+        'chapter': number(header.get('Chapter')),
+        'model': header.get('Model'),
+        'system_prompt': sections['SYSTEM PROMPT'],
+        'user_prompt': sections['USER PROMPT'],
+        'response': sections.get('RESPONSE'),
+        'error': sections.get('ERROR'),
+    }
+
+
+def iter_request_logs(llm_logs_dir: str) -> Iterator[Dict[str, Any]]:
+    """Request records of a directory: segment log records, then parsed .txt files (unparseable ones skipped)."""
+    if not os.path.isdir(llm_logs_dir):
+        return
+    yield from iter_records(llm_logs_dir)
+    for name in sorted(os.listdir(llm_logs_dir)):
+        if not name.endswith('.txt'):
+            continue
+        with open(os.path.join(llm_logs_dir, name), 'r', encoding='utf-8') as f:
+            record = parse_request_log(f.read())
+        if record is not None:
+            yield record
+
+
+class ReplayIndex:
+    """Recorded responses of a project, looked up by prompt hash or by step."""
+
+    def __init__(self, llm_logs_dir: str, logger=None):
+        self.llm_logs_dir = llm_logs_dir
+        self.logger = logger
+        self._by_prompt: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        self._by_step: Dict[Tuple[Any, ...], Tuple[str, str]] = {}
+        self.records = 0
+        self.exact_hits = 0
+        self.step_hits = 0
+        self.misses = 0
+        for record in iter_request_logs(llm_logs_dir):
+            if record['response'] is None:
+                continue  # failed request
+            self.records += 1
+            entry = (record['timestamp'], record['response'])
+            system_hash = _sha256(record['system_prompt'])
+            for index, key in ((self._by_prompt, (system_hash, _sha256(record['user_prompt']))),
+                               (self._by_step, (record['task'], record['batch'], record['chapter'], system_hash))):
+                if key not in index or index[key][0] <= entry[0]:
+                    index[key] = entry
+        if logger is not None:
+            logger.info(f"Replay index: {self.records} recorded responses from {llm_logs_dir}")
+
+    def lookup(self, system_prompt: str, user_prompt: str, task_name: Optional[str] = None,
+               batch_id: Optional[int] = None, chapter_id: Optional[int] = None) -> Optional[str]:
+        """Recorded response for a request, or None."""
+        system_hash = _sha256(system_prompt)
+        entry = self._by_prompt.get((system_hash, _sha256(user_prompt)))
+        if entry is not None:
+            self.exact_hits += 1
+            return entry[1]
+        entry = self._by_step.get((task_name, batch_id, chapter_id, system_hash))
+        if entry is not None:
+            self.step_hits += 1
+            if self.logger is not None:
+                self.logger.warning(f"Replay: prompt for task={task_name}, batch={batch_id}, chapter={chapter_id} "
+                                    f"differs from the recording; using the recorded response of that step")
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        return {'records': self.records, 'exact_hits': self.exact_hits,
+                'step_hits': self.step_hits, 'misses': self.misses}
@@ -0,0 +1,143 @@
+"""
+Local entity mention scanner (Aho–Corasick).
+
+Known entity names and aliases are compiled into one automaton; a chapter is
+normalized the same way as names (see name_normalizer) and scanned in a single
+linear pass, reporting how often each entity is mentioned. Only whole-word
+matches count ("an" does not match inside "bình an").
+"""
+import re
+import unicodedata
+from collections import deque
+from typing import Dict, Hashable, Iterable, List, Optional, Set
+
+from src.name_normalizer import normalize_name
+
+
+_PUNCT_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Chapter text in the same form as normalized names (NFC, lowercase, punctuation as spaces)."""
+    text = unicodedata.normalize("NFC", text).lower()
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", text)).strip()
+
+
+class AhoCorasick:
+    """Multi-pattern matcher; patterns can be added at any time, links are rebuilt lazily."""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Set[Hashable]] = [set()]
+        # pattern length per value at each terminal node, for boundary checks
+        self._lengths: List[Dict[Hashable, int]] = [{}]
+        # nearest proper suffix node that is terminal (0 = none), to visit every pattern ending here
+        self._out_link: List[int] = [0]
+        self._dirty = False
+
+    def add(self, pattern: str, value: Hashable):
+        """Register `value` to be reported whenever `pattern` occurs."""
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(set())
+                self._lengths.append({})
+                self._out_link.append(0)
+            node = nxt
+        self._lengths[node][value] = len(pattern)
+        self._dirty = True
+
+    def _build(self):
+        """Compute failure links and merged outputs (BFS over the trie)."""
+        for node in range(len(self._out)):
+            self._out[node] = set(self._lengths[node])
+        queue = deque()
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0) if self._goto[fail].get(ch, 0) != child else 0
+                self._out[child] |= self._out[self._fail[child]]
+                suffix = self._fail[child]
+                self._out_link[child] = suffix if self._lengths[suffix] else self._out_link[suffix]
+        self._dirty = False
+
+    def count(self, text: str) -> Dict[Hashable, int]:
+        """
+        Whole-word occurrence counts per value in `text` (already normalized).
+        
+        Nested aliases of one value count once: a match inside a longer match of
+        the same value ("lâm" within "lâm phong") is dropped.
+        """
+        if self._dirty:
+            self._build()
+        counts: Dict[Hashable, int] = {}
+        # start offsets of counted matches per value (ends only grow, so containment is a stack check)
+        starts: Dict[Hashable, List[int]] = {}
+        node = 0
+        size = len(text)
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            if not self._out[node]:
+                continue
+            # Match must end at a word boundary
+            if i + 1 < size and text[i + 1] != " ":
+                continue
+            # Every pattern ending here, longest first: a value whose longer alias fails the
+            # start boundary may still match through a shorter one ("lâm phong" / "phong")
+            matched = set()
+            terminal = node if self._lengths[node] else self._out_link[node]
+            while terminal:
+                for value, length in self._lengths[terminal].items():
+                    if value in matched:
+                        continue
+                    start = i + 1 - length
+                    if start == 0 or text[start - 1] == " ":
+                        matched.add(value)
+                        counted = starts.setdefault(value, [])
+                        while counted and counted[-1] >= start:
+                            counted.pop()
+                            counts[value] -= 1
+                        counted.append(start)
+                        counts[value] = counts.get(value, 0) + 1
+                terminal = self._out_link[terminal]
+        return counts
+
+
+class MentionScanner:
+    """Counts entity mentions in chapter text; entity ids are caller-defined hashables."""
+
+    def __init__(self, min_chars: int = 2):
+        self.min_chars = min_chars
+        self._automaton = AhoCorasick()
+        self._patterns: Set[tuple] = set()
+
+    def add_entity(self, entity_id: Hashable, names: Iterable[str]):
+        """Register an entity under its name and aliases (idempotent)."""
+        for name in names:
+            pattern = normalize_name(name)
+            if len(pattern) < self.min_chars or (pattern, entity_id) in self._patterns:
+                continue
+            self._patterns.add((pattern, entity_id))
+            self._automaton.add(pattern, entity_id)
+
+    def scan(self, text: str) -> Dict[Hashable, int]:
+        """Mention count per entity id in a chapter."""
+        return self._automaton.count(normalize_text(text))
@@ -0,0 +1,116 @@
+"""
+Vietnamese-aware normalization of entity names.
+
+  - normalize_name(): NFC, lowercase, drop parenthesised qualifiers
+    ("Lăng Hàn (thiếu niên)"), collapse punctuation/whitespace and strip
+    honorific titles ("Trưởng lão X", "X tiền bối")
+  - fold_diacritics(): diacritic-insensitive key ("lăng hàn" -> "lang han")
+  - TrigramIndex: candidate lookup for near-duplicate spellings
+"""
+import re
+import difflib
+import unicodedata
+from typing import Dict, Iterable, List, Set, Tuple
+
+
+# Titles stripped from the start or end of a name (already normalized form)
+TITLES = (
+    "trưởng lão", "tông chủ", "môn chủ", "các chủ", "bang chủ", "cung chủ", "gia chủ",
+    "sư phụ", "sư tôn", "sư huynh", "sư đệ", "sư tỷ", "sư muội", "sư thúc", "sư bá",
+    "tiền bối", "đại nhân", "chân nhân", "công tử", "tiểu thư", "thiếu gia", "lão tổ",
+)
+
+_PARENS_RE = re.compile(r"[\(\[\{][^\)\]\}]*[\)\]\}]")
+_PUNCT_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+_DIGITS_RE = re.compile(r"\d+")
+
+
+def _collapse(text: str) -> str:
+    text = _PUNCT_RE.sub(" ", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def normalize_name(name: str) -> str:
+    """Canonical form used as the exact identity of an entity name."""
+    if not isinstance(name, str):
+        return ""
+    text = unicodedata.normalize("NFC", name).lower()
+    text = _collapse(_PARENS_RE.sub(" ", text))
+    for title in TITLES:
+        # Keep the title when it is the whole name (e.g. an entity called "Sư phụ")
+        if text.startswith(title + " ") and len(text) > len(title) + 1:
+            text = text[len(title) + 1:]
+        elif text.endswith(" " + title) and len(text) > len(title) + 1:
+            text = text[:-(len(title) + 1)]
+    return text
+
+
+def fold_diacritics(text: str) -> str:
+    """Strip Vietnamese diacritics (including đ -> d)."""
+    decomposed = unicodedata.normalize("NFD", text)
+    stripped = "".join(c for c in decomposed if unicodedata.category(c) != "Mn")
+    return unicodedata.normalize("NFC", stripped).replace("đ", "d").replace("Đ", "D")
+
+
+def loose_key(name: str) -> str:
+    """Diacritic-insensitive key: normalize_name() then fold_diacritics()."""
+    return fold_diacritics(normalize_name(name))
+
+
+def similarity(a: str, b: str) -> float:
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+
+def is_fuzzy_match(a: str, b: str, threshold: float) -> bool:
+    """
+    Near-duplicate spelling test for loose keys.
+
+    Numbers must agree ("đệ tử 1" vs "đệ tử 2" are different) and very short
+    keys never match fuzzily, since one letter changes the name entirely.
+    """
+    if min(len(a), len(b)) < 6 or _DIGITS_RE.findall(a) != _DIGITS_RE.findall(b):
+        return False
+    return similarity(a, b) >= threshold
+
+
+def _trigrams(key: str) -> Set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Inverted trigram index over keys for fuzzy candidate lookup."""
+
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = {}
+        self._sizes: Dict[str, int] = {}
+
+    def add(self, key: str):
+        if not key or key in self._sizes:
+            return
+        grams = _trigrams(key)
+        self._sizes[key] = len(grams)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(key)
+
+    def add_all(self, keys: Iterable[str]):
+        for key in keys:
+            self.add(key)
+
+    def candidates(self, key: str, min_jaccard: float = 0.5, limit: int = 5) -> List[Tuple[float, str]]:
+        """Keys sharing enough trigrams with `key`, best first (Jaccard, key)."""
+        grams = _trigrams(key)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for other in self._postings.get(gram, ()):
+                shared[other] = shared.get(other, 0) + 1
+        scored = []
+        for other, count in shared.items():
+            if other == key:
+                continue
+            jaccard = count / (len(grams) + self._sizes[other] - count)
+            if jaccard >= min_jaccard:
+                scored.append((jaccard, other))
+        scored.sort(reverse=True)
+        return scored[:limit]
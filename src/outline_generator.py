@@ -422,7 +422,8 @@ Hãy tạo outline theo đúng định dạng JSON trên."""
             # Handle description as array or string
             desc = e.get('description', '')
             if isinstance(desc, list):
-                desc_text = "; ".join(desc) if desc else ""
+                canonical = e.get('canonical_description', '')
+                desc_text = "; ".join(([canonical] if canonical else []) + desc)
             else:
                 desc_text = desc
 
@@ -2,14 +2,19 @@
 Post-chapter processing: Extract events, conflicts, summaries, etc.
 """
 import os
-from typing import Dict, Any, List, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Callable
 from src.utils import save_json, load_json, parse_json_from_response
+from src.prompts.extract_prompt import SYSTEM_CHAPTER_ANALYZER
+from src.event_index import EventIndex
+from src.conflict_registry import ConflictRegistry
 
 
 class PostChapterProcessor:
     """Handle all post-chapter processing tasks."""
     
-    def __init__(self, llm_client, checkpoint_manager, logger, config, paths):
+    def __init__(self, llm_client, checkpoint_manager, logger, config, paths, store=None):
         self.llm_client = llm_client
         self.checkpoint = checkpoint_manager
         self.logger = logger
@@ -19,39 +24,233 @@ class PostChapterProcessor:
         self.events_file = os.path.join(paths['events_dir'], 'events.json')
         self.conflicts_file = os.path.join(paths['conflicts_dir'], 'conflicts.json')
         self.summaries_file = os.path.join(paths['summaries_dir'], 'summaries.json')
+        self.store = store  # Optional SQLiteProjectStore; None = JSON files
+        self.parallel = config.get('story', {}).get('parallel_post_processing', False)
+        # One chapter_analysis call for entities/events/conflicts/summary (see analyze_chapter)
+        self.combined_analysis = config.get('story', {}).get('combined_analysis', False)
+        # Extraction steps may run concurrently; guard the in-memory lists and their JSON files
+        self._lock = threading.RLock()
         
         # Load existing data
         self.events = self._load_events()
+        self.event_index = EventIndex(self.events)  # participant/chapter indexes over self.events
         self.conflicts = self._load_conflicts()
+        self.conflict_registry = ConflictRegistry(self.conflicts)  # id/status/timeline indexes over self.conflicts
         self.summaries = self._load_summaries()
     
-    def process_chapter(self, chapter_content: str, chapter_num: int) -> Dict[str, Any]:
+    def process_chapter(self, chapter_content: str, chapter_num: int,
+                        entity_extractor: Optional[Callable[[str, int], Any]] = None) -> Dict[str, Any]:
         """
         Process a chapter after it's written.
         
+        Args:
+            chapter_content: Chapter text
+            chapter_num: Chapter number
+            entity_extractor: Optional extra step run on the same text
+                (e.g. EntityManager.extract_entities_from_chapter)
+        
+        When `story.parallel_post_processing` is enabled, entity/event/conflict
+        extraction and the chapter summary run concurrently (they only read the
+        chapter text); the super summary is updated once they all finish.
+        
         Returns dictionary with extracted data.
         """
         self.logger.info(f"Post-processing chapter {chapter_num}")
         
-        # Extract events
-        events = self.extract_events(chapter_content, chapter_num)
-        
-        # Extract conflicts
-        conflicts = self.extract_conflicts(chapter_content, chapter_num)
-        
-        # Generate summary
-        summary = self.generate_summary(chapter_content, chapter_num)
+        tasks = {}
+        if entity_extractor is not None:
+            tasks['entities'] = entity_extractor
+        tasks['events'] = self.extract_events
+        tasks['conflicts'] = self.extract_conflicts
+        tasks['summary'] = self.generate_summary
+        
+        if self.parallel:
+            with ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix=f"post_ch{chapter_num}") as executor:
+                futures = {name: executor.submit(fn, chapter_content, chapter_num) for name, fn in tasks.items()}
+                # result() re-raises the first failure after all tasks have settled
+                results = {name: future.result() for name, future in futures.items()}
+        else:
+            results = {name: fn(chapter_content, chapter_num) for name, fn in tasks.items()}
+        
+        events = results['events']
+        conflicts = results['conflicts']
+        summary = results['summary']
         
         # Update super summary
         super_summary = self.update_super_summary(chapter_num)
         
         return {
+            'entities': results.get('entities'),
             'events': events,
             'conflicts': conflicts,
             'summary': summary,
             'super_summary': super_summary
         }
     
+    def analyze_chapter(self, chapter_content: str, chapter_num: int,
+                        entity_manager=None) -> Dict[str, bool]:
+        """
+        Extract entities, events, conflicts and the summary with a single LLM call.
+        
+        Every section of the combined response that validates is recorded exactly as
+        its individual step would record it (and that step is checkpointed), so the
+        individual extraction methods afterwards only run for sections that failed.
+        
+        Args:
+            chapter_content: Chapter text
+            chapter_num: Chapter number
+            entity_manager: EntityManager receiving the entities section (None skips it)
+        
+        Returns:
+            {section: True if recorded from the combined response, False if left to its own call}
+        """
+        step_name = f"chapter_analysis_{chapter_num}"
+        
+        if self.checkpoint.is_step_completed(step_name, chapter=chapter_num):
+            self.logger.info(f"Chapter {chapter_num} already analyzed")
+            return {}
+        
+        section_steps = {
+            'entities': f"entity_extraction_chapter_{chapter_num}",
+            'events': f"event_extraction_{chapter_num}",
+            'conflicts': f"conflict_extraction_{chapter_num}",
+            'summary': f"summary_generation_{chapter_num}",
+        }
+        if entity_manager is None:
+            del section_steps['entities']
+        pending = [section for section, step in section_steps.items()
+                   if not self.checkpoint.is_step_completed(step, chapter=chapter_num)]
+        if not pending:
+            return {}
+        
+        self.logger.info(f"Analyzing chapter {chapter_num} in one call ({', '.join(pending)})")
+        
+        # Truncate content if needed
+        truncated = chapter_content[:self.max_chars] + "..." if len(chapter_content) > self.max_chars else chapter_content
+        
+        existing_names = []
+        if entity_manager is not None:
+            # Same existing-entity list as extract_entities_from_chapter
+            existing_names = entity_manager.rank_existing_entities(chapter_content, chapter_num)
+        
+        prompt = f"""Hãy phân tích chương {chapter_num}.
+
+**NỘI DUNG CHƯƠNG:**
+{truncated}
+
+**ENTITY ĐÃ CÓ (không cần trích xuất lại):**
+{', '.join(existing_names) if existing_names else "Chưa có"}
+
+**MÂU THUẪN ĐÃ CÓ:**
+{self._format_conflicts_list(self.get_unresolved_conflicts())}
+
+**YÊU CẦU:**
+- entities: chỉ các entity MỚI chưa có trong danh sách trên
+- events: chỉ sự kiện quan trọng (3-10 sự kiện), importance từ 0-1
+- conflicts: mâu thuẫn MỚI và cập nhật trạng thái mâu thuẫn cũ (theo ID);
+  timeline: immediate (1 chapter), batch (5), short_term (10), medium_term (30), long_term (100), epic (300)
+- summary: tóm tắt 400-500 từ, ghi rõ cảnh giới nhân vật, không bỏ sót thông tin then chốt
+
+**ĐỊNH DẠNG OUTPUT (JSON):**
+
+```json
+{{
+  "entities": [
+    {{"name": "Tên", "type": "character", "description": "...", "status": "..."}}
+  ],
+  "events": [
+    {{
+      "description": "Mô tả sự kiện ngắn gọn",
+      "importance": 0.9,
+      "characters_involved": ["Tên nhân vật 1"],
+      "entities_involved": ["Entity 1"],
+      "location": "Địa điểm xảy ra",
+      "consequences": "Hậu quả/ảnh hưởng của sự kiện"
+    }}
+  ],
+  "conflicts": {{
+    "new_conflicts": [
+      {{
+        "id": "conflict_unique_id",
+        "description": "Mô tả mâu thuẫn",
+        "type": "internal/external/philosophical",
+        "timeline": "batch",
+        "characters_involved": ["Nhân vật 1"],
+        "entities_involved": ["Entity 1"],
+        "introduced_chapter": {chapter_num},
+        "status": "active"
+      }}
+    ],
+    "updated_conflicts": [
+      {{"id": "conflict_id_existing", "status": "resolved/developing", "resolution_chapter": {chapter_num}}}
+    ]
+  }},
+  "summary": "Tóm tắt chương"
+}}
+```"""
+        
+        data = {}
+        try:
+            result = self.llm_client.call(
+                prompt=prompt,
+                task_name="chapter_analysis",
+                system_message=SYSTEM_CHAPTER_ANALYZER,
+                chapter_id=chapter_num
+            )
+            data = parse_json_from_response(result['response'])
+        except Exception as e:
+            self.logger.warning(f"Combined analysis of chapter {chapter_num} failed, using individual calls: {e}")
+        if not isinstance(data, dict):
+            data = {}
+        
+        recorded = {}
+        for section in pending:
+            value = self._validate_analysis_section(section, data.get(section))
+            recorded[section] = value is not None
+            if value is None:
+                self.logger.warning(f"Combined analysis of chapter {chapter_num}: '{section}' missing or invalid, "
+                                    f"falling back to its own call")
+            elif section == 'entities':
+                entity_manager.record_chapter_entities(entity_manager.categorize_entities(value), chapter_num,
+                                                       chapter_content)
+            elif section == 'events':
+                self.record_events(value, chapter_num)
+            elif section == 'conflicts':
+                self.record_conflicts(value['new_conflicts'], value['updated_conflicts'], chapter_num)
+            else:
+                self.record_summary(value, chapter_num)
+        
+        self.checkpoint.mark_step_completed(
+            step_name,
+            chapter=chapter_num,
+            metadata={'recorded': [s for s, ok in recorded.items() if ok]}
+        )
+        return recorded
+    
+    @staticmethod
+    def _validate_analysis_section(section: str, value: Any) -> Any:
+        """The section value in the shape its record_* method expects, or None if unusable."""
+        def dict_items(items, key):
+            return isinstance(items, list) and all(isinstance(i, dict) and i.get(key) for i in items)
+        
+        if section == 'entities':
+            if isinstance(value, dict):
+                return value if all(dict_items(v, 'name') for v in value.values()) else None
+            return value if dict_items(value, 'name') else None
+        if section == 'events':
+            return value if dict_items(value, 'description') else None
+        if section == 'conflicts':
+            if not isinstance(value, dict):
+                return None
+            new_conflicts = value.get('new_conflicts', [])
+            updated = value.get('updated_conflicts', [])
+            if dict_items(new_conflicts, 'description') and dict_items(updated, 'id'):
+                return {'new_conflicts': new_conflicts, 'updated_conflicts': updated}
+            return None
+        if section == 'summary':
+            return value.strip() if isinstance(value, str) and value.strip() else None
+        return None
+    
     def extract_events(self, chapter_content: str, chapter_num: int) -> List[Dict[str, Any]]:
         """Extract important events from chapter."""
         step_name = f"event_extraction_{chapter_num}"
@@ -105,10 +304,18 @@ Hãy trích xuất theo định dạng JSON trên."""
         
         # Parse events
         events = self._parse_events_response(result['response'], chapter_num)
+        return self.record_events(events, chapter_num)
+    
+    def record_events(self, events: List[Dict[str, Any]], chapter_num: int) -> List[Dict[str, Any]]:
+        """Store a chapter's extracted events and mark its event extraction done."""
+        step_name = f"event_extraction_{chapter_num}"
+        for event in events:
+            event['chapter'] = chapter_num
         
         # Save events
-        self.events.extend(events)
-        self._save_events()
+        with self._lock:
+            self.event_index.extend(events)
+            self._save_events(events)
         
         # Mark completed
         self.checkpoint.mark_step_completed(step_name, chapter=chapter_num)
@@ -188,9 +395,16 @@ Hãy trích xuất theo định dạng JSON trên."""
         
         # Parse conflicts
         new_conflicts, updated = self._parse_conflicts_response(result['response'], chapter_num)
+        return self.record_conflicts(new_conflicts, updated, chapter_num)
+    
+    def record_conflicts(self, new_conflicts: List[Dict[str, Any]], updated: List[Dict[str, Any]],
+                         chapter_num: int) -> List[Dict[str, Any]]:
+        """Apply a chapter's new/updated conflicts and mark its conflict extraction done."""
+        step_name = f"conflict_extraction_{chapter_num}"
         
         # Update conflicts
-        self._update_conflicts(new_conflicts, updated, chapter_num)
+        with self._lock:
+            self._update_conflicts(new_conflicts, updated, chapter_num)
         
         # Mark completed
         self.checkpoint.mark_step_completed(step_name, chapter=chapter_num)
@@ -231,14 +445,20 @@ Hãy viết tóm tắt."""
             chapter_id=chapter_num
         )
         
-        summary = result['response'].strip()
+        return self.record_summary(result['response'].strip(), chapter_num)
+    
+    def record_summary(self, summary: str, chapter_num: int) -> str:
+        """Store a chapter summary and mark its summary generation done."""
+        step_name = f"summary_generation_{chapter_num}"
         
         # Save summary
-        self.summaries.append({
-            'chapter': chapter_num,
-            'summary': summary
-        })
-        self._save_summaries()
+        with self._lock:
+            entry = {
+                'chapter': chapter_num,
+                'summary': summary
+            }
+            self.summaries.append(entry)
+            self._save_summaries([entry])
         
         # Mark completed
         self.checkpoint.mark_step_completed(step_name, chapter=chapter_num)
@@ -246,13 +466,21 @@ Hãy viết tóm tắt."""
         return summary
     
     def update_super_summary(self, chapter_num: int) -> str:
-        """Update super summary of entire story so far."""
+        """
+        Update super summary of entire story so far.
+        
+        The text is kept once, in the `super_summary` checkpoint metadata (with
+        `super_summary_chapter`, the chapter it covers up to); the chapter's step
+        entry only records that chapter. An already completed chapter returns the
+        current super summary.
+        """
         step_name = f"super_summary_update_{chapter_num}"
         
         if self.checkpoint.is_step_completed(step_name, chapter=chapter_num):
             self.logger.info(f"Super summary already updated for chapter {chapter_num}")
-            metadata = self.checkpoint.get_step_metadata(step_name, chapter=chapter_num)
-            return metadata.get('super_summary', '') if metadata else ''
+            metadata = self.checkpoint.get_step_metadata(step_name, chapter=chapter_num) or {}
+            # Entries written before the text was stored once still carry their copy
+            return metadata.get('super_summary') or self.checkpoint.get_metadata('super_summary', '')
         
         self.logger.info(f"Updating super summary up to chapter {chapter_num}")
         
@@ -291,14 +519,15 @@ Hãy viết tóm tắt siêu ngắn gọn."""
         
         super_summary = result['response'].strip()
         
-        # Save to metadata
+        # Save to metadata (the only copy of the text)
         self.checkpoint.set_metadata('super_summary', super_summary)
+        self.checkpoint.set_metadata('super_summary_chapter', chapter_num)
         
         # Mark completed
         self.checkpoint.mark_step_completed(
             step_name, 
             chapter=chapter_num,
-            metadata={'super_summary': super_summary}
+            metadata={'super_summary_chapter': chapter_num}
         )
         
         return super_summary
@@ -312,12 +541,18 @@ Hãy viết tóm tắt siêu ngắn gọn."""
     
     def get_unresolved_conflicts(self) -> List[Dict[str, Any]]:
         """Get all unresolved conflicts."""
-        return [c for c in self.conflicts if c.get('status') == 'active']
+        return self._conflicts_with_status('active')
     
     def get_conflicts_by_timeline(self, timeline: str) -> List[Dict[str, Any]]:
         """Get unresolved conflicts by timeline."""
-        return [c for c in self.conflicts 
-                if c.get('status') == 'active' and c.get('timeline') == timeline]
+        return self._conflicts_with_status('active', timeline)
+    
+    def _conflicts_with_status(self, status: str, timeline: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Status/timeline lookup from the project store's index when active, else the registry."""
+        with self._lock:
+            if self.store is not None:
+                return self.store.conflicts_by_status(status, timeline)
+            return self.conflict_registry.with_status(status, timeline)
     
     def get_events_by_entities(self, entity_names: List[str], max_events: int = 10) -> List[Dict[str, Any]]:
         """
@@ -333,30 +568,25 @@ Hãy viết tóm tắt siêu ngắn gọn."""
         if not entity_names:
             return []
         
-        # Normalize entity names for matching
-        entity_names_lower = [name.lower() for name in entity_names]
+        return self.get_top_events(max_events, characters=entity_names, entities=entity_names)
+    
+    def get_top_events(self, limit: int, characters: Optional[List[str]] = None,
+                       entities: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Most important events, optionally only those involving given names.
         
-        related_events = []
-        for event in self.events:
-            # Check if any entity is involved
-            involved = False
-            
-            # Check characters_involved
-            chars = event.get('characters_involved', [])
-            if any(char.lower() in entity_names_lower for char in chars):
-                involved = True
-            
-            # Check entities_involved
-            entities = event.get('entities_involved', [])
-            if any(entity.lower() in entity_names_lower for entity in entities):
-                involved = True
-            
-            if involved:
-                related_events.append(event)
+        Args:
+            limit: Maximum number of events to return
+            characters: Match against characters_involved
+            entities: Match against entities_involved
+                      (with neither given, all events are considered)
         
-        # Sort by importance (descending) and limit
-        related_events.sort(key=lambda x: x.get('importance', 0), reverse=True)
-        return related_events[:max_events]
+        Name lookups use the project store's participant index when it is active.
+        """
+        with self._lock:
+            if self.store is not None and (characters is not None or entities is not None):
+                return self.store.events_by_participants(limit, characters=characters, entities=entities)
+            return self.event_index.top_k(limit, characters=characters, entities=entities)
     
     def get_events_by_chapter_range(self, start_chapter: int, end_chapter: int) -> List[Dict[str, Any]]:
         """
@@ -369,38 +599,58 @@ Hãy viết tóm tắt siêu ngắn gọn."""
         Returns:
             List of events from the specified chapter range
         """
-        return [e for e in self.events 
-                if start_chapter <= e.get('chapter', 0) <= end_chapter]
+        with self._lock:
+            if self.store is not None:
+                return self.store.events_by_chapter(start_chapter, end_chapter)
+            return self.event_index.in_chapters(start_chapter, end_chapter)
     
     def _load_events(self) -> List[Dict[str, Any]]:
         """Load events from file."""
+        if self.store is not None:
+            return self.store.load_events()
         if os.path.exists(self.events_file):
             return load_json(self.events_file)
         return []
     
-    def _save_events(self):
-        """Save events to file."""
-        save_json(self.events, self.events_file)
+    def _save_events(self, new_events: Optional[List[Dict[str, Any]]] = None):
+        """Save events to file (or append only the new ones to the project store)."""
+        with self._lock:
+            if self.store is not None:
+                self.store.add_events(new_events or [])
+                return
+            save_json(self.events, self.events_file)
     
     def _load_conflicts(self) -> List[Dict[str, Any]]:
         """Load conflicts from file."""
+        if self.store is not None:
+            return self.store.load_conflicts()
         if os.path.exists(self.conflicts_file):
             return load_json(self.conflicts_file)
         return []
     
-    def _save_conflicts(self):
-        """Save conflicts to file."""
-        save_json(self.conflicts, self.conflicts_file)
+    def _save_conflicts(self, changed: Optional[List[Dict[str, Any]]] = None):
+        """Save conflicts to file (or only the changed ones to the project store)."""
+        with self._lock:
+            if self.store is not None:
+                self.store.upsert_conflicts(self.conflicts if changed is None else changed)
+                return
+            save_json(self.conflicts, self.conflicts_file)
     
     def _load_summaries(self) -> List[Dict[str, Any]]:
         """Load summaries from file."""
+        if self.store is not None:
+            return self.store.load_summaries()
         if os.path.exists(self.summaries_file):
             return load_json(self.summaries_file)
         return []
     
-    def _save_summaries(self):
-        """Save summaries to file."""
-        save_json(self.summaries, self.summaries_file)
+    def _save_summaries(self, changed: Optional[List[Dict[str, Any]]] = None):
+        """Save summaries to file (or only the changed ones to the project store)."""
+        with self._lock:
+            if self.store is not None:
+                self.store.put_summaries(self.summaries if changed is None else changed)
+                return
+            save_json(self.summaries, self.summaries_file)
     
     def _parse_events_response(self, response: str, chapter_num: int) -> List[Dict[str, Any]]:
         """Parse events from LLM response."""
@@ -433,32 +683,32 @@ Hãy viết tóm tắt siêu ngắn gọn."""
     
     def _update_conflicts(self, new_conflicts: List[Dict], updated: List[Dict], chapter_num: int):
         """Update conflicts list."""
-        # Add new conflicts
+        changed = []
+        # Add new conflicts (ids that are missing or already taken get a fresh one)
         for conflict in new_conflicts:
-            if 'id' not in conflict:
-                conflict['id'] = f"conflict_ch{chapter_num}_{len(self.conflicts)}"
-            self.conflicts.append(conflict)
+            changed.append(self.conflict_registry.add(conflict, chapter_num))
         
         # Update existing conflicts
         for update in updated:
-            conflict_id = update.get('id')
-            for i, conflict in enumerate(self.conflicts):
-                if conflict.get('id') == conflict_id:
-                    if 'status' in update:
-                        self.conflicts[i]['status'] = update['status']
-                    if 'resolution_chapter' in update:
-                        self.conflicts[i]['resolution_chapter'] = update['resolution_chapter']
-                    break
-        
-        self._save_conflicts()
+            conflict = self.conflict_registry.update(
+                update.get('id'),
+                chapter_num,
+                status=update.get('status'),
+                resolution_chapter=update.get('resolution_chapter')
+            )
+            if conflict is not None and all(c is not conflict for c in changed):
+                changed.append(conflict)
+        
+        self._save_conflicts(changed)
     
     def _get_chapter_events(self, chapter_num: int) -> List[Dict[str, Any]]:
         """Get events for a specific chapter."""
-        return [e for e in self.events if e.get('chapter') == chapter_num]
+        return self.get_events_by_chapter_range(chapter_num, chapter_num)
     
     def _get_chapter_conflicts(self, chapter_num: int) -> List[Dict[str, Any]]:
         """Get conflicts introduced in a specific chapter."""
-        return [c for c in self.conflicts if c.get('introduced_chapter') == chapter_num]
+        with self._lock:
+            return self.conflict_registry.introduced_in(chapter_num)
     
     def _get_chapter_summary(self, chapter_num: int) -> str:
         """Get summary for a specific chapter."""
@@ -0,0 +1,485 @@
+"""
+Optional SQLite storage backend for project state.
+
+With `storage.backend: "sqlite"` all entities, events, conflicts and summaries of a
+project live in one database (`projects/{project_id}/project.db`), with indexed tables
+for the lookups chapter writing and outlining need: entities appearing in a chapter,
+events by chapter and by participant, conflicts by status and timeline. With this
+backend EntityManager and PostChapterProcessor answer those lookups from the database
+(their in-memory lists remain for merging) and persist only what changed instead of
+rewriting the whole JSON files. The JSON files
+can be regenerated on demand with `export_json()` (`python scripts.py export`).
+
+Writes commit once per save, except while a chapter is open (`begin_chapter()` /
+`end_chapter()`): then everything written by the chapter's post-processing steps,
+from any worker thread, is committed together when the chapter ends.
+
+On first open, an empty database is seeded from existing JSON files. The schema
+version lives in `PRAGMA user_version`; opening an older database migrates it (so
+far: recomputing `name_norm` with the current `normalize_name()`).
+"""
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from src.utils import save_json, load_json
+from src.name_normalizer import normalize_name
+
+
+# 1: initial schema; 2: name_norm from the Vietnamese-aware normalize_name();
+# 3: participant roles in event_participants, appearance/participant rows rebuilt.
+# Bump whenever normalize_name() changes so stored keys are recomputed on open.
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    id INTEGER PRIMARY KEY,
+    category TEXT NOT NULL,
+    name TEXT NOT NULL,
+    name_norm TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    UNIQUE (category, name_norm)
+);
+CREATE INDEX IF NOT EXISTS idx_entities_name ON entities (name_norm);
+
+CREATE TABLE IF NOT EXISTS entity_chapters (
+    entity_id INTEGER NOT NULL REFERENCES entities (id) ON DELETE CASCADE,
+    chapter INTEGER NOT NULL,
+    PRIMARY KEY (entity_id, chapter)
+);
+CREATE INDEX IF NOT EXISTS idx_entity_chapters_chapter ON entity_chapters (chapter);
+
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    chapter INTEGER,
+    importance REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_chapter ON events (chapter);
+
+-- role: 'character' (characters_involved) or 'entity' (entities_involved)
+CREATE TABLE IF NOT EXISTS event_participants (
+    event_id INTEGER NOT NULL REFERENCES events (id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    name_norm TEXT NOT NULL,
+    PRIMARY KEY (event_id, role, name_norm)
+);
+CREATE INDEX IF NOT EXISTS idx_event_participants_name ON event_participants (role, name_norm);
+
+CREATE TABLE IF NOT EXISTS conflicts (
+    id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    status TEXT,
+    timeline TEXT,
+    introduced_chapter INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_conflicts_status ON conflicts (status, timeline);
+
+CREATE TABLE IF NOT EXISTS summaries (
+    chapter INTEGER PRIMARY KEY,
+    summary TEXT NOT NULL
+);
+"""
+
+
+def _dumps(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False)
+
+
+def _importance(event: Dict[str, Any]) -> float:
+    try:
+        return float(event.get('importance', 0) or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _as_list(value: Any) -> List[Any]:
+    if isinstance(value, list):
+        return list(value)
+    return [value] if value else []
+
+
+def merge_entity_data(entity: Dict[str, Any], other: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fold `other` into `entity` (two records of the same entity under spellings that
+    normalize alike): chapters, descriptions and aliases are unioned and `other`'s
+    name is kept as an alias. Other fields of `entity` win.
+    """
+    merged = {**other, **entity}
+    merged['appear_in_chapters'] = sorted(set(_as_list(entity.get('appear_in_chapters')))
+                                          | set(_as_list(other.get('appear_in_chapters'))))
+    descriptions = _as_list(entity.get('description'))
+    descriptions += [d for d in _as_list(other.get('description')) if d not in descriptions]
+    merged['description'] = descriptions
+    aliases = _as_list(entity.get('aliases'))
+    for alias in [other.get('name', '')] + _as_list(other.get('aliases')):
+        if alias and alias != entity.get('name') and alias not in aliases:
+            aliases.append(alias)
+    if aliases:
+        merged['aliases'] = aliases
+    return merged
+
+
+def _merge_colliding(entities: Dict[str, List[Dict[str, Any]]]) -> Tuple[List[Tuple[str, Dict[str, Any]]], List[str]]:
+    """
+    (category, entity) pairs with same-normalized-name records merged, in original
+    order, plus "category: name <- other" notes for each merge.
+    """
+    merged: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    notes = []
+    for category, items in entities.items():
+        for entity in items:
+            key = (category, normalize_name(entity.get('name', '')))
+            if not key[1]:
+                continue
+            if key in merged:
+                notes.append(f"{category}: {merged[key].get('name')} <- {entity.get('name')}")
+                merged[key] = merge_entity_data(merged[key], entity)
+            else:
+                merged[key] = entity
+    return [(category, entity) for (category, _), entity in merged.items()], notes
+
+
+class SQLiteProjectStore:
+    """Project state in a single SQLite database, written in per-save or per-chapter transactions."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        # One connection shared by the step-graph worker threads, serialised by a lock
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        # Chapters whose writes are held back, and chapters ended but not yet committed
+        self._open_chapters: Set[int] = set()
+        self._ended_chapters: List[int] = []
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < 3:
+                # Older layout without roles; rebuilt from the events by _migrate()
+                self._conn.execute("DROP TABLE IF EXISTS event_participants")
+            self._conn.executescript(SCHEMA)
+            self._migrate(version)
+
+    def _migrate(self, version: int):
+        """Bring an older database up to SCHEMA_VERSION."""
+        if version >= SCHEMA_VERSION:
+            return
+        with self.transaction() as conn:
+            self._renormalize_entities(conn)
+            self._reindex_event_participants(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _renormalize_entities(self, conn: sqlite3.Connection):
+        """
+        Recompute name_norm; rows that now share a key are merged into the first one.
+        Chapter appearances are re-added from each entity's appear_in_chapters.
+        """
+        rows = conn.execute("SELECT id, category, name, data FROM entities ORDER BY category, position").fetchall()
+        keep: Dict[Tuple[str, str], Tuple[int, Dict[str, Any]]] = {}
+        drop = []
+        for row in rows:
+            key = (row['category'], normalize_name(row['name']))
+            if key in keep:
+                entity_id, entity = keep[key]
+                keep[key] = (entity_id, merge_entity_data(entity, json.loads(row['data'])))
+                drop.append(row['id'])
+            else:
+                keep[key] = (row['id'], json.loads(row['data']))
+        conn.executemany("DELETE FROM entities WHERE id = ?", [(entity_id,) for entity_id in drop])
+        # Temporary unique keys first, so swapping keys between rows cannot collide
+        conn.execute("UPDATE entities SET name_norm = '#' || id")
+        conn.executemany("UPDATE entities SET name_norm = ?, data = ? WHERE id = ?",
+                         [(name_norm, _dumps(entity), entity_id)
+                          for (_, name_norm), (entity_id, entity) in keep.items()])
+        for entity_id, entity in keep.values():
+            self._index_entity_chapters(conn, entity_id, entity)
+
+    def _reindex_event_participants(self, conn: sqlite3.Connection):
+        """Rebuild event_participants (older databases lack roles or used older keys)."""
+        conn.execute("DELETE FROM event_participants")
+        for row in conn.execute("SELECT id, data FROM events").fetchall():
+            self._index_event_participants(conn, row['id'], json.loads(row['data']))
+
+    @staticmethod
+    def _index_entity_chapters(conn: sqlite3.Connection, entity_id: int, entity: Dict[str, Any]):
+        conn.executemany("INSERT OR IGNORE INTO entity_chapters (entity_id, chapter) VALUES (?, ?)",
+                         [(entity_id, ch) for ch in _as_list(entity.get('appear_in_chapters'))])
+
+    @staticmethod
+    def _index_event_participants(conn: sqlite3.Connection, event_id: int, event: Dict[str, Any]):
+        rows = {(event_id, role, normalize_name(name))
+                for role, field in (('character', 'characters_involved'), ('entity', 'entities_involved'))
+                for name in _as_list(event.get(field)) if isinstance(name, str)}
+        conn.executemany("INSERT OR IGNORE INTO event_participants (event_id, role, name_norm) VALUES (?, ?, ?)",
+                         [row for row in rows if row[2]])
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run a block of writes atomically.
+
+        The block is committed on exit unless a chapter is open, in which case it
+        stays pending until the last open chapter ends. A failing block is rolled
+        back on its own either way.
+        """
+        with self._lock:
+            if not self._conn.in_transaction:
+                self._conn.execute("BEGIN")
+            self._conn.execute("SAVEPOINT write_block")
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.execute("ROLLBACK TO write_block")
+                self._conn.execute("RELEASE write_block")
+                raise
+            self._conn.execute("RELEASE write_block")
+            if not self._open_chapters:
+                self._conn.commit()
+
+    def begin_chapter(self, chapter_num: int):
+        """Hold back commits until `end_chapter(chapter_num)`."""
+        with self._lock:
+            self._open_chapters.add(chapter_num)
+
+    def end_chapter(self, chapter_num: int) -> List[int]:
+        """
+        Close a chapter opened with `begin_chapter()`.
+
+        Pending writes are committed once no chapter is open any more (with
+        pipelined chapters the next one may still be running). Returns the
+        chapters whose writes this call committed, so callers can persist
+        anything that must not get ahead of the database (checkpoint marks).
+        """
+        with self._lock:
+            if chapter_num in self._open_chapters:
+                self._open_chapters.discard(chapter_num)
+                self._ended_chapters.append(chapter_num)
+            if self._open_chapters:
+                return []
+            if self._conn.in_transaction:
+                self._conn.commit()
+            committed, self._ended_chapters = self._ended_chapters, []
+            return committed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            for table in ('entities', 'events', 'conflicts', 'summaries'):
+                if self._conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                    return False
+        return True
+
+    # ---- entities ----
+
+    def load_entities(self) -> Dict[str, List[Dict[str, Any]]]:
+        """All entities grouped by category, in insertion order."""
+        entities: Dict[str, List[Dict[str, Any]]] = {}
+        with self._lock:
+            rows = self._conn.execute("SELECT category, data FROM entities ORDER BY category, position").fetchall()
+        for row in rows:
+            entities.setdefault(row['category'], []).append(json.loads(row['data']))
+        return entities
+
+    def upsert_entities(self, changed: Iterable[Tuple[str, Dict[str, Any]]]):
+        """Insert or update (category, entity) pairs and their chapter appearances."""
+        with self.transaction() as conn:
+            for category, entity in changed:
+                name = entity.get('name', '')
+                name_norm = normalize_name(name)
+                if not name_norm:
+                    continue
+                row = conn.execute("SELECT id FROM entities WHERE category = ? AND name_norm = ?",
+                                   (category, name_norm)).fetchone()
+                if row:
+                    entity_id = row['id']
+                    conn.execute("UPDATE entities SET name = ?, data = ? WHERE id = ?",
+                                 (name, _dumps(entity), entity_id))
+                else:
+                    position = conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM entities WHERE category = ?",
+                                            (category,)).fetchone()[0]
+                    entity_id = conn.execute(
+                        "INSERT INTO entities (category, name, name_norm, position, data) VALUES (?, ?, ?, ?, ?)",
+                        (category, name, name_norm, position, _dumps(entity))
+                    ).lastrowid
+                self._index_entity_chapters(conn, entity_id, entity)
+
+    def find_entity(self, name: str) -> Optional[Dict[str, Any]]:
+        """Entity by (normalized) name across categories, with its category."""
+        with self._lock:
+            row = self._conn.execute("SELECT category, data FROM entities WHERE name_norm = ? ORDER BY id LIMIT 1",
+                                     (normalize_name(name),)).fetchone()
+        return {**json.loads(row['data']), 'category': row['category']} if row else None
+
+    def entities_in_chapter(self, chapter: int,
+                            categories: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """Entities appearing in a chapter, grouped by category in insertion order."""
+        query = ("SELECT e.category, e.data FROM entity_chapters c JOIN entities e ON e.id = c.entity_id "
+                 "WHERE c.chapter = ?")
+        params: List[Any] = [chapter]
+        if categories is not None:
+            query += f" AND e.category IN ({', '.join('?' * len(categories))})"
+            params += list(categories)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY e.category, e.position", params).fetchall()
+        result: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            result.setdefault(row['category'], []).append(json.loads(row['data']))
+        return result
+
+    # ---- events ----
+
+    def load_events(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM events ORDER BY id").fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def add_events(self, events: Iterable[Dict[str, Any]]):
+        with self.transaction() as conn:
+            for event in events:
+                event_id = conn.execute("INSERT INTO events (chapter, importance, data) VALUES (?, ?, ?)",
+                                        (event.get('chapter'), _importance(event), _dumps(event))).lastrowid
+                self._index_event_participants(conn, event_id, event)
+
+    def events_by_chapter(self, start_chapter: int, end_chapter: int) -> List[Dict[str, Any]]:
+        """Events of chapters start..end (inclusive), in insertion order."""
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM events WHERE chapter BETWEEN ? AND ? ORDER BY id",
+                                      (start_chapter, end_chapter)).fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def events_by_participants(self, limit: int, characters: Optional[Iterable[str]] = None,
+                               entities: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Most important events whose characters_involved includes one of `characters`
+        or whose entities_involved includes one of `entities` (ties in insertion order).
+        """
+        clauses, params = [], []
+        for role, names in (('character', characters), ('entity', entities)):
+            norms = sorted({normalize_name(n) for n in names or () if n} - {''})
+            if norms:
+                clauses.append(f"(p.role = ? AND p.name_norm IN ({', '.join('?' * len(norms))}))")
+                params += [role, *norms]
+        if not clauses:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT e.data FROM events e WHERE e.id IN "
+                f"(SELECT p.event_id FROM event_participants p WHERE {' OR '.join(clauses)}) "
+                "ORDER BY e.importance DESC, e.id LIMIT ?",
+                (*params, limit)
+            ).fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    # ---- conflicts ----
+
+    def load_conflicts(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM conflicts ORDER BY position").fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def upsert_conflicts(self, conflicts: Iterable[Dict[str, Any]]):
+        with self.transaction() as conn:
+            for conflict in conflicts:
+                position = conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM conflicts").fetchone()[0]
+                conn.execute(
+                    "INSERT INTO conflicts (id, position, status, timeline, introduced_chapter, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+                    "status = excluded.status, timeline = excluded.timeline, "
+                    "introduced_chapter = excluded.introduced_chapter, data = excluded.data",
+                    (str(conflict.get('id')), position, conflict.get('status'), conflict.get('timeline'),
+                     conflict.get('introduced_chapter'), _dumps(conflict))
+                )
+
+    def conflicts_by_status(self, status: str, timeline: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Conflicts with a status (and timeline), in insertion order."""
+        query, params = "SELECT data FROM conflicts WHERE status = ?", [status]
+        if timeline is not None:
+            query += " AND timeline = ?"
+            params.append(timeline)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY position", params).fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    # ---- summaries ----
+
+    def load_summaries(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT chapter, summary FROM summaries ORDER BY chapter").fetchall()
+        return [{'chapter': row['chapter'], 'summary': row['summary']} for row in rows]
+
+    def put_summaries(self, summaries: Iterable[Dict[str, Any]]):
+        with self.transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO summaries (chapter, summary) VALUES (?, ?)",
+                             [(s['chapter'], s['summary']) for s in summaries])
+
+    # ---- JSON import / export ----
+
+    def import_json(self, paths: Dict[str, str]) -> List[str]:
+        """
+        Seed the database from the project's JSON files.
+
+        Entities whose names normalize to the same key within a category (one row
+        in the database) are merged rather than overwritten; returns a note per merge.
+        """
+        entities_file, events_file, conflicts_file, summaries_file = _json_files(paths)
+        merges = []
+        if os.path.exists(entities_file):
+            entities, merges = _merge_colliding(load_json(entities_file))
+            self.upsert_entities(entities)
+        if os.path.exists(events_file):
+            self.add_events(load_json(events_file))
+        if os.path.exists(conflicts_file):
+            self.upsert_conflicts(load_json(conflicts_file))
+        if os.path.exists(summaries_file):
+            self.put_summaries(load_json(summaries_file))
+        return merges
+
+    def export_json(self, paths: Dict[str, str]) -> List[str]:
+        """Write entities.json, events.json, conflicts.json and summaries.json from the database."""
+        entities_file, events_file, conflicts_file, summaries_file = _json_files(paths)
+        save_json(self.load_entities(), entities_file)
+        save_json(self.load_events(), events_file)
+        save_json(self.load_conflicts(), conflicts_file)
+        save_json(self.load_summaries(), summaries_file)
+        return [entities_file, events_file, conflicts_file, summaries_file]
+
+
+def _json_files(paths: Dict[str, str]) -> Tuple[str, str, str, str]:
+    return (
+        os.path.join(paths['entities_dir'], 'entities.json'),
+        os.path.join(paths['events_dir'], 'events.json'),
+        os.path.join(paths['conflicts_dir'], 'conflicts.json'),
+        os.path.join(paths['summaries_dir'], 'summaries.json'),
+    )
+
+
+def open_project_store(config: Dict[str, Any], paths: Dict[str, str], logger=None) -> Optional[SQLiteProjectStore]:
+    """Open the configured storage backend; None means the default JSON files."""
+    storage_config = config.get('storage', {})
+    backend = storage_config.get('backend', 'json')
+    if backend == 'json':
+        return None
+    if backend != 'sqlite':
+        raise ValueError(f"Unknown storage backend: {backend}")
+
+    db_path = os.path.join(paths['project_root'], storage_config.get('sqlite_file', 'project.db'))
+    store = SQLiteProjectStore(db_path)
+    if store.is_empty():
+        merges = store.import_json(paths)
+        if logger and not store.is_empty():
+            logger.info(f"Imported existing JSON project data into {db_path}")
+        if logger and merges:
+            logger.warning(f"Merged {len(merges)} entities whose names collide after normalization: "
+                           + "; ".join(merges))
+    return store
@@ -176,3 +176,48 @@ Mỗi đối tượng có:
 ]
 
 """).strip()
+
+
+SYSTEM_DESCRIPTION_COMPACTOR = textwrap.dedent("""
+
+**Vai trò:** Biên tập hồ sơ thực thể cho truyện tu tiên/kiếm hiệp.
+
+**Đầu vào:** Tên thực thể và danh sách mô tả qua các chương (cũ trước, mới sau; dòng đầu có thể là bản tóm tắt trước đó).
+
+**Yêu cầu:**
+
+* Gộp thành **một mô tả duy nhất**, dạng `trường: giá trị; trường: giá trị; ...` giống đầu vào.
+* Với mỗi trường, giữ **giá trị mới nhất**; bỏ `unknow` nếu đã có giá trị cụ thể.
+* Giữ các mốc thay đổi quan trọng (đột phá cảnh giới, đổi phe, bị thương, mất/được bảo vật) thật ngắn gọn.
+* Không bịa thêm chi tiết; tối đa khoảng 120 từ.
+
+**Chỉ trả về đoạn mô tả, không kèm lời giải thích.**
+
+""").strip()
+
+
+# Entity rules shared with the combined chapter analysis (everything between the
+# goal and the output format of SYSTEM_ENTITY_EXTRACTOR)
+_ENTITY_RULES = SYSTEM_ENTITY_EXTRACTOR[
+    SYSTEM_ENTITY_EXTRACTOR.index("**Quy tắc chung:**"):SYSTEM_ENTITY_EXTRACTOR.index("**Định dạng bắt buộc")
+].strip()
+
+SYSTEM_CHAPTER_ANALYZER = textwrap.dedent("""
+**Vai trò:** Bộ phân tích chương cho truyện tu tiên/kiếm hiệp.
+
+**Đầu vào:** Nội dung một chương, danh sách entity đã có và các mâu thuẫn đang mở.
+
+**Mục tiêu:** Trong **một lần** đọc, trả về **một object JSON** gồm 4 phần:
+
+* `entities`: mảng các entity **MỚI** (chưa có trong danh sách), mỗi entity có `name`, `type`, `description`, `status` theo quy tắc bên dưới.
+* `events`: 3-10 sự kiện **quan trọng**, mỗi sự kiện có `description`, `importance` (0-1), `characters_involved`, `entities_involved`, `location`, `consequences`.
+* `conflicts`: object có `new_conflicts` (mâu thuẫn mới: `id`, `description`, `type`, `timeline`, `characters_involved`, `entities_involved`, `introduced_chapter`, `status`) và `updated_conflicts` (mâu thuẫn cũ có tiến triển: `id`, `status`, `resolution_chapter`).
+* `summary`: tóm tắt chương 400-500 từ, gồm các sự kiện chính, ghi rõ cảnh giới nhân vật.
+
+**Quy tắc entity:**
+
+{entity_rules}
+
+**Chỉ trả về object JSON, không kèm lời giải thích.**
+
+""").strip().replace("{entity_rules}", _ENTITY_RULES)
@@ -0,0 +1,125 @@
+"""
+Declarative step DAG for the generation pipeline.
+
+Each node is one pipeline step, named by its CheckpointManager key
+(e.g. "chapter_writing_3", "outline_generation_batch2"), with explicit
+dependencies on other nodes. StepGraph.run() executes every ready node
+concurrently, limiting how many steps may call the same LLM model at once.
+Nodes may add further nodes while running (e.g. the outline step adds the
+chapter steps once the chapter numbers are known).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List, Optional
+
+
+class Step:
+    """One node of the step graph."""
+
+    def __init__(self, name: str, fn: Callable[[Dict[str, Any]], Any],
+                 deps: Optional[List[str]] = None, task: Optional[str] = None,
+                 done: Optional[Callable[[], bool]] = None):
+        """
+        Args:
+            name: Unique node name (the step's checkpoint key)
+            fn: Called with {dep_name: dep_result}; its return value is the node result
+            deps: Names of nodes that must finish first
+            task: LLM task name (task_configs key) used for per-model concurrency limits
+            done: Returns True if the step is already checkpointed, so it runs without
+                  taking a model slot (it only reloads its output)
+        """
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps or [])
+        self.task = task
+        self.done = done
+
+
+class StepGraph:
+    """Run a DAG of Steps on a thread pool under per-model concurrency limits."""
+
+    def __init__(self, logger, model_for_task: Callable[[str], str],
+                 max_workers: int = 8, model_concurrency: Optional[Dict[str, int]] = None):
+        self.logger = logger
+        self.model_for_task = model_for_task
+        self.max_workers = max_workers
+        self.model_concurrency = dict(model_concurrency or {})
+        self.default_concurrency = self.model_concurrency.pop('default', max_workers)
+        self.results: Dict[str, Any] = {}
+        self._steps: Dict[str, Step] = {}
+        self._started = set()
+        self._lock = threading.RLock()
+        self._semaphores: Dict[str, threading.Semaphore] = {}
+
+    def add(self, step: Step) -> Step:
+        """Add a node (also allowed from inside a running step)."""
+        with self._lock:
+            if step.name in self._steps:
+                raise ValueError(f"Duplicate step: {step.name}")
+            self._steps[step.name] = step
+        return step
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._steps
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Execute all nodes; returns {name: result}.
+
+        Stops scheduling new nodes after the first failure, waits for the running
+        ones, then re-raises that failure.
+        """
+        failure = None
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="step") as executor:
+            while True:
+                if failure is None:
+                    for step in self._ready_steps():
+                        self._started.add(step.name)
+                        deps = {d: self.results[d] for d in step.deps}
+                        running[executor.submit(self._run_step, step, deps)] = step
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self.logger.error(f"Step {step.name} failed: {e}")
+                        if failure is None:
+                            failure = e
+                        continue
+                    with self._lock:
+                        self.results[step.name] = result
+
+        if failure is not None:
+            raise failure
+
+        with self._lock:
+            blocked = {name: [d for d in s.deps if d not in self.results]
+                       for name, s in self._steps.items() if name not in self.results}
+        if blocked:
+            raise RuntimeError(f"Steps with unsatisfiable dependencies: {blocked}")
+        return self.results
+
+    def _ready_steps(self) -> List[Step]:
+        with self._lock:
+            return [s for name, s in self._steps.items()
+                    if name not in self._started and all(d in self.results for d in s.deps)]
+
+    def _semaphore(self, model: str) -> threading.Semaphore:
+        with self._lock:
+            if model not in self._semaphores:
+                limit = self.model_concurrency.get(model, self.default_concurrency)
+                self._semaphores[model] = threading.Semaphore(max(1, int(limit)))
+            return self._semaphores[model]
+
+    def _run_step(self, step: Step, deps: Dict[str, Any]) -> Any:
+        if step.task is None or (step.done is not None and step.done()):
+            return step.fn(deps)
+        model = self.model_for_task(step.task)
+        with self._semaphore(model):
+            self.logger.debug(f"Running step {step.name} on {model}")
+            return step.fn(deps)
@@ -6,6 +6,10 @@ import json
 import yaml
 import logging
 import re
+import queue
+import atexit
+import threading
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, Optional
@@ -112,8 +116,11 @@ def load_json(file_path: str) -> Any:
 def save_json(data: Any, file_path: str, indent: int = 2) -> None:
     """Save data to JSON file."""
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    with open(file_path, 'w', encoding='utf-8') as f:
+    # Write to a temp file and swap it in so concurrent readers never see a half-written file
+    tmp_path = f"{file_path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp_path, file_path)
 
 
 def load_text(file_path: str) -> str:
@@ -129,6 +136,64 @@ def save_text(text: str, file_path: str) -> None:
         f.write(text)
 
 
+_LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+_log_lock = threading.Lock()
+_console_handler: Optional[logging.Handler] = None
+_log_listeners: Dict[str, QueueListener] = {}
+
+
+def _attach_queue_handler(logger: logging.Logger, name: str, logs_dir: str, log_level: int):
+    """
+    Route a logger through a QueueHandler (idempotent).
+    
+    The calling thread only enqueues records; a QueueListener thread per logger
+    writes them to the console handler (shared by all loggers) and to the
+    logger's own file handler. Constructing another Logger for the same
+    name/project reuses the existing pipeline instead of adding handlers.
+    """
+    global _console_handler
+    with _log_lock:
+        listener = _log_listeners.get(logger.name)
+        if listener is not None:
+            return
+        
+        formatter = logging.Formatter(_LOG_FORMAT)
+        if _console_handler is None:
+            _console_handler = logging.StreamHandler()
+            _console_handler.setFormatter(formatter)
+        
+        # File handler - main log
+        log_file = os.path.join(logs_dir, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        file_handler.setLevel(log_level)
+        file_handler.setFormatter(formatter)
+        
+        log_queue: queue.Queue = queue.Queue(-1)
+        logger.addHandler(QueueHandler(log_queue))
+        listener = QueueListener(log_queue, _console_handler, file_handler, respect_handler_level=True)
+        listener.start()
+        _log_listeners[logger.name] = listener
+
+
+@atexit.register
+def stop_log_listeners():
+    """Write out queued log records and stop the listener threads (the next Logger starts a fresh pipeline)."""
+    global _console_handler
+    with _log_lock:
+        listeners = list(_log_listeners.items())
+        _log_listeners.clear()
+        console_handler, _console_handler = _console_handler, None
+    for logger_name, listener in listeners:
+        listener.stop()
+        logger = logging.getLogger(logger_name)
+        for handler in list(logger.handlers):
+            if isinstance(handler, QueueHandler):
+                logger.removeHandler(handler)
+        for handler in listener.handlers:
+            if handler is not console_handler:
+                handler.close()
+
+
 class Logger:
     """
     Custom logger for the story generation system.
@@ -148,32 +213,11 @@ class Logger:
         os.makedirs(self.paths['logs_dir'], exist_ok=True)
         os.makedirs(self.paths['llm_logs_dir'], exist_ok=True)
         
-        # Create logger
-        self.logger = logging.getLogger(name)
+        # One logger per (name, project): projects running in the same process log to their own files
+        self.logger = logging.getLogger(f"{name}.{project_id}")
         self.logger.setLevel(log_level)
-        
-        # File handler - main log
-        log_file = os.path.join(
-            self.paths['logs_dir'],
-            f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-        )
-        file_handler = logging.FileHandler(log_file, encoding='utf-8')
-        file_handler.setLevel(log_level)
-        
-        # Console handler
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(log_level)
-        
-        # Formatter
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        file_handler.setFormatter(formatter)
-        console_handler.setFormatter(formatter)
-        
-        # Add handlers
-        self.logger.addHandler(file_handler)
-        self.logger.addHandler(console_handler)
+        self.logger.propagate = False
+        _attach_queue_handler(self.logger, name, self.paths['logs_dir'], log_level)
     
     def info(self, message: str):
         self.logger.info(message)
@@ -190,6 +234,9 @@ class Logger:
     def log_llm_call(self, step: str, prompt: str, response: str, 
                      tokens: Dict[str, int], cost: float, duration: float):
         """Log LLM API call details to main log."""
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        
         if self.log_config.get('log_prompts', True):
             self.info(f"[{step}] Prompt:\n{prompt[:500]}..." if len(prompt) > 500 else f"[{step}] Prompt:\n{prompt}")
         
@@ -197,7 +244,9 @@ class Logger:
             self.info(f"[{step}] Response:\n{response[:500]}..." if len(response) > 500 else f"[{step}] Response:\n{response}")
         
         if self.log_config.get('log_tokens', True):
-            self.info(f"[{step}] Tokens - Input: {tokens.get('input', 0)}, Output: {tokens.get('output', 0)}, Total: {tokens.get('total', 0)}")
+            self.info(f"[{step}] Tokens - Input: {tokens.get('input', 0)} (cached {tokens.get('cached', 0)}), "
+                      f"Output: {tokens.get('output', 0)}, Thoughts: {tokens.get('thoughts', 0)}, Total: {tokens.get('total', 0)}"
+                      f"{' (estimated)' if tokens.get('estimated') else ''}")
         
         if self.log_config.get('log_cost', True):
             self.info(f"[{step}] Cost: ${cost:.4f}, Duration: {duration:.2f}s")
@@ -208,8 +257,11 @@ class Logger:
                        tokens: Optional[Dict[str, int]] = None, cost: Optional[float] = None,
                        duration: Optional[float] = None, model: Optional[str] = None):
         """
-        Log individual LLM request to separate file.
-        File naming: {task_name}_batch{batch_id}_chapter{chapter_id}_{timestamp}.txt
+        Log individual LLM request.
+        
+        With logging.llm_request_format "jsonl" (default) the record is appended to the
+        compressed segment log in llm_logs_dir by a background writer; with "txt" it is
+        written to its own file {task_name}_batch{batch_id}_chapter{chapter_id}_{timestamp}.txt
         
         Args:
             task_name: Name of the task (outline_generation, chapter_writing, etc.)
@@ -224,6 +276,25 @@ class Logger:
             duration: Call duration in seconds
             model: Model name used
         """
+        if self.log_config.get('llm_request_format', 'jsonl') == 'jsonl':
+            # Queued for the background writer (see src/llm_log_sink.py); no file I/O on this thread
+            self._llm_log_sink().write({
+                'timestamp': datetime.now().isoformat(),
+                'project_id': self.project_id,
+                'task': task_name,
+                'batch': batch_id,
+                'chapter': chapter_id,
+                'model': model,
+                'system_prompt': system_prompt,
+                'user_prompt': user_prompt,
+                'response': response or None,
+                'error': error,
+                'tokens': tokens,
+                'cost': cost,
+                'duration': duration
+            })
+            return
+        
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
         
         # Build filename
@@ -280,6 +351,8 @@ class Logger:
         if tokens:
             log_lines.append(f"Input Tokens: {tokens.get('input', 0)}")
             log_lines.append(f"Output Tokens: {tokens.get('output', 0)}")
+            log_lines.append(f"Thoughts Tokens: {tokens.get('thoughts', 0)}")
+            log_lines.append(f"Cached Tokens: {tokens.get('cached', 0)}")
             log_lines.append(f"Total Tokens: {tokens.get('total', 0)}")
         if cost is not None:
             log_lines.append(f"Cost: ${cost:.4f}")
@@ -294,6 +367,15 @@ class Logger:
             self.debug(f"Saved LLM request log to: {filepath}")
         except Exception as e:
             self.error(f"Failed to save LLM request log: {e}")
+    
+    def _llm_log_sink(self):
+        from src.llm_log_sink import get_llm_log_sink
+        return get_llm_log_sink(
+            self.paths['llm_logs_dir'],
+            segment_max_mb=self.log_config.get('llm_log_segment_mb', 64),
+            queue_size=self.log_config.get('llm_log_queue_size', 1000)
+        )
+    
     def log_llm_error(self, task_name: str, system_prompt: str, user_prompt: str,
                      error: str, batch_id: Optional[int] = None, 
                      chapter_id: Optional[int] = None, model: Optional[str] = None):
@@ -323,45 +405,74 @@ class CostTracker:
         self.pricing = config.get('cost_tracking', {}).get('pricing', {})
         self.enabled = config.get('cost_tracking', {}).get('enabled', True)
         self.total_cost = 0.0
-        self.total_tokens = {'input': 0, 'output': 0, 'total': 0}
+        self.total_tokens = {'input': 0, 'output': 0, 'thoughts': 0, 'cached': 0, 'total': 0}
         self.calls = []
+        self._lock = threading.Lock()
+    
+    def _model_pricing(self, model: str) -> Dict[str, float]:
+        """Pricing entry of a model: exact name, else the longest configured prefix (e.g. dated previews)."""
+        if model in self.pricing:
+            return self.pricing[model]
+        prefixes = [name for name in self.pricing if model.startswith(name)]
+        return self.pricing[max(prefixes, key=len)] if prefixes else {}
+    
+    def calculate_cost(self, model: str, input_tokens: int, output_tokens: int,
+                       thoughts_tokens: int = 0, cached_tokens: int = 0) -> float:
+        """
+        Cost in USD from the cost_tracking.pricing table (USD per 1M tokens).
+        
+        Cached prompt tokens (part of input_tokens) use `cached_input` when the model
+        has one; thinking tokens are billed at the output price.
+        """
+        model_pricing = self._model_pricing(model)
+        input_price = model_pricing.get('input', 0.0)
+        cached_price = model_pricing.get('cached_input', input_price)
+        output_price = model_pricing.get('output', 0.0)
+        cached_tokens = min(cached_tokens, input_tokens)
+        return ((input_tokens - cached_tokens) * input_price
+                + cached_tokens * cached_price
+                + (output_tokens + thoughts_tokens) * output_price) / 1_000_000
     
     def add_call(self, model: str, input_tokens: int, output_tokens: int, 
-                 step: str = "", duration: float = 0.0):
-        """Add an API call to the tracker."""
+                 step: str = "", duration: float = 0.0,
+                 thoughts_tokens: int = 0, cached_tokens: int = 0):
+        """Add an API call to the tracker; returns its cost."""
         if not self.enabled:
             return 0.0
         
-        model_pricing = self.pricing.get(model, {'input': 0.0, 'output': 0.0})
-        input_cost = (input_tokens / 1000) * model_pricing.get('input', 0.0)
-        output_cost = (output_tokens / 1000) * model_pricing.get('output', 0.0)
-        total_cost = input_cost + output_cost
-        
-        self.total_cost += total_cost
-        self.total_tokens['input'] += input_tokens
-        self.total_tokens['output'] += output_tokens
-        self.total_tokens['total'] += (input_tokens + output_tokens)
+        total_cost = self.calculate_cost(model, input_tokens, output_tokens, thoughts_tokens, cached_tokens)
         
-        self.calls.append({
-            'timestamp': datetime.now().isoformat(),
-            'step': step,
-            'model': model,
-            'input_tokens': input_tokens,
-            'output_tokens': output_tokens,
-            'cost': total_cost,
-            'duration': duration
-        })
+        with self._lock:
+            self.total_cost += total_cost
+            self.total_tokens['input'] += input_tokens
+            self.total_tokens['output'] += output_tokens
+            self.total_tokens['thoughts'] += thoughts_tokens
+            self.total_tokens['cached'] += cached_tokens
+            self.total_tokens['total'] += (input_tokens + output_tokens + thoughts_tokens)
+            
+            self.calls.append({
+                'timestamp': datetime.now().isoformat(),
+                'step': step,
+                'model': model,
+                'input_tokens': input_tokens,
+                'output_tokens': output_tokens,
+                'thoughts_tokens': thoughts_tokens,
+                'cached_tokens': cached_tokens,
+                'cost': total_cost,
+                'duration': duration
+            })
         
         return total_cost
     
     def get_summary(self) -> Dict[str, Any]:
         """Get cost and usage summary."""
-        return {
-            'total_cost': self.total_cost,
-            'total_tokens': self.total_tokens,
-            'total_calls': len(self.calls),
-            'calls': self.calls
-        }
+        with self._lock:
+            return {
+                'total_cost': self.total_cost,
+                'total_tokens': dict(self.total_tokens),
+                'total_calls': len(self.calls),
+                'calls': list(self.calls)
+            }
     
     def save_summary(self, file_path: str):
         """Save cost summary to file."""
@@ -0,0 +1,25 @@
+"""Shared fixtures: repo root on sys.path and a config writing into a temp directory."""
+import os
+import sys
+
+import pytest
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.utils import stop_log_listeners  # noqa: E402
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    """The repo config with project data redirected into a temp directory."""
+    with open(os.path.join(ROOT, 'config', 'config.yaml'), 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    config['paths']['projects_base_dir'] = str(tmp_path / 'projects')
+    config['paths']['motif_file'] = os.path.join(ROOT, config['paths']['motif_file'])
+    path = tmp_path / 'config.yaml'
+    path.write_text(yaml.safe_dump(config, allow_unicode=True), encoding='utf-8')
+    yield str(path)
+    # Log handlers hold this test's captured stderr and temp files
+    stop_log_listeners()
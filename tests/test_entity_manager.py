@@ -0,0 +1,21 @@
+from src.checkpoint import CheckpointManager
+from src.entity_manager import EntityManager
+
+
+class _Logger:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def test_entities_new_in_chapter_get_its_mentions_counted(tmp_path):
+    paths = {'entities_dir': str(tmp_path / 'entities')}
+    manager = EntityManager(None, CheckpointManager(str(tmp_path / 'checkpoints'), 'story'),
+                            _Logger(), {}, paths)
+    chapter = "Lâm Phong rút kiếm. Lâm Phong bước vào Thanh Vân Tông."
+
+    manager.record_chapter_entities({'characters': [{'name': 'Lâm Phong', 'description': 'kiếm khách'}]},
+                                    3, chapter)
+
+    [entity] = manager.entities['characters']
+    assert entity['mention_count'] == 2
+    assert entity['appear_in_chapters'] == [3]
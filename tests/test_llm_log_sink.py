@@ -0,0 +1,20 @@
+from src.llm_log_sink import LLMLogSink, close_all_sinks, get_llm_log_sink, iter_records
+
+
+def test_write_after_close_is_appended_directly(tmp_path):
+    sink = LLMLogSink(str(tmp_path))
+    sink.write({'task': 'outline_generation', 'response': 'a'})
+    sink.close()
+
+    sink.write({'task': 'summary_generation', 'response': 'b'})
+
+    assert [r['task'] for r in iter_records(str(tmp_path))] == ['outline_generation', 'summary_generation']
+
+
+def test_late_writes_after_close_all_sinks_reuse_the_closed_sink(tmp_path):
+    sink = get_llm_log_sink(str(tmp_path))
+    close_all_sinks()
+
+    assert get_llm_log_sink(str(tmp_path)) is sink
+    sink.write({'task': 'description_compaction'})
+    assert [r['task'] for r in iter_records(str(tmp_path))] == ['description_compaction']
@@ -0,0 +1,15 @@
+"""StoryGenerator context assembly."""
+from main import StoryGenerator
+
+
+def test_batch_context_uses_registry_conflict_selection(config_path):
+    generator = StoryGenerator(config_path=config_path, project_id='smoke')
+    registry = generator.post_processor.conflict_registry
+    for i, timeline in enumerate(['immediate', 'short_term', 'short_term', 'short_term', 'epic']):
+        registry.add({'id': f'c{i}', 'timeline': timeline, 'description': '...'}, chapter_num=i + 1)
+    registry.update('c0', 6, status='resolved')
+
+    context = generator._prepare_batch_context(2)
+
+    # Resolved c0 is gone; two of the short-term conflicts, plus the epic one for awareness
+    assert [c['id'] for c in context['active_conflicts']] == ['c1', 'c2', 'c4']
@@ -0,0 +1,18 @@
+from src.mention_scanner import MentionScanner
+
+
+def test_shorter_alias_matches_when_longer_one_fails_the_boundary():
+    scanner = MentionScanner()
+    scanner.add_entity('lam_phong', ['Lâm Phong', 'Lâm', 'Phong'])
+
+    # "mộclâm phong": the full name starts mid-word, but "phong" is a whole word
+    assert scanner.scan("Mộclâm Phong bước tới.") == {'lam_phong': 1}
+    assert scanner.scan("Lâm Phong và Lâm.") == {'lam_phong': 2}
+
+
+def test_partial_words_do_not_match():
+    scanner = MentionScanner()
+    scanner.add_entity('an', ['An'])
+    scanner.add_entity('binh_an', ['Bình An'])
+
+    assert scanner.scan("Bình an vô sự, anh ta nói.") == {'an': 1, 'binh_an': 1}
@@ -0,0 +1,27 @@
+from src.checkpoint import CheckpointManager
+from src.post_processor import PostChapterProcessor
+
+
+class _Logger:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class _LLM:
+    def call(self, **kwargs):
+        return {'response': f"Tóm tắt đến chương {kwargs['chapter_id']}"}
+
+
+def test_super_summary_is_stored_once_not_per_chapter(tmp_path):
+    paths = {key: str(tmp_path / key) for key in ('events_dir', 'conflicts_dir', 'summaries_dir')}
+    checkpoint = CheckpointManager(str(tmp_path / 'checkpoints'), 'story')
+    processor = PostChapterProcessor(_LLM(), checkpoint, _Logger(), {}, paths)
+    processor.summaries = [{'chapter': 1, 'summary': 'a'}, {'chapter': 2, 'summary': 'b'}]
+
+    processor.update_super_summary(1)
+    processor.update_super_summary(2)
+
+    assert checkpoint.get_metadata('super_summary') == "Tóm tắt đến chương 2"
+    assert checkpoint.get_metadata('super_summary_chapter') == 2
+    assert checkpoint.get_step_metadata('super_summary_update_1', chapter=1) == {'super_summary_chapter': 1}
+    assert processor.update_super_summary(2) == "Tóm tắt đến chương 2"
@@ -0,0 +1,169 @@
+import sqlite3
+
+from src.checkpoint import CheckpointManager
+from src.project_store import SQLiteProjectStore
+
+
+def _committed_events(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+
+def test_chapter_writes_commit_together_with_checkpoint_marks(tmp_path):
+    db_path = str(tmp_path / "project.db")
+    store = SQLiteProjectStore(db_path)
+    checkpoint = CheckpointManager(str(tmp_path / "checkpoints"), "story")
+
+    checkpoint.hold_chapter(1)
+    store.begin_chapter(1)
+    store.add_events([{'chapter': 1, 'description': 'a'}])
+    checkpoint.mark_step_completed("event_extraction_1", chapter=1)
+    store.put_summaries([{'chapter': 1, 'summary': 's'}])
+
+    # Nothing reaches disk while the chapter is open
+    assert _committed_events(db_path) == 0
+    assert checkpoint.is_step_completed("event_extraction_1", chapter=1)
+    assert not CheckpointManager(str(tmp_path / "checkpoints"), "story").is_step_completed("event_extraction_1")
+
+    checkpoint.release_chapters(store.end_chapter(1))
+
+    assert _committed_events(db_path) == 1
+    assert CheckpointManager(str(tmp_path / "checkpoints"), "story").is_step_completed("event_extraction_1")
+    store.close()
+
+
+def test_overlapping_chapters_commit_when_last_one_ends(tmp_path):
+    db_path = str(tmp_path / "project.db")
+    store = SQLiteProjectStore(db_path)
+    store.begin_chapter(1)
+    store.begin_chapter(2)
+    store.add_events([{'chapter': 1}, {'chapter': 2}])
+
+    assert store.end_chapter(1) == []
+    assert _committed_events(db_path) == 0
+    assert store.end_chapter(2) == [1, 2]
+    assert _committed_events(db_path) == 2
+    store.close()
+
+
+def test_failed_write_block_is_rolled_back_inside_open_chapter(tmp_path):
+    store = SQLiteProjectStore(str(tmp_path / "project.db"))
+    store.begin_chapter(1)
+    store.add_events([{'chapter': 1}])
+    try:
+        with store.transaction() as conn:
+            conn.execute("INSERT INTO summaries (chapter, summary) VALUES (1, 's')")
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    store.end_chapter(1)
+
+    assert len(store.load_events()) == 1
+    assert store.load_summaries() == []
+    store.close()
+
+
+def test_import_merges_entities_with_colliding_names(tmp_path):
+    from src.utils import save_json
+    paths = {key: str(tmp_path / key) for key in ('entities_dir', 'events_dir', 'conflicts_dir', 'summaries_dir')}
+    save_json({'characters': [
+        {'name': 'Lâm Phong', 'description': 'kiếm khách', 'appear_in_chapters': [1]},
+        {'name': 'lâm  phong', 'description': ['đệ tử'], 'appear_in_chapters': [3]},
+    ]}, str(tmp_path / 'entities_dir' / 'entities.json'))
+    store = SQLiteProjectStore(str(tmp_path / "project.db"))
+
+    merges = store.import_json(paths)
+
+    [entity] = store.load_entities()['characters']
+    assert len(merges) == 1
+    assert entity['name'] == 'Lâm Phong'
+    assert entity['appear_in_chapters'] == [1, 3]
+    assert entity['description'] == ['kiếm khách', 'đệ tử']
+    assert entity['aliases'] == ['lâm  phong']
+    store.close()
+
+
+def test_opening_old_database_recomputes_name_norm(tmp_path):
+    db_path = str(tmp_path / "project.db")
+    SQLiteProjectStore(db_path).close()
+    with sqlite3.connect(db_path) as conn:
+        # Keys written by an older normalizer, which kept titles
+        conn.executemany(
+            "INSERT INTO entities (category, name, name_norm, position, data) VALUES ('characters', ?, ?, ?, ?)",
+            [('Lăng Hàn', 'lăng hàn', 0, '{"name": "Lăng Hàn", "appear_in_chapters": [1]}'),
+             ('Trưởng lão Lăng Hàn', 'trưởng lão lăng hàn', 1,
+              '{"name": "Trưởng lão Lăng Hàn", "appear_in_chapters": [2]}')]
+        )
+        conn.execute("PRAGMA user_version = 1")
+
+    store = SQLiteProjectStore(db_path)
+
+    [entity] = store.load_entities()['characters']
+    assert entity['appear_in_chapters'] == [1, 2]
+    assert entity['aliases'] == ['Trưởng lão Lăng Hàn']
+    # Appearance rows are rebuilt for the merged entity
+    assert [e['name'] for e in store.entities_in_chapter(2)['characters']] == ['Lăng Hàn']
+    store.close()
+
+
+def test_indexed_queries_return_matching_rows(tmp_path):
+    store = SQLiteProjectStore(str(tmp_path / "project.db"))
+    store.upsert_entities([
+        ('characters', {'name': 'Lâm Phong', 'appear_in_chapters': [1, 2]}),
+        ('characters', {'name': 'Tô Yên', 'appear_in_chapters': [2]}),
+        ('locations', {'name': 'Thanh Vân Tông', 'appear_in_chapters': [1]}),
+    ])
+    store.add_events([
+        {'chapter': 1, 'importance': 0.4, 'characters_involved': ['Lâm Phong'], 'entities_involved': []},
+        {'chapter': 2, 'importance': 0.9, 'characters_involved': ['Tô Yên'],
+         'entities_involved': ['Thanh Vân Tông']},
+        {'chapter': 3, 'importance': 0.7, 'characters_involved': ['Trưởng lão Lâm Phong']},
+    ])
+    store.upsert_conflicts([
+        {'id': 'c1', 'status': 'active', 'timeline': 'immediate'},
+        {'id': 'c2', 'status': 'resolved', 'timeline': 'immediate'},
+        {'id': 'c3', 'status': 'active', 'timeline': 'long_term'},
+    ])
+
+    in_chapter_2 = store.entities_in_chapter(2)
+    assert [e['name'] for e in in_chapter_2['characters']] == ['Lâm Phong', 'Tô Yên']
+    assert 'locations' not in in_chapter_2
+    assert list(store.entities_in_chapter(1, ['locations'])) == ['locations']
+    assert store.find_entity('lâm phong')['category'] == 'characters'
+
+    assert [e['chapter'] for e in store.events_by_chapter(2, 3)] == [2, 3]
+    assert [e['chapter'] for e in store.events_by_participants(5, characters=['Lâm Phong'])] == [3, 1]
+    assert [e['chapter'] for e in store.events_by_participants(5, entities=['Thanh Vân Tông'])] == [2]
+    # Roles are kept apart: a character name does not match entities_involved
+    assert store.events_by_participants(5, characters=['Thanh Vân Tông']) == []
+
+    assert [c['id'] for c in store.conflicts_by_status('active')] == ['c1', 'c3']
+    assert [c['id'] for c in store.conflicts_by_status('active', 'immediate')] == ['c1']
+    store.close()
+
+
+def test_processor_and_entity_lookups_use_the_store(tmp_path):
+    from src.entity_manager import EntityManager
+    from src.post_processor import PostChapterProcessor
+
+    class Logger:
+        def __getattr__(self, name):
+            return lambda *args, **kwargs: None
+
+    store = SQLiteProjectStore(str(tmp_path / "project.db"))
+    store.upsert_entities([('characters', {'name': 'Lâm Phong', 'appear_in_chapters': [4]})])
+    store.add_events([{'chapter': 4, 'importance': 1, 'characters_involved': ['Lâm Phong']}])
+    store.upsert_conflicts([{'id': 'c1', 'status': 'active', 'timeline': 'batch'}])
+    paths = {key: str(tmp_path / key) for key in ('entities_dir', 'events_dir', 'conflicts_dir', 'summaries_dir')}
+    checkpoint = CheckpointManager(str(tmp_path / "checkpoints"), "story")
+    entities = EntityManager(None, checkpoint, Logger(), {}, paths, store=store)
+    processor = PostChapterProcessor(None, checkpoint, Logger(), {}, paths, store=store)
+    # Lookups must come from the database, not the lists loaded at start-up
+    store.upsert_conflicts([{'id': 'c2', 'status': 'active', 'timeline': 'batch'}])
+    store.add_events([{'chapter': 5, 'importance': 2, 'characters_involved': ['Lâm Phong']}])
+
+    assert [e['name'] for e in entities.get_entities_by_chapter(4)['characters']] == ['Lâm Phong']
+    assert [c['id'] for c in processor.get_conflicts_by_timeline('batch')] == ['c1', 'c2']
+    assert [e['chapter'] for e in processor.get_top_events(5, characters=['Lâm Phong'])] == [5, 4]
+    assert [e['chapter'] for e in processor.get_events_by_chapter_range(5, 5)] == [5]
+    store.close()
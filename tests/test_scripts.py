@@ -0,0 +1,51 @@
+"""Smoke tests for the scripts.py command line."""
+import argparse
+import os
+import sys
+
+import scripts
+from src.utils import stop_log_listeners
+
+
+def test_export_subcommand_dispatches(capsys, monkeypatch, config_path):
+    monkeypatch.setattr(sys, 'argv', ['scripts.py', 'export', '--story-id', 'smoke', '--config', config_path])
+    scripts.main()
+    stop_log_listeners()  # flush console output while capsys still captures it
+    assert "✓" in capsys.readouterr().out
+
+
+def test_make_generator_attaches_replay_index(config_path):
+    args = argparse.Namespace(config=config_path, story_id='smoke', replay_from='recorded')
+    generator = scripts._make_generator(args)
+    assert generator.project_id == 'smoke'
+    assert generator.llm_client.replay is not None
+
+
+def test_rebuild_keeps_copied_chapters(monkeypatch, config_path):
+    from src.llm_replay import ReplayIndex
+    from src.utils import load_config, get_project_paths, ensure_project_directories, save_json
+
+    config = load_config(config_path)
+    ensure_project_directories('recorded', config)
+    paths = get_project_paths('recorded', config)
+    save_json({'chapters': [{'chapter_number': 1, 'title': 'Khởi đầu', 'summary': '...'}]},
+              os.path.join(paths['outlines_dir'], 'batch_1_outline.json'))
+    chapter_file = os.path.join(paths['chapters_dir'], 'chapter_001.txt')
+    with open(chapter_file, 'w', encoding='utf-8') as f:
+        f.write("Nội dung gốc của chương 1.")
+
+    lookups = []
+
+    def lookup(self, system_prompt, user_prompt, task_name=None, batch_id=None, chapter_id=None):
+        lookups.append(task_name)
+        return "{}"
+
+    monkeypatch.setattr(ReplayIndex, 'lookup', lookup)
+    scripts.run_rebuild(argparse.Namespace(config=config_path, story_id='recorded', into=None))
+    stop_log_listeners()
+
+    rebuilt = os.path.join(get_project_paths('recorded_rebuild', config)['chapters_dir'], 'chapter_001.txt')
+    with open(rebuilt, 'r', encoding='utf-8') as f:
+        assert f.read() == "Nội dung gốc của chương 1."
+    assert lookups and 'chapter_writing' not in lookups
+